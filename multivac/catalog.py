@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+
+""" SQLite catalog of workflow runs, jobs and test outcomes stored
+    by fetch.py.
+
+    The catalog is `<owner>/<repo>/catalog.sqlite`. fetch.py keeps
+    it up to date, the reporting scripts query it instead of
+    globbing and reading all the job meta files. If there is no
+    catalog, they fall back to the files.
+
+    Times are stored as GitHub gives them (`2021-06-10T13:10:38Z`),
+    so they are compared as strings.
+"""
+
+import argparse
+import glob
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_DIR)
+from multivac.sensors import test_status  # noqa: E402
+from multivac.storage import Layout, find_log  # noqa: E402
+
+
+CATALOG_FILENAME = 'catalog.sqlite'
+SCHEMA_VERSION = 3
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS workflow_runs (
+    id INTEGER PRIMARY KEY,
+    head_branch TEXT,
+    status TEXT,
+    conclusion TEXT,
+    created_at TEXT,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS workflow_runs_branch
+    ON workflow_runs (head_branch, created_at);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL,
+    name TEXT,
+    head_branch TEXT,
+    head_sha TEXT,
+    status TEXT,
+    conclusion TEXT,
+    labels TEXT,
+    runner_name TEXT,
+    html_url TEXT,
+    created_at TEXT,
+    started_at TEXT,
+    completed_at TEXT,
+    log_path TEXT,
+    log_offset INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_run ON jobs (run_id);
+CREATE INDEX IF NOT EXISTS jobs_branch ON jobs (head_branch, started_at);
+CREATE INDEX IF NOT EXISTS jobs_started ON jobs (started_at);
+CREATE INDEX IF NOT EXISTS jobs_conclusion ON jobs (conclusion);
+
+CREATE TABLE IF NOT EXISTS test_outcomes (
+    job_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    test TEXT,
+    conf TEXT,
+    status TEXT,
+    PRIMARY KEY (job_id, seq)
+);
+CREATE INDEX IF NOT EXISTS test_outcomes_test
+    ON test_outcomes (test, status);
+
+-- The 'complete' key is set once all the stored workflow runs are
+-- added by Catalog.rebuild().
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+# Statements to upgrade the schema from the given version to the
+# next one.
+MIGRATIONS = {
+    1: ['ALTER TABLE jobs ADD COLUMN log_offset INTEGER'],
+    # A catalog of an older version is considered complete.
+    2: ['CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)',
+        "INSERT OR REPLACE INTO meta VALUES ('complete', '1')"],
+}
+
+RUN_COLUMNS = ('id', 'head_branch', 'status', 'conclusion', 'created_at',
+               'updated_at')
+JOB_COLUMNS = ('id', 'run_id', 'name', 'head_branch', 'head_sha', 'status',
+               'conclusion', 'labels', 'runner_name', 'html_url',
+               'created_at', 'started_at', 'completed_at', 'log_path',
+               'log_offset')
+
+
+def catalog_path(repo_path):
+    return os.path.join(repo_path, CATALOG_FILENAME)
+
+
+class Catalog:
+    """ Connection to the catalog of the given repository storage.
+
+        The object may be shared between threads: writes are
+        serialized by a lock. Each write is a transaction, so a
+        killed fetch.py doesn't leave a half of a workflow run in
+        the catalog.
+
+        A new catalog is not `complete` till rebuild() adds all the
+        stored workflow runs to it. An incomplete catalog (say, its
+        rebuild was interrupted) is not used by the reporting scripts
+        and is rebuilt by fetch.py.
+    """
+
+    def __init__(self, repo_path):
+        self.repo_path = repo_path
+        self.path = catalog_path(repo_path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        # Readers don't block the writer and vice versa.
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        version = self._conn.execute('PRAGMA user_version').fetchone()[0]
+        if version not in (0, SCHEMA_VERSION) and version not in MIGRATIONS:
+            raise RuntimeError('Unknown catalog schema version {}: {}'.format(
+                version, self.path))
+        with self._conn:
+            while version in MIGRATIONS:
+                for statement in MIGRATIONS[version]:
+                    self._conn.execute(statement)
+                version += 1
+            self._conn.executescript(SCHEMA)
+            self._conn.execute('PRAGMA user_version={}'.format(
+                SCHEMA_VERSION))
+
+    @classmethod
+    def open_existing(cls, repo_path, incomplete=False):
+        """ Open the catalog if it exists and is complete (or
+            `incomplete` is set), return None otherwise.
+        """
+        if not os.path.isfile(catalog_path(repo_path)):
+            return None
+        catalog = cls(repo_path)
+        if not incomplete and not catalog.complete:
+            catalog.close()
+            return None
+        return catalog
+
+    @property
+    def complete(self):
+        """ Whether all the stored workflow runs are added. """
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT 1 FROM meta WHERE key = 'complete'")
+            return cursor.fetchone() is not None
+
+    def close(self):
+        self._conn.close()
+
+    def _run_row(self, run):
+        return tuple(run.get(column) for column in RUN_COLUMNS)
+
+    def _job_row(self, job, log_path):
+        row = dict(job)
+        row['labels'] = json.dumps(job.get('labels', []))
+        row['log_path'] = log_path
+        # Set if only the end of the log is stored.
+        row['log_offset'] = job.get('multivac', {}).get('log_offset')
+        return tuple(row.get(column) for column in JOB_COLUMNS)
+
+    def put_run(self, run, jobs):
+        """ Add or update the workflow run and its jobs.
+
+            `run` is the workflow run meta. `jobs` are (job meta,
+            log path, test statuses) tuples: the log path is relative
+            to the repository storage or None if there is no log,
+            test statuses are (test, conf, status) tuples given by
+            the `test_status` sensor or None to keep ones stored
+            before.
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO workflow_runs VALUES ({})'.format(
+                    ', '.join('?' * len(RUN_COLUMNS))), self._run_row(run))
+            for job, log_path, test_statuses in jobs:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO jobs VALUES ({})'.format(
+                        ', '.join('?' * len(JOB_COLUMNS))),
+                    self._job_row(job, log_path))
+                if test_statuses is None:
+                    continue
+                self._conn.execute(
+                    'DELETE FROM test_outcomes WHERE job_id = ?',
+                    (job['id'],))
+                self._conn.executemany(
+                    'INSERT INTO test_outcomes VALUES (?, ?, ?, ?, ?)',
+                    [(job['id'], seq, test, conf, status)
+                     for seq, (test, conf, status)
+                     in enumerate(test_statuses)])
+
+    def has_run(self, run_id):
+        """ Whether the workflow run is in the catalog. """
+        # Other threads may run put_run() transactions on the same
+        # connection.
+        with self._lock:
+            cursor = self._conn.execute(
+                'SELECT 1 FROM workflow_runs WHERE id = ?', (int(run_id),))
+            return cursor.fetchone() is not None
+
+    def jobs(self, branches=None, started_since=None, with_log=False,
+             exclude_conclusions=(), limit=None):
+        """ Yield job meta dictionaries from fresh jobs toward older
+            ones (by job ID).
+
+            Only fields stored in the catalog are there (see
+            JOB_COLUMNS), `log_path` is relative to the repository
+            storage. `log_offset` of a truncated log is given in
+            `multivac` as in the job meta file.
+
+            `branches` are branches of the workflow runs (older job
+            metas have no `head_branch`), the branch of the run is
+            given in `run_branch`.
+        """
+        conditions = []
+        params = []
+        if branches is not None:
+            conditions.append('workflow_runs.head_branch IN ({})'.format(
+                ', '.join('?' * len(branches))))
+            params.extend(branches)
+        if started_since is not None:
+            conditions.append('jobs.started_at >= ?')
+            params.append(started_since)
+        if with_log:
+            conditions.append('jobs.log_path IS NOT NULL')
+        if exclude_conclusions:
+            conditions.append('jobs.conclusion NOT IN ({})'.format(
+                ', '.join('?' * len(exclude_conclusions))))
+            params.extend(exclude_conclusions)
+        query = 'SELECT jobs.*, workflow_runs.head_branch AS run_branch ' \
+            'FROM jobs LEFT JOIN workflow_runs ' \
+            'ON workflow_runs.id = jobs.run_id'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY jobs.id DESC'
+        if limit:
+            query += ' LIMIT ?'
+            params.append(limit)
+        for row in self._conn.execute(query, params):
+            job = dict(row)
+            job['labels'] = json.loads(job['labels'])
+            log_offset = job.pop('log_offset')
+            if log_offset:
+                job['multivac'] = {'log_offset': log_offset}
+            yield job
+
+    def test_outcomes(self, job_id):
+        """ (test, conf, status) tuples of the job in the order
+            they're given by the `test_status` sensor or None if they
+            were not stored.
+        """
+        cursor = self._conn.execute(
+            'SELECT test, conf, status FROM test_outcomes WHERE job_id = ? '
+            'ORDER BY seq', (int(job_id),))
+        res = [tuple(row) for row in cursor]
+        if res:
+            return res
+        # There are no fails and passes at all or the outcomes
+        # are not stored: let the caller to look at the log.
+        return None
+
+    def rebuild(self):
+        """ Add all the workflow runs and jobs found in the storage
+            and mark the catalog as complete.
+
+            Return amount of jobs.
+        """
+        layout = Layout(self.repo_path)
+        jobs_per_run = {}
+        for job_meta_path in layout.glob_job_meta():
+            with open(job_meta_path, 'r') as f:
+                job = json.load(f)
+            log_path = layout.job_log_path(job['id'])
+            test_statuses = None
+            cache_filepath = test_status.get_cache_filepath(log_path)
+            if os.path.isfile(cache_filepath):
+                with open(cache_filepath, 'r') as f:
+                    test_statuses = [tuple(res) for res in json.load(f)]
+            if find_log(log_path) is None:
+                log_path = None
+            else:
+                log_path = layout.relpath(log_path)
+            jobs_per_run.setdefault(job['run_id'], []).append(
+                (job, log_path, test_statuses))
+
+        job_count = 0
+        for run_meta_path in glob.glob(
+                os.path.join(layout.workflow_runs_dir, '*[0-9].json')):
+            with open(run_meta_path, 'r') as f:
+                run = json.load(f)
+            jobs = jobs_per_run.pop(run['id'], [])
+            self.put_run(run, jobs)
+            job_count += len(jobs)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('complete', '1')")
+        return job_count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Create or update the catalog of the stored workflow '
+                    'runs and jobs')
+    parser.add_argument('repo_path', type=str, nargs='+',
+                        help='owner/repository')
+    args = parser.parse_args()
+
+    for repo_path in args.repo_path:
+        catalog = Catalog(repo_path)
+        job_count = catalog.rebuild()
+        catalog.close()
+        print('{}: {} jobs'.format(catalog.path, job_count))
@@ -4,109 +4,719 @@ import os
 import re
 import sys
 import argparse
+import hashlib
+import random
 import time
+import threading
 import requests
 import json
 import datetime
+import email.utils
+import logging
+import logging.handlers
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_DIR)
+from multivac import storage  # noqa: E402
+from multivac.catalog import Catalog  # noqa: E402
+from multivac.sensors import test_status  # noqa: E402
+from multivac.sensors.job_facts import JobFactsExtractor, \
+    get_facts_filepath  # noqa: E402
 
 parser = argparse.ArgumentParser(description='Download GitHub Actions logs')
-parser.add_argument('--branch', type=str,
-                    help='branch (all if omitted)')
+parser.add_argument('--branch', type=str, action='append',
+                    help='branch (may be passed several times, all if '
+                         'omitted)')
 parser.add_argument('--nologs', action='store_true',
                     help="Don't download logs")
 parser.add_argument('--nostop', action='store_true',
                     help="Continue till end or rate limit")
+parser.add_argument('--overlap', type=float, default=6,
+                    help="Re-list runs created this amount of hours before "
+                         "the previous crawl")
+parser.add_argument('--relist-interval', type=float, default=24,
+                    help="Re-list completed runs of the last two weeks "
+                         "once in this amount of hours")
+parser.add_argument('--nocache', action='store_true',
+                    help="Don't send conditional requests for workflow run "
+                         "and job lists")
 parser.add_argument('--since', type=int, default=1,
                     help="A workflow run list page to start from it")
-parser.add_argument('repo_path', type=str,
-                    help='owner/repository')
+parser.add_argument('--compress', choices=sorted(storage.COMPRESSIONS),
+                    help="Store logs compressed")
+parser.add_argument('--ingest', action='store_true',
+                    help="Extract facts from logs while they are downloaded "
+                         "and store them next to job meta")
+parser.add_argument('--tail-kib', type=int,
+                    help="Download only last N KiB of logs of successful "
+                         "jobs")
+parser.add_argument('--artifacts', action='store_true',
+                    help="Download artifacts of failed jobs")
+parser.add_argument('--artifact-workflow', type=str, action='append',
+                    help="Download artifacts only of runs of workflows "
+                         "matching this regexp (may be passed several "
+                         "times)")
+parser.add_argument('--artifact-max-size', type=int, default=512,
+                    help="Skip artifacts larger than N MiB")
+parser.add_argument('--artifact-workers', type=int, default=2,
+                    help="How many artifacts to download concurrently")
+parser.add_argument('--workers', type=int, default=4,
+                    help="How many workflow runs to download concurrently")
+parser.add_argument('--rate-limit-reserve', type=int, default=100,
+                    help="Spread the last N requests of the rate limit "
+                         "budget evenly till its reset")
+parser.add_argument('--api-url', type=str,
+                    default=os.getenv('MULTIVAC_GITHUB_API_URL',
+                                      'https://api.github.com'),
+                    help="GitHub API URL (say, a local stand-in for tests)")
+parser.add_argument('--log-level', choices=['info', 'debug', 'trace'],
+                    default='debug',
+                    help="debug.log verbosity: 'debug' adds requests and "
+                         "response statuses, 'trace' adds response headers "
+                         "and bodies")
+parser.add_argument('--log-max-size', type=int, default=64,
+                    help="Rotate debug.log when it reaches N MiB")
+parser.add_argument('repo_path', type=str, nargs='+',
+                    help='owner/repository (may be passed several times)')
 args = parser.parse_args()
-if '/' not in args.repo_path:
-    raise ValueError('repo_path must be in the form owner/repository')
-args.owner, args.repo = args.repo_path.split('/', 1)
+for repo_path in args.repo_path:
+    if '/' not in repo_path:
+        raise ValueError('repo_path must be in the form owner/repository')
+# Crawl each repository for each branch: owner/repository, branch.
+targets = [(repo_path, branch) for repo_path in args.repo_path
+           for branch in args.branch or [None]]
+if args.workers < 1:
+    raise ValueError('--workers must be a positive number')
+if args.tail_kib is not None and args.tail_kib < 1:
+    raise ValueError('--tail-kib must be a positive number')
+if args.artifact_workers < 1:
+    raise ValueError('--artifact-workers must be a positive number')
+artifact_workflow_res = [re.compile(regexp)
+                         for regexp in args.artifact_workflow or []]
+storage.check_compression(args.compress)
 
 token = os.getenv('MULTIVAC_GITHUB_TOKEN')
 assert token, 'MULTIVAC_GITHUB_TOKEN is not set in environ variables'
 
-pid = os.getpid()
 startup_time = datetime.datetime.now(datetime.timezone.utc)
 session = requests.Session()
 session.headers.update({
     'Accept': 'application/vnd.github.v3+json',
     'Authorization': 'token ' + token,
 })
-debug_log_fh = open('debug.log', 'a')
-workflow_runs_dir = f'{args.repo_path}/workflow_runs'
-workflow_run_jobs_dir = f'{args.repo_path}/workflow_run_jobs'
+# Each worker holds at most one connection at a time, each crawl
+# thread holds one more to walk the workflow run list.
+pool_maxsize = args.workers + len(targets)
+if args.artifacts:
+    pool_maxsize += args.artifact_workers
+adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_maxsize)
+session.mount('https://', adapter)
+session.mount('http://', adapter)
+
+# Response headers and bodies are logged only at this level.
+TRACE = 5
+logging.addLevelName(TRACE, 'TRACE')
+LOG_LEVELS = {
+    'info': logging.INFO,
+    'debug': logging.DEBUG,
+    'trace': TRACE,
+}
+# Response headers, which are logged on the debug level.
+DEBUG_HEADERS = (
+    'Content-Type',
+    'Content-Length',
+    'ETag',
+    'Retry-After',
+    'X-RateLimit-Remaining',
+    'X-RateLimit-Reset',
+    'X-RateLimit-Resource',
+)
+
+
+class LogMessage:
+    """ A log message, which is formatted only when it is going to
+        be written.
+    """
+
+    def __init__(self, fmt, args):
+        self.fmt = fmt
+        self.args = args
+
+    def __str__(self):
+        if not self.args:
+            return self.fmt
+        return self.fmt.format(*self.args)
+
+
+class JSONLinesFormatter(logging.Formatter):
+    """ Format a log record as a JSON object on its own line. """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc).isoformat(),
+            'pid': record.process,
+            'thread': record.threadName,
+            'level': record.levelname,
+            'msg': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        entry.update(getattr(record, 'fields', {}))
+        return json.dumps(entry, default=str)
+
+
+logger = logging.getLogger('multivac.fetch')
+logger.setLevel(LOG_LEVELS[args.log_level])
+debug_log_handler = logging.handlers.RotatingFileHandler(
+    'debug.log', maxBytes=args.log_max_size * 1024 * 1024, backupCount=4)
+debug_log_handler.setFormatter(JSONLinesFormatter())
+logger.addHandler(debug_log_handler)
+stderr_handler = logging.StreamHandler(sys.stderr)
+stderr_handler.setLevel(logging.INFO)
+logger.addHandler(stderr_handler)
+overlap = datetime.timedelta(hours=args.overlap)
+relist_interval = datetime.timedelta(hours=args.relist_interval)
+# Unlikely somebody will restart older runs.
+RERUN_HORIZON = datetime.timedelta(weeks=2)
+# Artifacts of failed jobs are downloaded in this pool, see
+# download_artifacts().
+artifact_executor = None
+if args.artifacts:
+    artifact_executor = ThreadPoolExecutor(
+        max_workers=args.artifact_workers, thread_name_prefix='artifact')
+# Workflow run statuses that mean 'not finished yet'.
+ACTIVE_STATUSES = ('queued', 'in_progress', 'waiting')
+
+
+class RateLimitScheduler:
+    """ Decide when a next GitHub API request may be sent.
+
+        Requests go at full speed while the primary rate limit
+        budget (X-RateLimit-Remaining) is above the reserve. The
+        reserve is spread evenly till the budget reset time
+        (X-RateLimit-Reset). When the budget is exhausted or a
+        secondary rate limit is hit, all requests are postponed
+        till the reset time or for Retry-After seconds.
+
+        https://docs.github.com/en/rest/using-the-rest-api/rate-limits-for-the-rest-api
+    """
+    # Exponential backoff parameters for server errors and
+    # secondary rate limits without a Retry-After header.
+    BACKOFF_BASE = 0.5
+    BACKOFF_CAP = 60
+    SECONDARY_LIMIT_BACKOFF_BASE = 60
+    SECONDARY_LIMIT_BACKOFF_CAP = 15 * 60
+
+    def __init__(self, reserve):
+        self.reserve = reserve
+        self._lock = threading.Lock()
+        self._remaining = None
+        self._reset = None
+        self._blocked_until = 0
+        self._next_at = 0
+
+    def acquire(self):
+        """ Block until a next request may be sent. """
+        with self._lock:
+            now = time.time()
+            start = max(now, self._blocked_until)
+            if self._reset is not None and self._reset <= start:
+                # The budget is refilled at the reset time.
+                self._remaining = None
+                self._reset = None
+            if self._remaining is not None:
+                if self._remaining <= 0:
+                    # Other threads wait for the reset too.
+                    start = self._reset + 1
+                    self._blocked_until = start
+                    self._remaining = None
+                    self._reset = None
+                elif self._remaining <= self.reserve:
+                    interval = (self._reset - start) / self._remaining
+                    start = max(start, self._next_at)
+                    self._next_at = start + interval
+                if self._remaining is not None:
+                    # Account the request before its response
+                    # arrives: other threads may ask meanwhile.
+                    self._remaining -= 1
+        delay = start - now
+        if delay > 1:
+            info('Rate limit: wait {:.0f} seconds (till {})', delay,
+                 datetime.datetime.fromtimestamp(
+                     start, datetime.timezone.utc).isoformat())
+        if delay > 0:
+            time.sleep(delay)
+
+    def update(self, response):
+        """ Actualize the budget from the response headers. """
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        reset = response.headers.get('X-RateLimit-Reset')
+        if remaining is None or reset is None:
+            return
+        remaining = int(remaining)
+        reset = int(reset)
+        with self._lock:
+            # Responses of concurrent requests may arrive out of
+            # order, so trust the smallest budget of the window.
+            if self._reset == reset and self._remaining is not None:
+                remaining = min(remaining, self._remaining)
+            self._remaining = remaining
+            self._reset = reset
+
+    def block(self, delay):
+        """ Postpone all requests for the given amount of seconds. """
+        with self._lock:
+            self._blocked_until = max(self._blocked_until,
+                                      time.time() + delay)
+
+    @staticmethod
+    def backoff(attempt, base, cap):
+        """ Exponential backoff with full jitter. """
+        return random.uniform(0, min(cap, base * 2 ** attempt))
+
+    @staticmethod
+    def parse_retry_after(value):
+        """ Seconds to wait by a Retry-After header value: either
+            an amount of seconds or an HTTP date.
+        """
+        try:
+            return int(value)
+        except ValueError:
+            pass
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+        return max(0, retry_at.timestamp() - time.time())
+
+    def retry_delay(self, response, attempt):
+        """ How long to wait before a retry of the failed request.
+
+            Return None if the request should not be retried.
+        """
+        status = response.status_code
+        retry_after = response.headers.get('Retry-After')
+        if retry_after is not None:
+            retry_after = self.parse_retry_after(retry_after)
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        reset = response.headers.get('X-RateLimit-Reset')
+
+        if status in (403, 429):
+            if retry_after is not None:
+                # Secondary rate limit.
+                delay = retry_after
+            elif remaining == '0' and reset is not None:
+                # Primary rate limit.
+                delay = max(0, int(reset) - time.time()) + 1
+            elif 'rate limit' in response.text.lower():
+                # Secondary rate limit without a hint when to retry.
+                delay = self.backoff(attempt + 1,
+                                     self.SECONDARY_LIMIT_BACKOFF_BASE,
+                                     self.SECONDARY_LIMIT_BACKOFF_CAP)
+            else:
+                # Just forbidden.
+                return None
+            self.block(delay)
+            return delay
+
+        if status // 100 == 5:
+            if retry_after is not None:
+                return retry_after
+            return self.backoff(attempt, self.BACKOFF_BASE,
+                                self.BACKOFF_CAP)
+
+        return None
+
+
+scheduler = RateLimitScheduler(args.rate_limit_reserve)
+
+
+class JSONResponse:
+    """ A response with a JSON body, which is parsed once.
+
+        Provides the subset of requests.Response API used by the
+        list downloaders.
+    """
+    status_code = 200
+
+    def __init__(self, url, headers, links, body):
+        self.url = url
+        self.headers = requests.structures.CaseInsensitiveDict(headers)
+        self.links = links
+        self._body = body
+
+    @classmethod
+    def from_cache(cls, entry):
+        """ A stored response, which is served instead of
+            '304 Not Modified'.
+        """
+        return cls(entry['url'], entry['headers'], entry['links'],
+                   entry['body'])
+
+    def json(self):
+        return self._body
+
+
+class ValidatorCache:
+    """ On-disk cache of ETag / Last-Modified validators along
+        with the response bodies.
+
+        GitHub answers '304 Not Modified' on a conditional request
+        if the resource was not changed and such a response is not
+        counted against the rate limit.
+
+        https://docs.github.com/en/rest/using-the-rest-api/best-practices-for-using-the-rest-api#use-conditional-requests-if-appropriate
+    """
+    # Drop entries, which were not refreshed for this time.
+    MAX_AGE = datetime.timedelta(days=30)
+
+    def __init__(self, dirpath):
+        self.dirpath = dirpath
+
+    def _path(self, url, params):
+        key = json.dumps([url, params], sort_keys=True)
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.dirpath, digest + '.json')
+
+    def get(self, url, params):
+        path = self._path(url, params)
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def put(self, url, params, response):
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return
+        entry = {
+            'url': url,
+            'params': params,
+            'etag': etag,
+            'last_modified': last_modified,
+            'headers': {
+                'Content-Type': response.headers.get('Content-Type'),
+            },
+            'links': response.links,
+            'body': response.json(),
+        }
+        with storage.atomic_write(self._path(url, params)) as f:
+            json.dump(entry, f)
+
+    def touch(self, url, params):
+        """ Mark the entry as fresh to keep it on prune(). """
+        os.utime(self._path(url, params))
+
+    def prune(self):
+        deadline = time.time() - self.MAX_AGE.total_seconds()
+        for entry in os.scandir(self.dirpath):
+            if entry.stat().st_mtime < deadline:
+                os.remove(entry.path)
+
+
+class Repository:
+    """ A GitHub repository and its data in the storage. """
+
+    def __init__(self, repo_path):
+        self.path = repo_path
+        self.owner, self.name = repo_path.split('/', 1)
+        self.api_url = '{}/repos/{}/{}'.format(
+            args.api_url.rstrip('/'), self.owner, self.name)
+        self.workflow_runs_dir = f'{repo_path}/workflow_runs'
+        self.workflow_run_jobs_dir = f'{repo_path}/workflow_run_jobs'
+        self.http_cache_dir = f'{repo_path}/http_cache'
+        self.checkpoints_dir = f'{repo_path}/checkpoints'
+        self.journal_dir = f'{repo_path}/journal'
+        self.layout = storage.Layout(repo_path)
+        self.validator_cache = None
+        if not args.nocache:
+            self.validator_cache = ValidatorCache(self.http_cache_dir)
+        self.catalog = None
+
+    def prepare(self):
+        """ Create the storage directories. Clean up after an
+            interrupted call.
+        """
+        if not os.path.isdir(self.workflow_runs_dir):
+            os.makedirs(self.workflow_runs_dir)
+        if not os.path.isdir(self.workflow_run_jobs_dir):
+            os.makedirs(self.workflow_run_jobs_dir)
+        # A new storage is sharded. An existing flat one is kept
+        # as is till it is migrated.
+        if not os.path.isfile(self.layout.marker_path):
+            with os.scandir(self.workflow_run_jobs_dir) as it:
+                if next(it, None) is None:
+                    self.layout.store(storage.Layout.SHARDED)
+        # Temporary files are left by an interrupted call. Such a
+        # call leaves a journal only if it is a crawl, so look for
+        # them anyway.
+        for dirpath in [self.workflow_runs_dir, self.http_cache_dir,
+                        self.checkpoints_dir,
+                        os.path.join(self.checkpoints_dir, 'branches'),
+                        self.journal_dir,
+                        os.path.join(self.journal_dir, 'branches')] + \
+                self.layout.job_dirs() + self.layout.artifact_dirs():
+            count = storage.remove_temp_files(dirpath)
+            if count:
+                info('Removed {} temporary files in {}', count, dirpath)
+        if self.validator_cache:
+            if not os.path.isdir(self.http_cache_dir):
+                os.makedirs(self.http_cache_dir)
+            self.validator_cache.prune()
+        self.catalog = Catalog(self.path)
+        # A new catalog or one, whose rebuild is interrupted.
+        if not self.catalog.complete:
+            info('Add stored workflow runs to the new catalog {}',
+                 self.catalog.path)
+            job_count = self.catalog.rebuild()
+            info('Added {} jobs to {}', job_count, self.catalog.path)
 
 
 def retry(http_get_function):
     def wrapper(*args, **kwargs):
         attempts = 10
-        while attempts:
+        for attempt in range(attempts):
             try:
                 return http_get_function(*args, **kwargs)
             except requests.exceptions.HTTPError as HTTPError:
-                if HTTPError.response.status_code // 100 == 4:
+                status = HTTPError.response.status_code
+                delay = scheduler.retry_delay(HTTPError.response, attempt)
+                if delay is None:
                     raise
-                attempts -= 1
-                time.sleep(0.5)
-                debug(f'Got {HTTPError.response.status_code} error. '
-                      f'{attempts}th attempt to retry...')
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.Timeout) as error:
+                status = type(error).__name__
+                delay = scheduler.backoff(attempt, scheduler.BACKOFF_BASE,
+                                          scheduler.BACKOFF_CAP)
+            info('Got {} error. Retry in {:.1f} seconds ({} of {} '
+                 'attempts left)...', status, delay, attempts - attempt - 1,
+                 attempts)
+            time.sleep(delay)
         raise StopIteration(
             "All 10 retry operation attempts exhausted.")
 
     return wrapper
 
 
-def timestamp():
-    """ Format current time according to ISO 8601 standard. """
-    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+def log(level, fmt, *args, exc_info=None, **fields):
+    """ Log the message formatted by str.format() on demand.
+
+        Keyword arguments are written as separate fields of the
+        debug.log entry. A traceback of `exc_info` (an exception or
+        True for the one being handled) goes to the `exc_info` field.
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, LogMessage(fmt, args), exc_info=exc_info,
+                   extra={'fields': fields})
 
 
-def debug(fmt, *args):
-    print('[{}] {} {}'.format(pid, timestamp(), fmt.format(*args)),
-          file=debug_log_fh)
+def trace(fmt, *args, **fields):
+    log(TRACE, fmt, *args, **fields)
 
 
-def info(fmt, *args):
-    debug(fmt, *args)
-    print(fmt.format(*args), file=sys.stderr)
+def debug(fmt, *args, **fields):
+    log(logging.DEBUG, fmt, *args, **fields)
 
 
-@retry
-def http_get(url, params=None):
-    """ HTTP GET with logging to debug.log.
+def info(fmt, *args, **fields):
+    """ Log to debug.log and to stderr. """
+    log(logging.INFO, fmt, *args, **fields)
 
-        Raise on a bad HTTP status.
+
+def send_get(url, params=None, headers=None, stream=False):
+    """ Send HTTP GET request when the rate limit allows it and
+        log the response status and headers.
     """
-    debug('HTTP GET: {}', url)
-
-    r = session.get(url, params=params)
-
-    debug('Response HTTP status: {}', r.status_code)
-    debug('Response headers:\n{}', json.dumps(dict(r.headers), indent=2))
-    content_type = r.headers.get('content-type')
-    if content_type:
-        if content_type.startswith('application/json'):
-            response_text = json.dumps(r.json(), indent=2)
-        elif content_type == 'application/zip' or content_type.startswith('text/plain'):
-            fmt = '[Don\'t log {} response.]'
-            response_text = fmt.format(content_type)
-        else:
-            fmt = '[Don\'t log response with unknown Content-Type: {}]'
-            response_text = fmt.format(content_type)
-        r.raise_for_status()
-    else:
-        response_text = '[EMPTY LOG!]'
+    scheduler.acquire()
+    debug('HTTP GET: {}', url, params=params)
 
-    debug('Response:\n{}', response_text)
+    r = session.get(url, params=params, headers=headers, stream=stream)
+    scheduler.update(r)
 
+    if logger.isEnabledFor(TRACE):
+        trace('Response HTTP status: {}', r.status_code, url=r.url,
+              status=r.status_code, headers=dict(r.headers))
+    else:
+        debug('Response HTTP status: {}', r.status_code, url=r.url,
+              status=r.status_code, headers={
+                  name: r.headers[name] for name in DEBUG_HEADERS
+                  if name in r.headers})
     return r
 
 
+class ResponseTooLarge(Exception):
+    pass
+
+
+@retry
+def http_get(url, params=None, cache=None):
+    """ HTTP GET of a JSON resource with logging to debug.log.
+
+        Raise on a bad HTTP status. Return JSONResponse.
+
+        If `cache` is provided, send a conditional request and
+        serve the stored response if the resource was not
+        modified.
+    """
+    headers = {}
+    entry = cache.get(url, params) if cache else None
+    if entry:
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+
+    r = send_get(url, params=params, headers=headers)
+
+    if r.status_code == 304 and entry:
+        debug('Not modified, use the cached response', url=url)
+        cache.touch(url, params)
+        return JSONResponse.from_cache(entry)
+
+    r.raise_for_status()
+    response = JSONResponse(r.url, r.headers, r.links, r.json())
+    trace('Response body', url=url, body=response.json())
+
+    if cache and r.status_code == 200:
+        cache.put(url, params, response)
+
+    return response
+
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-\d+/(?:\d+|\*)$')
+
+
+def response_offset(response):
+    """ Position of the response body in the whole resource: non-zero
+        for a partial content response.
+    """
+    if response.status_code != 206:
+        return 0
+    m = CONTENT_RANGE_RE.match(response.headers.get('Content-Range', ''))
+    if not m:
+        raise RuntimeError('Unexpected Content-Range: {}'.format(
+            response.headers.get('Content-Range')))
+    return int(m.group(1))
+
+
+@retry
+def http_download(url, filepath, compression=None, chunk_size=64 * 1024,
+                  sink=None, max_size=None, tail=None, keep_tail=None):
+    """ HTTP GET with streaming of the response body to a file.
+
+        The body is written to a temporary file in chunks and the
+        file is renamed to `filepath` only when the whole body is
+        received. Nothing is written if the body is empty.
+
+        The body is compressed on the fly if `compression` is
+        given (see storage.COMPRESSIONS).
+
+        The chunks are passed to `sink.write()` as well if `sink` is
+        given. It is reset by `sink.reset()` before each attempt.
+
+        Raise on a bad HTTP status. Raise ResponseTooLarge and write
+        nothing if the body is larger than `max_size` bytes.
+
+        Only last `tail` bytes are requested if `tail` is given (the
+        Range header goes along the redirect to the blob storage).
+        If the body doesn't start from the beginning, its first
+        partial line is dropped: the written text starts from a
+        line.
+
+        The whole body is requested and passed to the sink, but only
+        its last `keep_tail` bytes (from a line start) are written if
+        `keep_tail` is given.
+
+        Return size and SHA-256 hex digest of the written
+        (uncompressed) body and its offset in the whole resource.
+    """
+    size = 0
+    sha256 = hashlib.sha256()
+    tmp_filepath = storage.temp_path(filepath)
+    if sink:
+        sink.reset()
+    headers = None
+    if tail is not None:
+        headers = {'Range': 'bytes=-{}'.format(tail)}
+    with send_get(url, headers=headers, stream=True) as r:
+        # The range of an empty resource is not satisfiable.
+        if tail is not None and r.status_code == 416:
+            debug('Empty resource, nothing is written', url=url)
+            return 0, sha256.hexdigest(), 0
+        if not r.ok:
+            # Read the body while the response is open: retry() looks
+            # for a secondary rate limit in it.
+            r.content
+        r.raise_for_status()
+        offset = response_offset(r)
+        # Skip the partial first line.
+        skip_line = offset > 0
+        # The last chunks to write if `keep_tail` is given.
+        kept = []
+        kept_size = 0
+        try:
+            with storage.open_log_writer(tmp_filepath, compression) as f:
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    if skip_line:
+                        pos = chunk.find(b'\n')
+                        if pos < 0:
+                            offset += len(chunk)
+                            continue
+                        offset += pos + 1
+                        chunk = chunk[pos + 1:]
+                        skip_line = False
+                    if sink:
+                        sink.write(chunk)
+                    if keep_tail is not None:
+                        kept.append(chunk)
+                        kept_size += len(chunk)
+                        while kept_size - len(kept[0]) >= keep_tail:
+                            offset += len(kept[0])
+                            kept_size -= len(kept.pop(0))
+                        continue
+                    f.write(chunk)
+                    sha256.update(chunk)
+                    size += len(chunk)
+                    if max_size is not None and size > max_size:
+                        raise ResponseTooLarge(
+                            'The response body is larger than {} '
+                            'bytes'.format(max_size))
+                if kept:
+                    body = b''.join(kept)
+                    cut = len(body) - keep_tail
+                    if cut > 0:
+                        # From the first line start after the cut.
+                        pos = body.find(b'\n', cut - 1)
+                        cut = len(body) if pos < 0 else pos + 1
+                        offset += cut
+                        body = body[cut:]
+                    f.write(body)
+                    sha256.update(body)
+                    size = len(body)
+        except BaseException:
+            os.remove(tmp_filepath)
+            raise
+
+    if size == 0:
+        os.remove(tmp_filepath)
+        debug('Empty response body, nothing is written', url=url)
+    else:
+        storage.fsync_file(tmp_filepath)
+        os.replace(tmp_filepath, filepath)
+    return size, sha256.hexdigest(), offset
+
+
 class WorkflowRun:
-    def __init__(self, data=None, filepath=None):
+    def __init__(self, repo, data=None, filepath=None):
+        self.repo = repo
         if data:
             self._data = data
         elif filepath:
@@ -142,7 +752,7 @@ class WorkflowRun:
 
     @property
     def meta_path(self):
-        return os.path.join(workflow_runs_dir, self.id + '.json')
+        return self.repo.layout.run_meta_path(self.id)
 
     @property
     def created_at(self):
@@ -156,16 +766,18 @@ class WorkflowRun:
 
     @property
     def is_stored(self):
-        """ Whether the workflow run metainfo is stored.
+        """ Whether the workflow run metainfo is stored (and added
+            to the catalog).
 
             It does not check whether all jobs and logs are stored
             as well.
         """
-        return os.path.isfile(self.meta_path)
+        return os.path.isfile(self.meta_path) and \
+            self.repo.catalog.has_run(self.id)
 
     def store(self):
         info('Write {}', self.meta_path)
-        with open(self.meta_path, 'w') as f:
+        with storage.atomic_write(self.meta_path) as f:
             json.dump(self._data, f, indent=2)
 
     def load(self, filepath):
@@ -175,9 +787,11 @@ class WorkflowRun:
 
 
 class WorkflowRunJob:
-    def __init__(self, data):
+    def __init__(self, repo, data):
+        self.repo = repo
         self._data = data
-        self.log = None
+        # Given by the `test_status` sensor if the log is ingested.
+        self.test_statuses = None
 
     @property
     def id(self):
@@ -206,41 +820,134 @@ class WorkflowRunJob:
 
     @property
     def meta_path(self):
-        return os.path.join(workflow_run_jobs_dir, self.id + '.json')
+        return self.repo.layout.job_meta_path(self.id)
 
     @property
     def log_path(self):
-        return os.path.join(workflow_run_jobs_dir, self.id + '.log')
+        return self.repo.layout.job_log_path(self.id)
+
+    def prepare_dir(self):
+        job_dir = self.repo.layout.job_dir(self.id)
+        if not os.path.isdir(job_dir):
+            os.makedirs(job_dir, exist_ok=True)
 
     @property
     def log_url(self):
-        url_fmt = 'https://api.github.com/repos/{}/{}/actions/jobs/{}/logs'
-        return url_fmt.format(args.owner, args.repo, self.id)
+        return '{}/actions/jobs/{}/logs'.format(self.repo.api_url, self.id)
 
     @property
     def is_stored(self):
         if not os.path.isfile(self.meta_path):
             return False
-        if not args.nologs and not os.path.isfile(self.log_path):
+        if not args.nologs and storage.find_log(self.log_path) is None:
             return False
         return True
 
     def download_log(self):
+        """ Download the log right to `log_path` and record its
+            size and checksum in the job meta.
+        """
         url = self.log_url
         info('Download {}', url)
-        r = http_get(url)
-        self.log = r.content
+        self.prepare_dir()
+        log_path = storage.compressed_path(self.log_path, args.compress)
+        extractor = None
+        if args.ingest:
+            extractor = JobFactsExtractor(
+                detect_failure=self.conclusion == 'failure')
+        # Failures are looked for at the end of a log, but a failed
+        # job log is stored in full for the test statuses. A log of a
+        # successful job is downloaded in full only if the facts are
+        # extracted: it may have tests that failed and passed on a
+        # retry.
+        tail = None
+        keep_tail = None
+        if args.tail_kib is not None and self.conclusion == 'success':
+            if extractor:
+                keep_tail = args.tail_kib * 1024
+            else:
+                tail = args.tail_kib * 1024
+        size, sha256, offset = http_download(url, log_path, args.compress,
+                                             sink=extractor, tail=tail,
+                                             keep_tail=keep_tail)
+        if size:
+            info('Written {} ({} bytes)', log_path, size)
+            self._data['multivac'] = {
+                'log_size': size,
+                'log_sha256': sha256,
+            }
+            if offset:
+                # The log is truncated: this amount of its first bytes
+                # is not stored.
+                self._data['multivac']['log_offset'] = offset
+            if extractor:
+                # The extractor has seen the whole log unless only
+                # the tail is downloaded.
+                extractor.partial = tail is not None and offset > 0
+                extractor.close()
+                self.store_facts(extractor)
+                self.test_statuses = extractor.test_status_cache
+
+    @property
+    def artifact_path(self):
+        return self.repo.layout.artifact_path(self._data['run_id'], self.id)
+
+    @property
+    def needs_artifact(self):
+        """ Whether an artifact of the job should be downloaded. """
+        return self.conclusion == 'failure' and \
+            not os.path.isfile(self.artifact_path)
+
+    def download_artifact(self, artifact):
+        """ Download the artifact right to `artifact_path`. Skip it
+            if it is too large or gone.
+        """
+        max_size = args.artifact_max_size * 1024 * 1024
+        if artifact['size_in_bytes'] > max_size:
+            info('Skip artifact {} of job {}: {} bytes', artifact['name'],
+                 self.id, artifact['size_in_bytes'])
+            return
+        url = artifact['archive_download_url']
+        info('Download {}', url)
+        os.makedirs(os.path.dirname(self.artifact_path), exist_ok=True)
+        try:
+            size, _, _ = http_download(url, self.artifact_path,
+                                       max_size=max_size)
+        except ResponseTooLarge as e:
+            info('Skip artifact {} of job {}: {}', artifact['name'], self.id,
+                 e)
+            return
+        except requests.exceptions.HTTPError as e:
+            # Expired or removed meanwhile.
+            if e.response.status_code not in (404, 410):
+                raise
+            info('Skip artifact {} of job {}: HTTP status {}',
+                 artifact['name'], self.id, e.response.status_code)
+            return
+        if size:
+            info('Written {} ({} bytes)', self.artifact_path, size)
+
+    @property
+    def facts_path(self):
+        return get_facts_filepath(self.log_path)
+
+    def store_facts(self, extractor):
+        """ Store the facts extracted from the log and the test
+            statuses cache of the `test_status` sensor.
+        """
+        info('Write {}', self.facts_path)
+        with storage.atomic_write(self.facts_path) as f:
+            json.dump(extractor.facts, f, indent=2)
+        cache_path = test_status.get_cache_filepath(self.log_path)
+        with storage.atomic_write(cache_path) as f:
+            json.dump(extractor.test_status_cache, f, indent=2)
 
     def store(self):
         info('Write {}', self.meta_path)
-        with open(self.meta_path, 'w') as f:
+        self.prepare_dir()
+        with storage.atomic_write(self.meta_path) as f:
             json.dump(self._data, f, indent=2)
 
-        if self.log:
-            info('Write {}', self.log_path)
-            with open(self.log_path, 'wb') as f:
-                f.write(self.log)
-
 
 def workflow_runs_download_info(pages, pages_all, obj_count, obj_total, url,
                                 params):
@@ -256,71 +963,94 @@ def workflow_runs_download_info(pages, pages_all, obj_count, obj_total, url,
         if isinstance(obj_total, int):
             obj_total = min(obj_total, 1000)
 
-    info('[pages {:2} / {:2}] [objects {:4} / {:4}] Download {}'.format(
-        pages, pages_all, obj_count, obj_total, url))
+    info('[pages {:2} / {:2}] [objects {:4} / {:4}] Download {}', pages,
+         pages_all, obj_count, obj_total, url)
 
 
-def workflow_runs_page_info(response):
+def workflow_runs_page_info(page):
     """ Show information about workflow run search response:
         the list of workflow run IDs.
     """
     ids = []
-    for data in response.json()['workflow_runs']:
+    for data in page['workflow_runs']:
         ids.append(data['id'])
     info('Workflow run IDs on this page: {}', ids)
 
 
-def download_workflow_runs(branch=None, since=1):
+def download_workflow_runs(repo, branch=None, since=1, filters=None,
+                           on_page=None):
     """ Download and yield workflow runs metainformation from
         fresh ones toward older ones.
+
+        `filters` are extra query parameters such as `status` or
+        `created`.
+
+        `on_page(page, data)` is called for each downloaded list
+        page before its runs are yielded.
     """
     params = {
         # 100 is the maximum.
         'per_page': 100,
         'branch': branch,
     }
-    url = 'https://api.github.com/repos/{}/{}/actions/runs?page={}'.format(
-        args.owner, args.repo, since)
+    params.update(filters or {})
+    url = '{}/actions/runs?page={}'.format(repo.api_url, since)
     workflow_runs_download_info(0, '??', 0, '??', url, params)
-    r = http_get(url, params=params)
-    workflow_runs_page_info(r)
+    r = http_get(url, params=params, cache=repo.validator_cache)
+    page = r.json()
+    workflow_runs_page_info(page)
+    if on_page:
+        on_page(since, page)
 
     run_count = 0
-    for data in r.json()['workflow_runs']:
+    for data in page['workflow_runs']:
         run_count += 1
-        yield WorkflowRun(data=data)
+        yield WorkflowRun(repo, data=data)
 
     pages_all = '??'
-    last_url = r.links['last']['url']
-    pages_all_match = re.search(r'[^_]page=(\d+)', last_url)
-    if pages_all_match:
-        pages_all = int(pages_all_match.group(1))
+    # There is no pagination links if there is only one page.
+    if 'last' in r.links:
+        last_url = r.links['last']['url']
+        pages_all_match = re.search(r'[^_]page=(\d+)', last_url)
+        if pages_all_match:
+            pages_all = int(pages_all_match.group(1))
 
     pages = since
     while 'next' in r.links:
         next_url = r.links['next']['url']
-        run_total = r.json()['total_count']
+        run_total = page['total_count']
         workflow_runs_download_info(pages, pages_all, run_count, run_total,
                                     next_url, params)
-        r = http_get(next_url, params=params)
-        workflow_runs_page_info(r)
-        for data in r.json()['workflow_runs']:
-            run_count += 1
-            yield WorkflowRun(data=data)
+        r = http_get(next_url, params=params, cache=repo.validator_cache)
+        page = r.json()
+        workflow_runs_page_info(page)
         pages += 1
+        if on_page:
+            on_page(pages, page)
+        for data in page['workflow_runs']:
+            run_count += 1
+            yield WorkflowRun(repo, data=data)
 
 
-def workflow_run_jobs_page_info(response):
+def download_workflow_run(repo, workflow_run_id):
+    """ Download metainformation of the given workflow run. """
+    url = '{}/actions/runs/{}'.format(repo.api_url, workflow_run_id)
+    info('Download {}', url)
+    r = http_get(url)
+    return WorkflowRun(repo, data=r.json())
+
+
+def workflow_run_jobs_page_info(page):
     """ Show information about workflow run jobs search response:
         the list of job IDs.
     """
     ids = []
-    for data in response.json()['jobs']:
+    for data in page['jobs']:
         ids.append(data['id'])
     info('Workflow run job IDs: {}', ids)
 
 
-def download_workflow_run_jobs(workflow_run_id):
+def download_workflow_run_jobs(repo, workflow_run_id):
     """ Download and yield workflow run jobs metainformation for
         given workflow run. An object for each (re)run.
     """
@@ -330,32 +1060,451 @@ def download_workflow_run_jobs(workflow_run_id):
         # Download all jobs, not only the latest one.
         'filter': 'all',
     }
-    url = 'https://api.github.com/repos/{}/{}/actions/runs/{}/jobs'.format(
-        args.owner, args.repo, workflow_run_id)
+    url = '{}/actions/runs/{}/jobs'.format(repo.api_url, workflow_run_id)
     info('Download {}', url)
-    r = http_get(url, params=params)
-    workflow_run_jobs_page_info(r)
+    r = http_get(url, params=params, cache=repo.validator_cache)
+    page = r.json()
+    workflow_run_jobs_page_info(page)
 
     # Assume that nobody will rerun a workflow run more than 100
     # times. So we can download only the first page.
 
-    for data in r.json()['jobs']:
-        yield WorkflowRunJob(data)
+    for data in page['jobs']:
+        yield WorkflowRunJob(repo, data)
 
 
-if __name__ == '__main__':
-    if not os.path.isdir(workflow_runs_dir):
-        os.makedirs(workflow_runs_dir)
-    if not os.path.isdir(workflow_run_jobs_dir):
-        os.makedirs(workflow_run_jobs_dir)
+def download_workflow_run_artifacts(repo, workflow_run_id):
+    """ Download metainformation of artifacts of the given
+        workflow run.
+    """
+    params = {
+        # 100 is the maximum.
+        'per_page': 100,
+    }
+    url = '{}/actions/runs/{}/artifacts'.format(repo.api_url, workflow_run_id)
+    info('Download {}', url)
+    r = http_get(url, params=params, cache=repo.validator_cache)
+    return r.json()['artifacts']
+
+
+def match_artifacts(jobs, artifacts):
+    """ Map jobs to their artifacts: job ID -> artifact meta.
+
+        GitHub doesn't tell, which job has uploaded an artifact, so
+        it is guessed by the name: an artifact should be named after
+        the job exactly. If several artifacts have the same name (say,
+        uploaded by several attempts), the newest one is taken.
+    """
+    artifacts = [artifact for artifact in artifacts
+                 if not artifact.get('expired')]
+    artifacts.sort(key=lambda artifact: artifact.get('created_at') or '')
+    by_name = {artifact['name']: artifact for artifact in artifacts}
+    res = {}
+    for job in jobs:
+        artifact = by_name.get(job.meta['name'])
+        if artifact:
+            res[job.id] = artifact
+    return res
+
+
+def download_artifacts(run, jobs):
+    """ Download artifacts of failed jobs of the workflow run, which
+        are not stored yet.
+
+        The downloads go to the artifact worker pool. Wait for them:
+        the run is considered stored only when they're finished.
+    """
+    name = run.meta.get('name') or ''
+    if artifact_workflow_res and not any(
+            regexp.search(name) for regexp in artifact_workflow_res):
+        return
+    # Artifacts don't tell the attempt either: only jobs of the
+    # latest attempt get them.
+    attempt = max((job.meta.get('run_attempt', 1) for job in jobs),
+                  default=1)
+    jobs = [job for job in jobs if job.meta.get('run_attempt', 1) == attempt
+            and job.needs_artifact]
+    if not jobs:
+        return
+    artifacts = match_artifacts(
+        jobs, download_workflow_run_artifacts(run.repo, run.id))
+    futures = [artifact_executor.submit(job.download_artifact,
+                                        artifacts[job.id])
+               for job in jobs if job.id in artifacts]
+    for future in futures:
+        future.result()
+
+
+def process_workflow_run(run):
+    """ Download jobs and logs of the given workflow run and store
+        them.
+
+        Return True if the workflow run is stored and False if it
+        is skipped.
+    """
+    # Download jobs meta.
+    jobs = list(download_workflow_run_jobs(run.repo, run.id))
+
+    # Skip if there are incomplete jobs.
+    incomplete_jobs = [job for job in jobs if job.status != 'completed']
+    if incomplete_jobs:
+        reason = 'incomplete jobs'
+        info('Skip workflow run {}: {}', run.id, reason)
+        return False
+
+    # Download logs, store job meta and logs.
+    for job in jobs:
+        if not job.is_stored:
+            if not args.nologs:
+                job.download_log()
+            job.store()
+
+    if args.artifacts:
+        download_artifacts(run, jobs)
+
+    # Store workflow run meta (or update it).
+    run.store()
+
+    catalog_jobs = []
+    for job in jobs:
+        log_path = None
+        if storage.find_log(job.log_path):
+            log_path = run.repo.layout.relpath(job.log_path)
+        catalog_jobs.append((job.meta, log_path, job.test_statuses))
+    run.repo.catalog.put_run(run.meta, catalog_jobs)
+    return True
+
+
+def github_time(dt):
+    """ Format time as GitHub search query expects it. """
+    return dt.astimezone(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def branch_file_name(branch):
+    """ Name of a per branch state file: `all.json` for all
+        branches, `branches/<branch>.json` otherwise.
+    """
+    if branch is None:
+        return 'all.json'
+    return os.path.join('branches',
+                        urllib.parse.quote(branch, safe='') + '.json')
+
+
+class Checkpoint:
+    """ State of the crawl of a branch (or of all branches) left by
+        the previous successful fetch.py call.
+
+        * frontier -- all runs created before this time, which were
+          not listed in `pending`, were completed and stored.
+        * pending -- runs that were incomplete (or had incomplete
+          jobs) and should be revisited: run ID -> created_at.
+        * runs -- last seen updated_at of recently created runs:
+          run ID -> {'created_at': <..>, 'updated_at': <..>}.
+        * relisted -- when completed runs were listed back to
+          RERUN_HORIZON last time.
+    """
+
+    def __init__(self, repo, branch):
+        self.path = os.path.join(repo.checkpoints_dir,
+                                 branch_file_name(branch))
+        self.frontier = None
+        self.pending = {}
+        self.runs = {}
+        self.relisted = None
+        if os.path.isfile(self.path):
+            info('Read {}', self.path)
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            self.frontier = datetime.datetime.fromisoformat(data['frontier'])
+            self.pending = data['pending']
+            self.runs = data['runs']
+            if data.get('relisted'):
+                self.relisted = datetime.datetime.fromisoformat(
+                    data['relisted'])
+
+    def is_seen(self, run):
+        """ Whether the run was stored in the same state before. """
+        past_info = self.runs.get(run.id)
+        return past_info is not None and \
+            past_info['updated_at'] == run.meta['updated_at']
+
+    def seen(self, run):
+        self.runs[run.id] = {
+            'created_at': run.meta['created_at'],
+            'updated_at': run.meta['updated_at'],
+        }
+
+    def store(self, frontier, pending):
+        """ Write the new crawl state. Forget runs, which will not
+            be listed by the next crawl.
+        """
+        self.frontier = frontier
+        self.pending = dict(pending)
+        lower_bound = frontier - overlap
+        self.runs = {
+            run_id: run_info for run_id, run_info in self.runs.items()
+            if run_id in pending or datetime.datetime.fromisoformat(
+                run_info['created_at'].rstrip('Z') + '+00:00') >= lower_bound
+        }
+        data = {
+            'frontier': frontier.isoformat(),
+            'pending': pending,
+            'runs': self.runs,
+            'relisted': self.relisted and self.relisted.isoformat(),
+        }
+        dirpath = os.path.dirname(self.path)
+        if not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+        info('Write {}', self.path)
+        with storage.atomic_write(self.path) as f:
+            json.dump(data, f, indent=2)
+
+
+class Journal:
+    """ Progress of a fetch of a branch (or of all branches), which
+        is not finished yet.
+
+        It is written before the crawl starts and on each change of
+        the progress and removed when the checkpoint is stored. So a
+        journal, which is found on startup, is left by an interrupted
+        call and the crawl is resumed from it.
+
+        * started_at -- startup time of the call, which started the
+          crawl.
+        * mode -- 'walk' or 'crawl', see walk() and crawl().
+        * page -- the workflow run list page being walked (the walk
+          only).
+        * position -- created_at of the oldest run on this page: runs
+          created after it are stored by the interrupted walk.
+        * in_flight -- runs being downloaded: run ID -> created_at.
+        * pending -- runs to revisit next time found so far: run ID
+          -> created_at.
+
+        The journal is kept only in memory if `persistent` is False.
+    """
+
+    def __init__(self, repo, branch, persistent=True):
+        self.path = None
+        if persistent:
+            self.path = os.path.join(repo.journal_dir,
+                                     branch_file_name(branch))
+        self.reset()
+        if self.path and os.path.isfile(self.path):
+            info('Read {}', self.path)
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            self.started_at = datetime.datetime.fromisoformat(
+                data['started_at'])
+            self.mode = data['mode']
+            self.page = data['page']
+            self.position = data['position']
+            self.in_flight = data['in_flight']
+            self.pending = data['pending']
+
+    def reset(self):
+        self.started_at = None
+        self.mode = None
+        self.page = None
+        self.position = None
+        self.in_flight = {}
+        self.pending = {}
+
+    def begin(self, mode):
+        """ Start a crawl or continue the interrupted one if it is of
+            the same mode.
+        """
+        if self.mode != mode:
+            self.reset()
+        if self.started_at is None:
+            self.started_at = startup_time
+        self.mode = mode
+        self.store()
+
+    def at_page(self, page, data):
+        created_at = [run['created_at'] for run in data['workflow_runs']]
+        if created_at:
+            self.page = page
+            self.position = min(created_at)
+            self.store()
+
+    def submitted(self, run):
+        self.in_flight[run.id] = run.meta['created_at']
+        self.store()
+
+    def done(self, run):
+        self.in_flight.pop(run.id, None)
+        self.store()
+
+    def postpone(self, run):
+        """ Record the run to be revisited next time. """
+        self.pending[run.id] = run.meta['created_at']
+        self.store()
+
+    def store(self):
+        if not self.path:
+            return
+        data = {
+            'started_at': self.started_at.isoformat(),
+            'mode': self.mode,
+            'page': self.page,
+            'position': self.position,
+            'in_flight': self.in_flight,
+            'pending': self.pending,
+        }
+        dirpath = os.path.dirname(self.path)
+        if not os.path.isdir(dirpath):
+            os.makedirs(dirpath)
+        with storage.atomic_write(self.path) as f:
+            json.dump(data, f, indent=2)
+
+    def remove(self):
+        if self.path and os.path.isfile(self.path):
+            info('Remove {}', self.path)
+            os.remove(self.path)
+        self.reset()
+
+
+class WorkflowRunQueue:
+    """ Process workflow runs in a thread pool.
+
+        Keeps at most two workflow runs per worker in flight, so
+        the list walk doesn't go too far ahead of the workers.
+
+        `on_done(run, stored)` is called in the caller's thread for
+        each processed workflow run: `stored` is the result of
+        process_workflow_run(). An error of a worker is re-raised
+        in the caller's thread.
+
+        The runs in flight are recorded in the journal.
+    """
+
+    def __init__(self, executor, journal, on_done):
+        self._executor = executor
+        self._journal = journal
+        self._on_done = on_done
+        # Workflow run ID -> (run, future of process_workflow_run()).
+        self._in_flight = {}
+
+    def _collect(self, run_id):
+        run, future = self._in_flight.pop(run_id)
+        stored = future.result()
+        self._on_done(run, stored)
+        self._journal.done(run)
+
+    def _collect_done(self):
+        for run_id, (_, future) in list(self._in_flight.items()):
+            if future.done():
+                self._collect(run_id)
+
+    def wait_for(self, run_id):
+        """ Wait till the workflow run is processed if it is in
+            flight.
+
+            The same workflow run may appear on the list twice. Wait
+            for it to see the same state as a sequential walk would
+            see.
+        """
+        self._collect_done()
+        if run_id in self._in_flight:
+            wait([self._in_flight[run_id][1]])
+            self._collect(run_id)
+
+    def submit(self, run):
+        while len(self._in_flight) >= 2 * args.workers:
+            futures = [future for _, future in self._in_flight.values()]
+            wait(futures, return_when=FIRST_COMPLETED)
+            self._collect_done()
+        self._journal.submitted(run)
+        future = self._executor.submit(process_workflow_run, run)
+        self._in_flight[run.id] = (run, future)
+
+    def join(self):
+        while self._in_flight:
+            futures = [future for _, future in self._in_flight.values()]
+            wait(futures, return_when=FIRST_COMPLETED)
+            self._collect_done()
+
+
+def run_is_changed(run):
+    """ Whether jobs of the completed workflow run should be
+        (re)downloaded.
+    """
+    # Skip already processed runs if there were no restarts.
+    if run.is_stored:
+        try:
+            run_past_info = WorkflowRun(run.repo, filepath=run.meta_path)
+        except json.JSONDecodeError:
+            # Written in place by an older version and truncated.
+            info('Workflow run {} meta is corrupted, downloading '
+                 'jobs...', run.id)
+            return True
+        if run.updated_at == run_past_info.updated_at:
+            info(("Workflow run {} was not changed ({}), don't "
+                  "download jobs again"), run.id, run.updated_at)
+            return False
+        info('Workflow run {} was updated ({} vs {}), downloading '
+             'jobs...', run.id, run_past_info.updated_at,
+             run.updated_at)
+    return True
+
 
+def walk(executor, repo, branch, checkpoint, journal):
+    """ Walk the workflow run list from fresh runs toward older
+        ones till a stop condition.
+
+        Continue the interrupted walk if it is recorded in the
+        journal: revisit the runs, which were in flight, and walk
+        from the page, where it was stopped.
+
+        Return runs to revisit next time: run ID -> created_at.
+    """
     ignore_in_stop_condition = set()
 
-    for run in download_workflow_runs(args.branch, args.since):
+    def on_done(run, stored):
+        checkpoint.seen(run)
+        if stored:
+            # A new workflow run may be created while the script
+            # works. So the same workflow run may appear twice: on
+            # page N and on page N+1. If we'll not ignore it in the
+            # stop condition, the first script invocation may stop
+            # prematurely.
+            ignore_in_stop_condition.add(run.id)
+        else:
+            journal.postpone(run)
+
+    def consider(run):
+        # Skip incomplete runs. We'll look at them next time.
+        if run.status != 'completed':
+            reason = 'incomplete'
+            info('Skip workflow run {}: {}', run.id, reason)
+            journal.postpone(run)
+        elif run_is_changed(run):
+            queue.submit(run)
+        else:
+            checkpoint.seen(run)
+
+    queue = WorkflowRunQueue(executor, journal, on_done)
+
+    since = args.since
+    # Runs created after this time are stored by the interrupted
+    # walk, don't stop on them.
+    resume_position = None
+    if journal.page is not None:
+        since = journal.page
+        resume_position = journal.position
+        info('Resume the walk started at {} from page {}',
+             journal.started_at, since)
+        for run_id in list(journal.in_flight):
+            consider(download_workflow_run(repo, run_id))
+
+    for run in download_workflow_runs(repo, branch, since,
+                                      on_page=journal.at_page):
+        queue.wait_for(run.id)
+
         # Stop condition.
         #
-        # If there are no stored runs, continue till the end (how much
-        # GitHub allows to download, it is 1000 runs).
+        # If there are no stored runs, continue till the end (how
+        # much GitHub allows to download, it is 1000 runs).
         #
         # However we don't stop on a first known workflow run.
         # A restarted workflow run keeps its position in the list
@@ -364,55 +1513,180 @@ if __name__ == '__main__':
         # them).
         #
         # Actually this is not the optimal traverse algorithm, but
-        # it is simple to implement.
+        # it is simple to implement. It is used when there is no
+        # checkpoint (see crawl()).
         #
         # [1]: https://github.community/t/135654
-        is_ignored = run.id in ignore_in_stop_condition
-        run_is_old = startup_time - run.created_at > datetime.timedelta(weeks=2)
-        if not args.nostop and run.is_stored and run_is_old and not is_ignored:
+        is_ignored = run.id in ignore_in_stop_condition or (
+            resume_position is not None and
+            run.meta['created_at'] >= resume_position)
+        run_is_old = startup_time - run.created_at > RERUN_HORIZON
+        if not args.nostop and run.is_stored and run_is_old and \
+                not is_ignored:
             info('Found stored workflow run {} older than 2 weeks, '
                  'stopping...', run.id)
             break
 
-        # Skip incomplete runs. We'll look at them next time.
+        consider(run)
+
+    queue.join()
+    return journal.pending
+
+
+def crawl(executor, repo, branch, checkpoint, journal):
+    """ Download only runs, which are new or could be changed since
+        the previous crawl recorded in the checkpoint.
+
+        * Active runs are recorded to be revisited next time.
+        * Runs recorded as pending last time are revisited one by
+          one.
+        * Completed runs created after the previous crawl (with some
+          overlap) are listed.
+        * Once in --relist-interval hours completed runs created
+          during last two weeks are listed instead.
+
+        A re-run of an older workflow run is caught if it is in
+        progress at a crawl. Otherwise (it is started and finished
+        between two crawls) it is caught by the next re-listing: its
+        updated_at differs from the stored one. The re-listing
+        starts from the beginning of a day, so its query is the same
+        during the day and the pages, which are not changed since the
+        previous re-listing, are not modified (see the ETag cache).
+        Use --nostop to walk all the runs.
+
+        Continue the interrupted crawl if it is recorded in the
+        journal: revisit the runs, which were in flight or found
+        pending.
+
+        Return runs to revisit next time: run ID -> created_at.
+    """
+    # Runs to revisit: recorded as pending by the previous crawl
+    # and ones left by the interrupted crawl.
+    revisit = list(checkpoint.pending)
+    revisit.extend(journal.in_flight)
+    revisit.extend(journal.pending)
+    journal.pending.clear()
+    journal.store()
+
+    def on_done(run, stored):
+        checkpoint.seen(run)
+        if not stored:
+            journal.postpone(run)
+
+    def consider(run):
+        queue.wait_for(run.id)
         if run.status != 'completed':
             reason = 'incomplete'
             info('Skip workflow run {}: {}', run.id, reason)
-            continue
-
-        # Skip already processed runs if there were no restarts.
-        if run.is_stored:
-            run_past_info = WorkflowRun(filepath=run.meta_path)
-            if run.updated_at == run_past_info.updated_at:
-                info(("Workflow run {} was not changed ({}), don't download " +
-                      "jobs again"), run.id, run.updated_at)
-                continue
-            info('Workflow run {} was updated ({} vs {}), downloading jobs...',
-                 run.id, run_past_info.updated_at, run.updated_at)
-
-        # Download jobs meta.
-        jobs = list(download_workflow_run_jobs(run.id))
-
-        # Skip if there are incomplete jobs.
-        incomplete_jobs = [job for job in jobs if job.status != 'completed']
-        if incomplete_jobs:
-            reason = 'incomplete jobs'
-            info('Skip workflow run {}: {}', run.id, reason)
-            continue
-
-        # Download logs, store job meta and logs.
-        for job in jobs:
-            if not job.is_stored:
-                if not args.nologs:
-                    job.download_log()
-                job.store()
-
-        # Store workflow run meta (or update it).
-        run.store()
-        # A new workflow run may be created while the script works.
-        # So the same workflow run may appear twice: on page N and
-        # on page N+1. If we'll not ignore it in the stop condition,
-        # the first script invocation may stop prematurely.
-        ignore_in_stop_condition.add(run.id)
-
-debug_log_fh.close()
+            journal.postpone(run)
+        elif checkpoint.is_seen(run) and run.is_stored:
+            info("Workflow run {} was not changed ({}), don't download "
+                 "jobs again", run.id, run.updated_at)
+        elif run_is_changed(run):
+            queue.submit(run)
+        else:
+            checkpoint.seen(run)
+
+    queue = WorkflowRunQueue(executor, journal, on_done)
+
+    # Active runs go first: a run, which is completed between
+    # this listing and the listing of completed runs, is caught by
+    # the latter.
+    for status in ACTIVE_STATUSES:
+        filters = {'status': status}
+        for run in download_workflow_runs(repo, branch, filters=filters):
+            consider(run)
+
+    for run_id in dict.fromkeys(revisit):
+        if run_id not in journal.pending:
+            consider(download_workflow_run(repo, run_id))
+
+    since = checkpoint.frontier - overlap
+    if checkpoint.relisted is None or \
+            startup_time - checkpoint.relisted >= relist_interval:
+        # From the start of the day: the query is the same during the
+        # day, so the list pages are revalidated by the ETag cache.
+        horizon = (startup_time - RERUN_HORIZON).replace(
+            hour=0, minute=0, second=0, microsecond=0)
+        since = min(since, horizon)
+        info('Re-list completed runs created since {}', since)
+        checkpoint.relisted = startup_time
+    filters = {
+        'status': 'completed',
+        'created': '>=' + github_time(since),
+    }
+    for run in download_workflow_runs(repo, branch, filters=filters):
+        consider(run)
+
+    queue.join()
+    return journal.pending
+
+
+def fetch(executor, repo, branch):
+    """ Download new and updated workflow runs of the repository
+        branch (all branches if `branch` is None).
+    """
+    checkpoint = Checkpoint(repo, branch)
+    # The walk doesn't cover fresh runs if it is started from
+    # a page other than the first one: don't record it.
+    journal = Journal(repo, branch, persistent=args.since == 1)
+
+    if journal.mode == 'walk':
+        pending = walk(executor, repo, branch, checkpoint, journal)
+        # Runs created since the interrupted call are crawled
+        # below.
+        checkpoint.store(journal.started_at, pending)
+        journal.remove()
+        if args.nostop:
+            return
+
+    if checkpoint.frontier and not args.nostop and args.since == 1:
+        info('Crawl {} runs created since {} (checkpoint {})',
+             repo.path, checkpoint.frontier - overlap, checkpoint.path)
+        journal.begin('crawl')
+        pending = crawl(executor, repo, branch, checkpoint, journal)
+    else:
+        journal.begin('walk')
+        pending = walk(executor, repo, branch, checkpoint, journal)
+        # The walk reaches two weeks old runs.
+        checkpoint.relisted = startup_time
+
+    if args.since == 1:
+        checkpoint.store(startup_time, pending)
+        journal.remove()
+
+
+if __name__ == '__main__':
+    repos = {repo_path: Repository(repo_path) for repo_path in args.repo_path}
+    for repo in repos.values():
+        repo.prepare()
+
+    # The crawls share the session (so the connection pool and the
+    # rate limit budget) and the worker pool. Each crawl walks its
+    # workflow run list in its own thread.
+    executor = ThreadPoolExecutor(max_workers=args.workers,
+                                  thread_name_prefix='worker')
+    crawl_executor = ThreadPoolExecutor(max_workers=len(targets),
+                                        thread_name_prefix='crawl')
+    failed = []
+    try:
+        futures = {
+            crawl_executor.submit(fetch, executor, repos[repo_path], branch):
+                (repo_path, branch)
+            for repo_path, branch in targets
+        }
+        for future, (repo_path, branch) in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                info('Failed to fetch {} (branch: {}): {!r}', repo_path,
+                     branch or 'all', e, exc_info=e)
+                failed.append(e)
+    finally:
+        crawl_executor.shutdown(wait=True, cancel_futures=True)
+        executor.shutdown(wait=True, cancel_futures=True)
+        if artifact_executor:
+            artifact_executor.shutdown(wait=True, cancel_futures=True)
+
+    if failed:
+        raise failed[0]
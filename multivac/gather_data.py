@@ -1,27 +1,31 @@
 #!/usr/bin/env python
 import argparse
-import csv
-import glob
+import itertools
 import json
 import os
 import re
 import sys
+import time
 
 import requests
 
-from sensors.test_status import test_status_iter
-from sensors.failures import specific_failures, generic_failures, \
-    compile_failure_specs
-from datetime import datetime
-from influxdb import influx_connector
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from datetime import datetime, timezone
 
 PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(PROJECT_DIR)
-
-COLOR_RE = re.compile('\033' + r'\[\d(?:;\d\d)?m')
-COMPILER_RE = re.compile(r'C compiler identification is '
-                         r'(\S* \d*.\d*.\d*)')
-DATETIME_RE = re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}')
+from multivac.sensors.failures import specific_failures, \
+    generic_failures, failure_matcher  # noqa: E402
+from multivac.sensors.job_facts import JobFactsExtractor, load_facts, \
+    SENSORS_VERSION, FAILURES_VERSION  # noqa: E402
+from multivac.influxdb import InfluxWriter, SyncState  # noqa: E402
+from multivac.catalog import Catalog  # noqa: E402
+from multivac.sinks import Sink, JSONSink, NDJSONSink, CSVSink, \
+    ParquetSink  # noqa: E402
+from multivac.storage import Layout, open_log, find_log, \
+    reverse_lines, atomic_write  # noqa: E402
 
 # According to distrowatch.com and repology.org/project/glibc/versions
 LIBC_VERSIONS = {
@@ -49,57 +53,60 @@ LIBC_VERSIONS = {
 }
 
 
-def decolor(data):
-    return COLOR_RE.sub('', data)
+def detect_error(logs: str, *failure_specs: list,
+                 window: int = None) -> (str, str):
+    """ Find the failure in one scan of the log from its end.
+
+        Failure specification lists are given in the order of
+        priority: the last line matching a specification of the
+        first list wins, if there is no such line, the last line
+        matching a specification of the second list and so on.
+
+        Only last `window` bytes of the log are scanned if it is
+        given. A line is decoded only if it could match (see
+        FailureMatcher.could_match()), undecodable bytes are
+        replaced.
+    """
+    matchers = [failure_matcher(specs) for specs in failure_specs]
+    # (type, line) of the last line matching each list.
+    found = [None] * len(failure_specs)
+    # Lists of a lower priority than a found failure are not checked.
+    best = len(failure_specs)
+    # As far as the failure occurs at the end of the log, let's
+    # start to parse the file from the end to speed up the process
+    for raw_line in reverse_lines(logs, window):
+        line = None
+        for i in range(best):
+            if found[i] is not None or \
+                    not matchers[i].could_match(raw_line):
+                continue
+            if line is None:
+                line = raw_line.decode('utf-8', errors='replace')
+            failure_type = matchers[i].match(line)
+            if failure_type:
+                found[i] = (failure_type, line)
+                best = i
+                break
+        if found[0] is not None:
+            break
+    if best < len(failure_specs):
+        return found[best]
+    return 'unknown_failure', None
 
 
-# As far as the failure occurs at the end of the log, let's
-# start to parse the file from the end to speed up the process
-def reverse_readline(filename, buf_size=8192):
-    """An iterator that returns the lines of a file in reverse order"""
-    with open(filename, encoding='utf8') as fh:
-        segment = None
-        offset = 0
-        fh.seek(0, os.SEEK_END)
-        file_size = remaining_size = fh.tell()
-        while remaining_size > 0:
-            offset = min(file_size, offset + buf_size)
-            fh.seek(file_size - offset)
-            try:
-                buffer = fh.read(min(remaining_size, buf_size))
-            except UnicodeDecodeError:
-                print(f'ERROR when reading {filename}: UnicodeDecodeError')
-                yield ''
-            else:
-                remaining_size -= buf_size
-                lines = buffer.split('\n')
-                # The first line of the buffer is probably not a complete line so
-                # we'll save it and append it to the last line of the next buffer
-                # we read
-                if segment is not None:
-                    # If the previous chunk starts right from the beginning of line
-                    # do not concat the segment to the last line of new chunk.
-                    # Instead, yield the segment first
-                    if buffer[-1] != '\n':
-                        lines[-1] += segment
-                    else:
-                        yield segment
-                segment = lines[0]
-                for index in range(len(lines) - 1, 0, -1):
-                    if lines[index]:
-                        yield lines[index]
-                # Don't yield None if the file was empty
-                if segment is not None:
-                    yield segment
-
-
-def detect_error(logs: str, failure_specs: list) -> (str, str):
-    for number, line in enumerate(reverse_readline(logs)):
-        # check if the line matches one of regular expressions:
-        for failure_type in failure_specs:
-            for regexp in failure_type['re_compiled']:
-                if regexp.match(line):
-                    return failure_type['type'], line
+def detect_failure_type(logs: str, facts: dict,
+                        window: int = None) -> (str, str):
+    """ Failure type and the line, where it is found: from the
+        facts extracted by fetch.py if they contain it, from last
+        `window` bytes of the log otherwise (see detect_error()).
+    """
+    failure = facts['failure']
+    if failure is None:
+        return detect_error(logs, specific_failures, generic_failures,
+                            window=window)
+    for kind in ('specific', 'generic'):
+        if failure[kind]:
+            return tuple(failure[kind])
     return 'unknown_failure', None
 
 
@@ -112,12 +119,10 @@ def github_time_to_unix(time: str) -> float:
     return time_to_unix
 
 
-def get_log_datetime(log_line: str) -> str:
-    # Get ISO format date and time from the log line
-    datetime_match = DATETIME_RE.search(log_line)
-    if datetime_match:
-        return f'{datetime_match.group(0)}Z'
-    return ''
+def github_time_to_datetime(time: str) -> datetime:
+    if not time:
+        return None
+    return datetime.fromisoformat(f"{time.rstrip('Z')}+00:00")
 
 
 # https://github.com/tarantool/tarantool/tree/master/.github/workflows
@@ -129,18 +134,373 @@ DEFAULT_RUNNERS_MATCHER = re.compile(
     r"default_gcc|memtx|integration|out_of_source).*")
 DEFAULT_RUNNER_OS = 'ubuntu_20_04'
 NUM_MATCHER = re.compile(r".*/(\d*)\.json")
+LOG_CHUNK_SIZE = 64 * 1024
+# Jobs sent to a `--jobs` worker process at once.
+JOBS_CHUNK_SIZE = 16
+# Chunks of jobs per a `--jobs` worker queued at once: processed jobs
+# are written out before next ones are queued.
+JOBS_CHUNKS_PER_WORKER = 2
+S3_URL = 'multivac.hb.vkcs.cloud/{}'
+CSV_FIELDNAMES = [
+    'job_id',
+    'workflow_run_id',
+    'job_name',
+    'branch',
+    'commit_sha',
+    'conclusion',
+    'queued_at',
+    'started_at',
+    'completed_at',
+    'platform',
+    'runner_label',
+    'runner_name',
+    'runner_version',
+    'failure_type',
+]
+# Columns of `--format parquet` datasets, see parquet_schema().
+PARQUET_JOB_COLUMNS = [
+    ('job_id', 'int'),
+    ('workflow_run_id', 'int'),
+    ('job_name', 'category'),
+    ('os_version', 'category'),
+    ('branch', 'category'),
+    ('commit_sha', 'string'),
+    ('conclusion', 'category'),
+    ('queued_at', 'timestamp'),
+    ('started_at', 'timestamp'),
+    ('time_in_queue', 'float'),
+    ('completed_at', 'timestamp'),
+    ('job_duration', 'float'),
+    ('platform', 'category'),
+    ('runner_label', 'category'),
+    ('gc64', 'category'),
+    ('debug', 'category'),
+    ('html_url', 'string'),
+    ('runner_name', 'category'),
+    ('runner_version', 'category'),
+    ('failure_type', 'category'),
+    ('compiler_version', 'category'),
+    ('libc_version', 'category'),
+    ('date', 'category'),
+]
+PARQUET_TEST_COLUMNS = [
+    ('job_id', 'int'),
+    ('workflow_run_id', 'int'),
+    ('job_name', 'category'),
+    ('branch', 'category'),
+    ('commit_sha', 'string'),
+    ('started_at', 'timestamp'),
+    ('name', 'category'),
+    ('conf', 'category'),
+    ('test_type', 'category'),
+    ('test_subtype', 'category'),
+    ('test_attempt', 'int'),
+    ('date', 'category'),
+]
+
+
+class ExtractionCache:
+    """ What was extracted from job logs by previous runs:
+        `<owner>/<repo>/cache/gather/<shard>/<id>.json`.
+
+        An entry is used only for the same log: of the same size and
+        modification time. The facts are used if they're extracted by
+        the same version of the sensors, the failure if it is found
+        with the same failure specifications and `--failure-scan-kib`.
+        So a change of the specifications leads to a new scan only of
+        failed jobs.
+    """
+
+    def __init__(self, layout, failure_window):
+        self.layout = layout
+        self.failure_key = [FAILURES_VERSION, failure_window]
+
+    def log_key(self, log_path):
+        """ Size and modification time of the stored log or None. """
+        path = find_log(log_path)
+        if path is None:
+            return None
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def load(self, job_id, log_key):
+        """ The entry of the job or an empty one. """
+        try:
+            with open(self.layout.job_cache_path('gather', job_id), 'r') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {'log': log_key}
+        if entry.get('log') != log_key:
+            return {'log': log_key}
+        return entry
+
+    def facts(self, entry):
+        if entry.get('sensors_version') != SENSORS_VERSION:
+            return None
+        return entry['facts']
+
+    def put_facts(self, entry, facts):
+        entry['sensors_version'] = SENSORS_VERSION
+        entry['facts'] = facts
+
+    def failure(self, entry):
+        if entry.get('failure_key') != self.failure_key:
+            return None
+        return tuple(entry['failure'])
+
+    def put_failure(self, entry, failure):
+        entry['failure_key'] = self.failure_key
+        entry['failure'] = failure
+
+    def store(self, job_id, entry):
+        path = self.layout.job_cache_path('gather', job_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with atomic_write(path) as f:
+            json.dump(entry, f)
+
+
+class ArtifactChecker:
+    """ Tells, which jobs have their artifact uploaded to S3:
+        `<s3_url>/artifacts/<run_id>/<job_id>.zip`.
+
+        The artifacts are checked by HEAD requests in a thread pool,
+        once per job, even ones present in the local storage: they're
+        uploaded by the daily sync (see aws-sync.yml), so a link to a
+        fresh one would be broken till then. The results are kept in
+        `<owner>/<repo>/cache/artifacts.json`: a found artifact for
+        FOUND_TTL seconds, a missing one for MISSING_TTL seconds (it
+        may be uploaded by the next sync).
+    """
+    FOUND_TTL = 30 * 86400
+    MISSING_TTL = 6 * 3600
+    WORKERS = 16
+
+    def __init__(self, layout, s3_url):
+        self.layout = layout
+        self.s3_url = s3_url
+        self.cache_path = os.path.join(layout.cache_dir, 'artifacts.json')
+        try:
+            with open(self.cache_path, 'r') as f:
+                self.cache = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.cache = dict()
+
+    def url(self, run_id, job_id):
+        return f'{self.s3_url}/artifacts/{run_id}/{job_id}.zip'
+
+    def cached(self, job_id, now):
+        """ Whether the artifact exists or None if it is unknown. """
+        entry = self.cache.get(str(job_id))
+        if entry is None:
+            return None
+        exists, checked_at = entry
+        ttl = self.FOUND_TTL if exists else self.MISSING_TTL
+        if now - checked_at > ttl:
+            return None
+        return exists
+
+    @staticmethod
+    def head(session, url):
+        try:
+            return session.head(f'http://{url}', timeout=30).status_code == 200
+        except requests.exceptions.RequestException as e:
+            print(f'Failed to check {url}: {e}')
+            return None
+
+    def resolve(self, jobs):
+        """ Map job IDs to their artifact URLs (None if there is no
+            artifact). `jobs` are (run_id, job_id) pairs.
+        """
+        now = time.time()
+        res = dict()
+        to_check = dict()
+        for run_id, job_id in jobs:
+            url = self.url(run_id, job_id)
+            exists = self.cached(job_id, now)
+            if exists is None:
+                to_check[job_id] = url
+                continue
+            res[job_id] = url if exists else None
+
+        if to_check:
+            print(f'Checking {len(to_check)} artifacts on S3...')
+            with requests.Session() as session, ThreadPoolExecutor(
+                    max_workers=self.WORKERS) as executor:
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_maxsize=self.WORKERS)
+                session.mount('http://', adapter)
+                checked = executor.map(lambda url: self.head(session, url),
+                                       to_check.values())
+                for (job_id, url), exists in zip(to_check.items(), checked):
+                    res[job_id] = url if exists else None
+                    # Not cached if the check is failed.
+                    if exists is not None:
+                        self.cache[str(job_id)] = [exists, now]
+            self.store()
+        return res
+
+    def store(self):
+        os.makedirs(self.layout.cache_dir, exist_ok=True)
+        with atomic_write(self.cache_path) as f:
+            json.dump(self.cache, f)
+
+
+class InfluxSink(Sink):
+    """ Writes points of jobs (and of their failed tests if `tests` is
+        set) to InfluxDB.
+
+        Jobs not changed since the last sync are skipped, see
+        SyncState. The sync states are saved by `save_sync_states()`
+        once the writer is closed without errors.
+
+        Artifacts of jobs with failed tests are checked by batches of
+        ARTIFACT_BATCH jobs, so they're checked concurrently.
+    """
+    ARTIFACT_BATCH = 64
+
+    def __init__(self, gatherer, writer, tests, full_sync=False):
+        self.gatherer = gatherer
+        self.writer = writer
+        self.tests = tests
+        self.buckets = [os.environ['INFLUX_JOB_BUCKET']]
+        if tests:
+            self.buckets += [os.environ['INFLUX_TEST_BUCKET'],
+                             os.environ['INFLUX_TABLE_BUCKET']]
+        self.states = []
+        # Several deployments write to their own buckets from the same
+        # storage: a state per bucket.
+        for bucket in self.buckets:
+            path = os.path.join(gatherer.layout.cache_dir, 'influxdb',
+                                f'{bucket}.json')
+            self.states.append(SyncState(path, bucket, full=full_sync))
+        self.artifact_checker = ArtifactChecker(
+            gatherer.layout, gatherer.s3_url)
+        self.pending_table_jobs = []
+        self.unchanged = [0] * len(self.buckets)
+
+    def write(self, i, job_id, points):
+        if self.states[i].changed(job_id, points):
+            self.writer.write(self.buckets[i], points)
+        else:
+            self.unchanged[i] += 1
+
+    def push(self, job_data):
+        job_id = job_data['job_id']
+        self.write(0, job_id, self.gatherer.job_points(job_data))
+        if not self.tests or 'failed_tests' not in job_data:
+            return
+        self.write(1, job_id, self.gatherer.test_points(job_data))
+        self.pending_table_jobs.append(job_data)
+        if len(self.pending_table_jobs) == self.ARTIFACT_BATCH:
+            self.flush_table_jobs()
+
+    def flush_table_jobs(self):
+        artifact_urls = self.artifact_checker.resolve(
+            (job_data['workflow_run_id'], job_data['job_id'])
+            for job_data in self.pending_table_jobs)
+        for job_data in self.pending_table_jobs:
+            job_id = job_data['job_id']
+            self.write(2, job_id, self.gatherer.table_points(
+                job_data, artifact_urls[job_id]))
+        self.pending_table_jobs = []
+
+    def close(self):
+        if self.pending_table_jobs:
+            self.flush_table_jobs()
+        for bucket, unchanged in zip(self.buckets, self.unchanged):
+            if unchanged:
+                print(f'Skipped {unchanged} jobs of bucket {bucket} not '
+                      f'changed since the last sync')
+
+    def save_sync_states(self):
+        for state in self.states:
+            state.save()
+
+
+class ParquetJobsSink(Sink):
+    """ Jobs and their failed tests as Parquet datasets partitioned by
+        the day the job started: `<path>/jobs/date=<YYYY-MM-DD>/` and
+        `<path>/failed_tests/date=<YYYY-MM-DD>/`.
+
+        Jobs exported by previous runs are listed in
+        `<path>/exported_jobs.json` and skipped: each run appends only
+        new jobs. The list is saved each time the rows are written:
+        each BATCH jobs and on close.
+    """
+    BATCH = 10000
+
+    def __init__(self, path):
+        self.jobs = ParquetSink(os.path.join(path, 'jobs'),
+                                PARQUET_JOB_COLUMNS, ['date'], max_rows=None)
+        self.tests = ParquetSink(os.path.join(path, 'failed_tests'),
+                                 PARQUET_TEST_COLUMNS, ['date'],
+                                 max_rows=None)
+        os.makedirs(path, exist_ok=True)
+        self.exported_path = os.path.join(path, 'exported_jobs.json')
+        try:
+            with open(self.exported_path, 'r') as f:
+                self.exported = set(json.load(f))
+        except FileNotFoundError:
+            self.exported = set()
+        self.pending = 0
+
+    def push(self, job_data):
+        job_id = job_data['job_id']
+        if job_id in self.exported:
+            return
+        row = {name: job_data.get(name) for name, _ in PARQUET_JOB_COLUMNS}
+        for name in ('queued_at', 'started_at', 'completed_at'):
+            row[name] = github_time_to_datetime(job_data[name])
+        row['date'] = row['started_at'].strftime('%Y-%m-%d')
+        self.jobs.push(row)
+        for test in job_data.get('failed_tests', []):
+            self.tests.push({
+                'job_id': job_id,
+                'workflow_run_id': job_data['workflow_run_id'],
+                'job_name': job_data['job_name'],
+                'branch': job_data['branch'],
+                'commit_sha': job_data['commit_sha'],
+                'started_at': row['started_at'],
+                'name': test['name'],
+                'conf': test['conf'],
+                'test_type': test['test_type'],
+                'test_subtype': test['test_subtype'],
+                'test_attempt': test['test_attempt'],
+                'date': row['date'],
+            })
+        self.exported.add(job_id)
+        self.pending += 1
+        if self.pending == self.BATCH:
+            self.flush()
+
+    def flush(self):
+        self.jobs.flush()
+        self.tests.flush()
+        with atomic_write(self.exported_path) as f:
+            json.dump(sorted(self.exported), f)
+        self.pending = 0
+
+    def close(self):
+        self.flush()
 
 
 class GatherData:
     def __init__(self, cli_args):
         self.repo_path = cli_args.repo_path
-        self.workflow_run_jobs_dir = f'{self.repo_path}/workflow_run_jobs'
-        self.workflow_runs_dir = f'{self.repo_path}/workflow_runs'
+        self.layout = Layout(self.repo_path)
         self.output_dir = 'output'
-        self.gathered_data = dict()
+        self.s3_url = cli_args.s3_url.format(self.repo_path)
         self.latest_n: int = cli_args.latest
         self.watch_failure = args.watch_failure
         self.tests_flag = cli_args.tests
+        self.full_sync = cli_args.full_sync
+        self.jobs = cli_args.jobs
+        self.failure_window = None
+        if cli_args.failure_scan_kib:
+            self.failure_window = cli_args.failure_scan_kib * 1024
+        self.cache = None
+        if not cli_args.nocache:
+            self.cache = ExtractionCache(self.layout, self.failure_window)
         self.since_seconds = None
 
         if args.format == 'influxdb':
@@ -164,10 +524,10 @@ class GatherData:
                 print(wrong_usage_message.format('unit'))
 
     @staticmethod
-    def get_test_data(log_file) -> list:
-        """To use this function, you should open log file first and put lines
-        to a variable as a list. This function will call the `test_status`
-        sensor to collect data about failed tests: test name and configuration.
+    def get_test_data(test_statuses) -> list:
+        """Accepts (test, conf, status) tuples given by the `test_status`
+        sensor (or stored in the job facts) and collects data about failed
+        tests: test name and configuration.
         All attempts numbered for unicalization in InfluxDB.
         Returns a list of dictionaries. Works only if option `-t` set."""
 
@@ -178,7 +538,7 @@ class GatherData:
         tests_data = []
 
         for test_name, conf, status in filter(lambda x: x[2] == "fail",
-                                              test_status_iter(log_file)):
+                                              test_statuses):
             #  Check if the test retried to set correct attempt number
             for test in tests_data[::-1]:
                 if test['name'] == test_name and test['conf'] == conf:
@@ -208,14 +568,6 @@ class GatherData:
 
         return tests_data
 
-    @staticmethod
-    def get_release_or_debug(log_file):
-        for line in log_file:
-            if '| Target:' in line and \
-                    line.endswith('Debug\n'):
-                return 'True'
-        return 'False'
-
     @staticmethod
     def detect_os_version(job_name):
 
@@ -231,31 +583,19 @@ class GatherData:
         return 'unknown'
 
     @staticmethod
-    def get_runner_version(log_file):
-        version_matcher = re.compile(r"Current runner version: "
-                                     r"'(\d*.\d*.\d*)'")
-        freebsd_version_matcher = re.compile(r"Runner Version: "
-                                             r"(\d*.\d*.\S*)")
-        for line in log_file:
-            match = version_matcher.search(line)
-            if match:
-                runner_version = match.group(1)
-                return runner_version
-            else:
-                freebsd_match = freebsd_version_matcher.search(line)
-                if freebsd_match:
-                    runner_version = freebsd_match.group(1)
-                    return runner_version
-        return "unknown_runner_version"
-
-    @staticmethod
-    def get_compiler_version(log_file):
-        compiler = 'undefined_compiler'
-        for line in log_file:
-            compiler_match = COMPILER_RE.search(line)
-            if compiler_match:
-                compiler = compiler_match.group(1)
-        return compiler
+    def extract_facts(job, log_path):
+        """Read the log once and feed all the sensors at once: see
+        JobFactsExtractor. The failure is detected by a scan from the end of
+        the log, see detect_failure_type()."""
+        extractor = JobFactsExtractor(cache_test_statuses=False)
+        # Only the end of the log is stored (see fetch.py --tail-kib): its
+        # first line is not the queue time.
+        extractor.partial = 'log_offset' in job.get('multivac', {})
+        with open_log(log_path, 'rb') as log_file:
+            for chunk in iter(lambda: log_file.read(LOG_CHUNK_SIZE), b''):
+                extractor.write(chunk)
+        extractor.close()
+        return extractor.facts
 
     @staticmethod
     def calc_time_diff(time_started: str, time_ended: str) -> float:
@@ -264,10 +604,24 @@ class GatherData:
         time_diff = unix_time_ended - unix_time_started
         return time_diff
 
-    def gather_data(self):
-        # workflow_run_jobs/*[0-9].json
-        workflow_files = glob.glob(
-            os.path.join(self.workflow_run_jobs_dir, '*[0-9].json'))
+    def iter_jobs(self, curr_time):
+        """Yield meta of jobs from fresh ones toward older ones: query the
+        catalog kept by fetch.py if it exists, read job API JSON files
+        otherwise."""
+        catalog = Catalog.open_existing(self.repo_path)
+        if catalog:
+            started_since = None
+            if self.since_seconds:
+                started_since = datetime.fromtimestamp(
+                    curr_time - self.since_seconds, timezone.utc).strftime(
+                    '%Y-%m-%dT%H:%M:%SZ')
+            yield from catalog.jobs(started_since=started_since,
+                                    limit=self.latest_n)
+            catalog.close()
+            return
+
+        # workflow_run_jobs/[<shard>/]*[0-9].json
+        workflow_files = self.layout.glob_job_meta()
 
         def sorter(filename):
             return int(NUM_MATCHER.search(filename).group(1))
@@ -276,12 +630,136 @@ class GatherData:
         if self.latest_n:
             job_json_files = job_json_files[:self.latest_n]
 
-        curr_time = datetime.timestamp(datetime.now())
         for job_json in job_json_files:
-
             # Load info about jobs from job API JSON file
             with open(job_json, 'r') as f:
-                job = json.load(f)
+                yield json.load(f)
+
+    def gather_job(self, job):
+        """Gather data about the job from its meta and log.
+
+        Returns the job data, the failure type to count in the failure
+        statistics (None if the job is not failed or has no log) and
+        messages to print. The caller prints the messages, so they go in the
+        same order whether jobs are processed in parallel or not."""
+        messages = []
+
+        if 'aarch64' in job['name']:
+            platform = 'aarch64'
+        else:
+            platform = 'amd64'
+
+        job_id = job['id']
+
+        if 'gc64' in job['name'] or platform == 'aarch64':
+            gc64 = 'True'
+        else:
+            gc64 = 'False'
+
+        # Load info about jobs and tests from .log, if there are logs
+        logs = self.layout.job_log_path(job_id)
+
+        time_queued = job.get('created_at', job['started_at'])
+        test_data = []
+        debug = 'unknown'
+        runner_version = 'unknown'
+        compiler = 'unknown'
+        job_failure_type = 'unknown'
+        failure_to_count = None
+
+        # Facts extracted by `fetch.py --ingest` or by a previous run save
+        # reading of the log.
+        facts = load_facts(logs)
+        cache_entry = None
+        # Whether the cache entry is changed and should be stored.
+        cache_dirty = False
+        if facts is None and self.cache:
+            log_key = self.cache.log_key(logs)
+            if log_key is not None:
+                cache_entry = self.cache.load(job_id, log_key)
+                facts = self.cache.facts(cache_entry)
+        if facts is None:
+            try:
+                facts = self.extract_facts(job, logs)
+            except FileNotFoundError:
+                messages.append(f'No logs for job {job_id}, {job["html_url"]}')
+            else:
+                if cache_entry is not None:
+                    self.cache.put_facts(cache_entry, facts)
+                    cache_dirty = True
+
+        if facts is not None:
+            time_queued = facts['queued_at'] or time_queued
+            test_data = self.get_test_data(facts['tests'])
+            debug = facts['debug']
+            runner_version = facts['runner_version']
+            compiler = facts['compiler_version']
+
+            if job['conclusion'] == 'failure':
+                # Detect failure type, collect total failures of certain type
+                failure = None
+                if cache_entry is not None:
+                    failure = self.cache.failure(cache_entry)
+                if failure is None:
+                    failure = detect_failure_type(logs, facts,
+                                                  self.failure_window)
+                    if cache_entry is not None:
+                        self.cache.put_failure(cache_entry, failure)
+                        cache_dirty = True
+                job_failure_type, failure_line = failure
+                if job_failure_type == self.watch_failure:
+                    messages.append(
+                        f'{job_id}  {job["name"]}\t'
+                        f' https://github.com/tarantool/tarantool/runs/'
+                        f'{job_id}?check_suite_focus=true\n'
+                        f'\t\t\t{failure_line}')
+                failure_to_count = job_failure_type
+
+        if cache_dirty:
+            self.cache.store(job_id, cache_entry)
+
+        # Get OS name and version
+        os_version = self.detect_os_version(job['name'])
+
+        # Save data to dict
+        gathered_job_data = {
+            'job_id': job_id,
+            'workflow_run_id': job['run_id'],
+            'job_name': job['name'],
+            'os_version': os_version,
+            'branch': job['head_branch'],
+            'commit_sha': job['head_sha'],
+            'conclusion': job['conclusion'],
+            'queued_at': time_queued,
+            'started_at': job['started_at'],
+            'time_in_queue': self.calc_time_diff(time_queued,
+                                                 job['started_at']),
+            'completed_at': job['completed_at'],
+            'job_duration': self.calc_time_diff(job['started_at'],
+                                                job['completed_at']),
+            'platform': platform,
+            'runner_label': ' '.join(job['labels']),
+            'gc64': gc64,
+            'debug': debug,
+            'html_url': job['html_url'],
+            'runner_name': job['runner_name'],
+            'runner_version': runner_version,
+            'failure_type': job_failure_type,
+            'compiler_version': compiler,
+            'libc_version': LIBC_VERSIONS.get(os_version, 'unknown'),
+        }
+        messages.append(
+            f'gathered job {job_id} started at {job["started_at"]}')
+
+        if test_data:
+            gathered_job_data.update(
+                {'failed_tests': test_data}
+            )
+        return gathered_job_data, failure_to_count, messages
+
+    def iter_jobs_since(self, curr_time):
+        """Jobs to gather: up to the first one older than `--since`."""
+        for job in self.iter_jobs(curr_time):
 
             # Don't process skipped and canceled job logs
             if job['conclusion'] in ['skipped', 'cancelled']:
@@ -295,299 +773,193 @@ class GatherData:
             if self.since_seconds:
                 job_started = github_time_to_unix(job['started_at'])
                 if curr_time - job_started > self.since_seconds:
-                    print(f'Found job {job_id} older then {self.since_seconds} '
-                          f'(started at {job["started_at"]}), break...')
-                    break
-
-            if 'aarch64' in job['name']:
-                platform = 'aarch64'
-            else:
-                platform = 'amd64'
-
-            job_id = job['id']
-
-            if 'gc64' in job['name'] or platform == 'aarch64':
-                gc64 = 'True'
-            else:
-                gc64 = 'False'
-
-            # Load info about jobs and tests from .log, if there are logs
-            logs = f'{self.workflow_run_jobs_dir}/{job_id}.log'
-
-            time_queued = job.get('created_at', job['started_at'])
-            test_data = []
-            debug = 'unknown'
-            runner_version = 'unknown'
-            compiler = 'unknown'
-            job_failure_type = 'unknown'
-
-            try:
-                with open(logs, 'r') as log_file:
-                    log_file_as_list = list(map(decolor, log_file))
-            except FileNotFoundError:
-                print(f'No logs for job {job_id}, {job["html_url"]}')
-            else:
-                # To get exact time the job was queued, we need to get the time
-                # in the first line of the log file
-                time_queued = get_log_datetime(log_file_as_list[0]) \
-                    or time_queued
-                test_data = self.get_test_data(log_file_as_list)
-                debug = self.get_release_or_debug(log_file_as_list)
-                runner_version = self.get_runner_version(log_file_as_list)
-                compiler = self.get_compiler_version(log_file_as_list)
-
-                if job['conclusion'] == 'failure':
-                    # Detect failure type, collect total failures of certain type
-                    job_failure_type, failure_line = detect_error(logs,
-                                                                  specific_failures)
-                    if job_failure_type == 'unknown_failure':
-                        job_failure_type, failure_line = detect_error(logs,
-                                                                      generic_failures)
-                    if job_failure_type == self.watch_failure:
-                        print(
-                            f'{job_id}  {job["name"]}\t'
-                            f' https://github.com/tarantool/tarantool/runs/'
-                            f'{job_id}?check_suite_focus=true\n'
-                            f'\t\t\t{failure_line}')
-                    results[job_failure_type] += 1
-                    results['total'] += 1
-
-            # Get OS name and version
-            os_version = self.detect_os_version(job['name'])
-
-            # Save data to dict
-            gathered_job_data = {
+                    self.stop_message = (
+                        f'Found job {job_id} older then {self.since_seconds} '
+                        f'(started at {job["started_at"]}), break...')
+                    return
+
+            yield job
+
+    def gather_in_processes(self, executor, jobs):
+        """Like `executor.map(gather_job, jobs)`, but take jobs lazily: only
+        a few chunks of jobs per worker are queued at once. So results don't
+        pile up in memory if they're written slower than gathered."""
+        pending = deque()
+        chunks = iter(lambda: list(itertools.islice(jobs, JOBS_CHUNK_SIZE)),
+                      [])
+        for chunk in chunks:
+            if len(pending) == self.jobs * JOBS_CHUNKS_PER_WORKER:
+                yield from pending.popleft().result()
+            pending.append(executor.submit(gather_jobs, chunk))
+        while pending:
+            yield from pending.popleft().result()
+
+    def gather_data(self, sink=None):
+        """Gather jobs and push the data of each job to the sink as soon as
+        it is gathered."""
+        curr_time = datetime.timestamp(datetime.now())
+        self.stop_message = None
+        jobs = self.iter_jobs_since(curr_time)
+
+        if self.jobs > 1:
+            # Results are given in the order of jobs, so the output is the
+            # same as of a serial run.
+            with ProcessPoolExecutor(max_workers=self.jobs,
+                                     initializer=init_worker,
+                                     initargs=(args,)) as executor:
+                self.collect(self.gather_in_processes(executor, jobs), sink)
+        else:
+            self.collect(map(self.gather_job, jobs), sink)
+
+        if self.stop_message:
+            print(self.stop_message)
+
+    def collect(self, gathered, sink):
+        """Handle results of gather_job() in the given order."""
+        for gathered_job_data, failure_type, messages in gathered:
+            for message in messages:
+                print(message)
+            if failure_type:
+                results[failure_type] += 1
+                results['total'] += 1
+            if sink:
+                sink.push(gathered_job_data)
+
+    def sink(self, output_format, writer=None):
+        """Sink of the gathered jobs for `--format` or None."""
+        if output_format == 'json':
+            return JSONSink(
+                os.path.join(self.output_dir, 'workflows.json'), 'job_id')
+        if output_format == 'ndjson':
+            return NDJSONSink(
+                os.path.join(self.output_dir, 'workflows.ndjson'))
+        if output_format == 'csv':
+            return CSVSink(os.path.join(self.output_dir, 'workflows.csv'),
+                           CSV_FIELDNAMES)
+        if output_format == 'parquet':
+            return ParquetJobsSink(os.path.join(self.output_dir, 'parquet'))
+        if output_format == 'influxdb':
+            return InfluxSink(self, writer, self.tests_flag, self.full_sync)
+        return None
+
+    def job_points(self, curr_job):
+        measurement = curr_job.get('failure_type') or curr_job['conclusion']
+
+        time_job_queued = github_time_to_unix(curr_job['queued_at'])
+
+        tags = {
+            'job_id': curr_job['job_id'],
+            'job_name': curr_job['job_name'].replace(",", ""),
+            'workflow_run_id': curr_job['workflow_run_id'],
+            'branch': curr_job['branch'],
+            'commit_sha': curr_job['commit_sha'],
+            'platform': curr_job['platform'],
+            'runner_label': curr_job['runner_label'],
+            'conclusion': curr_job['conclusion'],
+            'gc64': curr_job['gc64'],
+            'runner_version': curr_job['runner_version'],
+            'runner_name': curr_job['runner_name'],
+            'repository': self.repo_path,
+        }
+
+        fields = {
+            'value': 1,
+            'time_in_queue': int(curr_job['time_in_queue']),
+            'job_duration': int(curr_job['job_duration']),
+        }
+
+        data = {
+            'measurement': measurement,
+            'tags': tags,
+            'fields': fields,
+            # We have `time_job_queued` in seconds, but InfluxDB precision
+            # is nanoseconds, convert
+            'time': int(time_job_queued * 1e9)
+        }
+        return [data]
+
+    def test_points(self, job_info):
+        job_id = job_info['job_id']
+        points = []
+        for test in job_info['failed_tests']:
+            tags = {
+                'configuration': test['conf'],
+                'test_type': test['test_type'],
+                'test_subtype': test['test_subtype'],
+                'debug': job_info['debug'],
                 'job_id': job_id,
-                'workflow_run_id': job['run_id'],
-                'job_name': job['name'],
-                'os_version': os_version,
-                'branch': job['head_branch'],
-                'commit_sha': job['head_sha'],
-                'conclusion': job['conclusion'],
-                'queued_at': time_queued,
-                'started_at': job['started_at'],
-                'time_in_queue': self.calc_time_diff(time_queued,
-                                                     job['started_at']),
-                'completed_at': job['completed_at'],
-                'job_duration': self.calc_time_diff(job['started_at'],
-                                                    job['completed_at']),
-                'platform': platform,
-                'runner_label': ' '.join(job['labels']),
-                'gc64': gc64,
-                'debug': debug,
-                'html_url': job['html_url'],
-                'runner_name': job['runner_name'],
-                'runner_version': runner_version,
-                'failure_type': job_failure_type,
-                'compiler_version': compiler,
-                'libc_version': LIBC_VERSIONS.get(os_version, 'unknown'),
+                'job_name': job_info['job_name'].replace(",", ""),
+                'commit_sha': job_info['commit_sha'],
+                'test_attempt': test['test_attempt'],
+                'branch': job_info['branch'],
+                'architecture': job_info['platform'],
+                'gc64': job_info['gc64'],
+                'os_version': job_info['os_version'],
+                'compiler_version': job_info['compiler_version'],
+                'libc_version': job_info['libc_version'],
+                'repository': self.repo_path,
             }
-            print(f'gathered job {job_id} started at {job["started_at"]}')
-
-            if test_data:
-                gathered_job_data.update(
-                    {'failed_tests': test_data}
-                )
-            self.gathered_data[job_id] = gathered_job_data
-
-    def put_to_db_job(self):
-        influx_job_bucket = os.environ['INFLUX_JOB_BUCKET']
-        influx_org = os.environ['INFLUX_ORG']
-        data_list = list()
-
-        print('Writing job data to InfluxDB...')
-        for job in list(self.gathered_data.keys()):
-            curr_job = self.gathered_data[job]
-
-            measurement = curr_job.get('failure_type') or curr_job['conclusion']
+            time = github_time_to_unix(job_info['started_at'])
+            data = {
+                'measurement': test['name'],
+                'tags': tags,
+                'fields': {
+                    'value': 1
+                },
+                'time': int(time * 1e9)
 
-            time_job_queued = github_time_to_unix(curr_job['queued_at'])
+            }
+            points.append(data)
+        return points
 
+    def table_points(self, job_info, artifact_url):
+        base_url = f'github.com/{self.repo_path}'
+        s3_url = self.s3_url
+        job_id = job_info['job_id']
+        # The log may be stored compressed.
+        log_path = self.layout.job_log_path(job_id)
+        log_name = self.layout.relpath(find_log(log_path) or log_path)
+        job_json = self.layout.relpath(self.layout.job_meta_path(job_id))
+        points = []
+        for test in job_info['failed_tests']:
             tags = {
-                'job_id': curr_job['job_id'],
-                'job_name': curr_job['job_name'].replace(",", ""),
-                'workflow_run_id': curr_job['workflow_run_id'],
-                'branch': curr_job['branch'],
-                'commit_sha': curr_job['commit_sha'],
-                'platform': curr_job['platform'],
-                'runner_label': curr_job['runner_label'],
-                'conclusion': curr_job['conclusion'],
-                'gc64': curr_job['gc64'],
-                'runner_version': curr_job['runner_version'],
-                'runner_name': curr_job['runner_name'],
+                'configuration': test['conf'],
+                'test_type': test['test_type'],
+                'test_subtype': test['test_subtype'],
+                'debug': job_info['debug'],
+                'job_id': job_id,
+                'job_name': job_info['job_name'].replace(",", ""),
+                'commit_sha': job_info['commit_sha'],
+                'test_attempt': test['test_attempt'],
+                'branch': job_info['branch'],
+                'architecture': job_info['platform'],
+                'gc64': job_info['gc64'],
+                'os_version': job_info['os_version'],
+                'compiler_version': job_info['compiler_version'],
+                'libc_version': job_info['libc_version'],
                 'repository': self.repo_path,
+                'job_link': job_info['html_url'].lstrip('https://'),
+                'commit_link': f"{base_url}/commit/{job_info['commit_sha']}",
+                'job_json': f"{s3_url}/{job_json}",
+                'job_log': f"{s3_url}/{log_name}",
+                'workflow_run_json': f"{s3_url}/workflow_runs/"
+                                     f"{job_info['workflow_run_id']}.json",
+                # Link to the artifact if it is saved to S3.
+                'artifact_url': str(artifact_url),
             }
 
-            fields = {
-                'value': 1,
-                'time_in_queue': int(curr_job['time_in_queue']),
-                'job_duration': int(curr_job['job_duration']),
-            }
-
+            time = github_time_to_unix(job_info['started_at'])
             data = {
-                'measurement': measurement,
+                'measurement': test['name'],
                 'tags': tags,
-                'fields': fields,
-                # We have `time_job_queued` in seconds, but InfluxDB precision
-                # is nanoseconds, convert
-                'time': int(time_job_queued * 1e9)
+                'fields': {
+                    'value': 1
+                },
+                'time': int(time * 1e9)
+
             }
-            data_list.append(data)
-            if len(data_list) == 1000:
-                write_api = influx_connector()
-                write_api.write(influx_job_bucket, influx_org, data_list)
-                print('Chunk of 1000 records put to InfluxDB')
-                data_list = []
-
-        write_api = influx_connector()
-        write_api.write(influx_job_bucket, influx_org, data_list)
-        print(f'Chunk of {len(data_list)} records put to InfluxDB')
-
-    def put_to_db_test(self):
-        influx_test_bucket = os.environ['INFLUX_TEST_BUCKET']
-        influx_org = os.environ['INFLUX_ORG']
-        data_list = []
-        print('Writing test data to InfluxDB...')
-        for job_id in filter(
-                lambda x: 'failed_tests' in list(self.gathered_data[x].keys()),
-                list(self.gathered_data.keys())):
-            job_info = self.gathered_data[job_id]
-            for test in job_info.get('failed_tests'):
-                tags = {
-                    'configuration': test['conf'],
-                    'test_type': test['test_type'],
-                    'test_subtype': test['test_subtype'],
-                    'debug': job_info['debug'],
-                    'job_id': job_id,
-                    'job_name': job_info['job_name'].replace(",", ""),
-                    'commit_sha': job_info['commit_sha'],
-                    'test_attempt': test['test_attempt'],
-                    'branch': job_info['branch'],
-                    'architecture': job_info['platform'],
-                    'gc64': job_info['gc64'],
-                    'os_version': job_info['os_version'],
-                    'compiler_version': job_info['compiler_version'],
-                    'libc_version': job_info['libc_version'],
-                    'repository': self.repo_path,
-                }
-                time = github_time_to_unix(
-                    self.gathered_data[job_id]['started_at'])
-                data = {
-                    'measurement': test['name'],
-                    'tags': tags,
-                    'fields': {
-                        'value': 1
-                    },
-                    'time': int(time * 1e9)
-
-                }
-                data_list.append(data)
-                if len(data_list) == 1000:
-                    write_api = influx_connector()
-                    write_api.write(influx_test_bucket, influx_org, data_list)
-                    print('Chunk of 1000 records put to InfluxDB')
-                    data_list = []
-
-        write_api = influx_connector()
-        write_api.write(influx_test_bucket, influx_org, data_list)
-        print(f'Chunk of {len(data_list)} records put to InfluxDB')
-
-    def put_data_for_table_to_db(self):
-        influx_test_bucket = os.environ['INFLUX_TABLE_BUCKET']
-        influx_org = os.environ['INFLUX_ORG']
-        data_list = []
-        base_url = f'github.com/{self.repo_path}'
-        s3_url = f'multivac.hb.vkcs.cloud/{self.repo_path}'
-        print('Writing data for tests table to InfluxDB...')
-        for job_id in filter(
-                lambda x: 'failed_tests' in list(self.gathered_data[x].keys()),
-                list(self.gathered_data.keys())):
-            job_info = self.gathered_data[job_id]
-            for test in job_info.get('failed_tests'):
-                tags = {
-                    'configuration': test['conf'],
-                    'test_type': test['test_type'],
-                    'test_subtype': test['test_subtype'],
-                    'debug': job_info['debug'],
-                    'job_id': job_id,
-                    'job_name': job_info['job_name'].replace(",", ""),
-                    'commit_sha': job_info['commit_sha'],
-                    'test_attempt': test['test_attempt'],
-                    'branch': job_info['branch'],
-                    'architecture': job_info['platform'],
-                    'gc64': job_info['gc64'],
-                    'os_version': job_info['os_version'],
-                    'compiler_version': job_info['compiler_version'],
-                    'libc_version': job_info['libc_version'],
-                    'repository': self.repo_path,
-                    'job_link': job_info['html_url'].lstrip('https://'),
-                    'commit_link': f"{base_url}/commit/{job_info['commit_sha']}",
-                    'job_json': f"{s3_url}/workflow_run_jobs/{job_id}.json",
-                    'job_log': f"{s3_url}/workflow_run_jobs/{job_id}.log",
-                    'workflow_run_json': f"{s3_url}/workflow_runs/"
-                                         f"{job_info['workflow_run_id']}.json",
-                    'artifact_url': 'None'
-                }
-
-                # Store link to the artifact if artifact saved to S3
-                artifact_url = f"{s3_url}/artifacts/{job_info['workflow_run_id']}/{job_id}.zip"
-                if requests.head(f"http://{artifact_url}").status_code == 200:
-                    tags['artifact_url'] = artifact_url
-
-                time = github_time_to_unix(
-                    self.gathered_data[job_id]['started_at'])
-                data = {
-                    'measurement': test['name'],
-                    'tags': tags,
-                    'fields': {
-                        'value': 1
-                    },
-                    'time': int(time * 1e9)
-
-                }
-                data_list.append(data)
-                if len(data_list) == 1000:
-                    write_api = influx_connector()
-                    write_api.write(influx_test_bucket, influx_org, data_list)
-                    print('Chunk of 1000 records put to InfluxDB')
-                    data_list = []
-
-        write_api = influx_connector()
-        write_api.write(influx_test_bucket, influx_org, data_list)
-        print(f'Chunk of {len(data_list)} records put to InfluxDB')
-
-    def write_json(self):
-        if not os.path.isdir(self.output_dir):
-            os.makedirs(self.output_dir)
-        output_file = os.path.join(self.output_dir + '/workflows.json')
-        with open(output_file, 'w') as jsonfile:
-            json.dump(self.gathered_data, jsonfile, indent=2)
-
-    def write_csv(self):
-        if not os.path.isdir(self.output_dir):
-            os.makedirs(self.output_dir)
-        output_file = os.path.join(self.output_dir + '/workflows.csv')
-        fieldnames = [
-            'job_id',
-            'workflow_run_id',
-            'job_name',
-            'branch',
-            'commit_sha',
-            'conclusion',
-            'queued_at',
-            'started_at',
-            'completed_at',
-            'platform',
-            'runner_label',
-            'runner_name',
-            'runner_version',
-            'failure_type',
-        ]
-        with open(output_file, 'w') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            for job_data in self.gathered_data.values():
-                writer.writerow(job_data)
+            points.append(data)
+        return points
 
     def print_failure_stats(self):
         if args.failure_stats:
@@ -598,11 +970,29 @@ class GatherData:
                     print(type, count)
 
 
+# GatherData of a `--jobs` worker process, see init_worker().
+worker_gatherer = None
+
+
+def init_worker(cli_args):
+    """Prepare a `--jobs` worker process: it may be started from scratch
+    rather than forked."""
+    global args, worker_gatherer
+    args = cli_args
+    for failure_specs in (specific_failures, generic_failures):
+        failure_matcher(failure_specs)
+    worker_gatherer = GatherData(cli_args)
+
+
+def gather_jobs(jobs):
+    return [worker_gatherer.gather_job(job) for job in jobs]
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description='Gather data about GitHub workflows')
     parser.add_argument(
-        '--format', choices=['json', 'csv', 'influxdb'],
+        '--format', choices=['json', 'ndjson', 'csv', 'parquet', 'influxdb'],
         help='write gathered data in the specified format'
     )
     parser.add_argument(
@@ -626,12 +1016,30 @@ if __name__ == '__main__':
     parser.add_argument('--repo-path', type=str, default='tarantool/tarantool',
                         help='repository (without owner)')
     parser.add_argument('--tests', '-t', action='store_true')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='process jobs in N processes')
+    parser.add_argument('--nocache', action='store_true',
+                        help="don't use and don't update the cache of data "
+                             "extracted from logs")
+    parser.add_argument('--failure-scan-kib', type=int,
+                        help='look for a failure only in last N KiB of a log')
+    parser.add_argument('--influx-batch-size', type=int, default=1000,
+                        help='write to InfluxDB in batches of N points')
+    parser.add_argument('--influx-flush-interval', type=int, default=1000,
+                        help='write a batch to InfluxDB at least each N '
+                             'milliseconds')
+    parser.add_argument('--full-sync', action='store_true',
+                        help='write to InfluxDB all jobs, not only changed '
+                             'since the last run')
+    parser.add_argument('--s3-url', type=str, default=S3_URL,
+                        help='S3 mirror of the storage ({} is the '
+                             'repository path), without a scheme')
 
     args = parser.parse_args()
 
     # compile regular expressions
-    compile_failure_specs(specific_failures)
-    compile_failure_specs(generic_failures)
+    failure_matcher(specific_failures)
+    failure_matcher(generic_failures)
 
     results = {failure_type['type']: 0 for failure_type in generic_failures}
     results.update(
@@ -640,15 +1048,18 @@ if __name__ == '__main__':
     results.update({'total': 0})
 
     result = GatherData(args)
-    result.gather_data()
-    if args.format == 'json':
-        result.write_json()
-    if args.format == 'csv':
-        result.write_csv()
     if args.format == 'influxdb':
-        result.put_to_db_job()
-        if args.tests:
-            result.put_to_db_test()
-            result.put_data_for_table_to_db()
+        print('Writing data to InfluxDB...')
+        with InfluxWriter(args.influx_batch_size,
+                          args.influx_flush_interval) as writer:
+            with result.sink(args.format, writer) as sink:
+                result.gather_data(sink)
+        # All points are written.
+        sink.save_sync_states()
+    elif args.format:
+        with result.sink(args.format) as sink:
+            result.gather_data(sink)
+    else:
+        result.gather_data()
     if args.failure_stats:
         result.print_failure_stats()
@@ -1,12 +1,130 @@
-from os import getenv
-from influxdb_client import InfluxDBClient, WriteApi
-from influxdb_client.client.write_api import SYNCHRONOUS
+import hashlib
+import json
+import os
+from threading import Lock
+from influxdb_client import InfluxDBClient
+from influxdb_client.client.write_api import WriteOptions
+from multivac.storage import atomic_write
 
 
-def influx_connector() -> WriteApi:
-    org = getenv('INFLUX_ORG')
-    token = getenv('INFLUX_TOKEN')
-    url = getenv('INFLUX_URL')
+class InfluxWriteError(Exception):
+    pass
 
-    client = InfluxDBClient(url=url, token=token, org=org)
-    return client.write_api(write_options=SYNCHRONOUS)
+
+class InfluxWriter:
+    """ Writes points to InfluxDB over one client.
+
+        Points are collected in batches of `batch_size` points (or for
+        `flush_interval` milliseconds at most) and written in the
+        background, gzipped, over the pooled connections of the
+        client. The failed writes are reported by `close()`, which
+        waits for all points to be written.
+
+        The connection is configured by the INFLUX_URL, INFLUX_TOKEN
+        and INFLUX_ORG environment variables.
+    """
+
+    def __init__(self, batch_size=1000, flush_interval=1000):
+        self.org = os.getenv('INFLUX_ORG')
+        self.client = InfluxDBClient(url=os.getenv('INFLUX_URL'),
+                                     token=os.getenv('INFLUX_TOKEN'),
+                                     org=self.org, enable_gzip=True)
+        self.lock = Lock()
+        self.errors = []
+        write_options = WriteOptions(batch_size=batch_size,
+                                     flush_interval=flush_interval)
+        self.write_api = self.client.write_api(
+            write_options=write_options,
+            success_callback=self.on_success,
+            error_callback=self.on_error)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def count(data):
+        """ Amount of points in a written batch of line protocol. """
+        if isinstance(data, bytes):
+            return data.count(b'\n') + 1
+        return data.count('\n') + 1
+
+    def on_success(self, conf, data):
+        bucket, _, _ = conf
+        print(f'Chunk of {self.count(data)} records put to InfluxDB '
+              f'bucket {bucket}')
+
+    def on_error(self, conf, data, exception):
+        bucket, _, _ = conf
+        print(f'Failed to put chunk of {self.count(data)} records to '
+              f'InfluxDB bucket {bucket}: {exception}')
+        with self.lock:
+            self.errors.append(exception)
+
+    def write(self, bucket, points):
+        """ Queue points (dicts or `Point` objects) for writing. """
+        self.write_api.write(bucket, self.org, points)
+
+    def close(self):
+        """ Write the queued points and close the connections.
+
+            Raise InfluxWriteError if some of the points are not
+            written.
+        """
+        try:
+            self.write_api.close()
+        finally:
+            self.client.close()
+        if self.errors:
+            raise InfluxWriteError('{} chunk(s) of records are not put to '
+                                   'InfluxDB'.format(len(self.errors)))
+
+
+class SyncState:
+    """ What is written to an InfluxDB bucket by the previous run:
+        a digest of points of each job.
+
+        Points of a job are written again only if they're changed:
+        say, the job is gathered by another version of the sensors
+        or with other failure specifications. The state keeps only
+        jobs of the last run: jobs that went out of the `--since`
+        window are not written again anyway.
+
+        The state is saved by `save()`, which should be called only
+        after the points are written successfully.
+    """
+
+    def __init__(self, path, bucket, full=False):
+        self.path = path
+        self.bucket = bucket
+        self.digests = dict()
+        self.new_digests = dict()
+        if full:
+            return
+        try:
+            with open(path, 'r') as f:
+                state = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        # Another bucket: everything should be written.
+        if state.get('bucket') == bucket:
+            self.digests = state['jobs']
+
+    @staticmethod
+    def digest(points):
+        data = json.dumps(points, sort_keys=True, default=str)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def changed(self, job_id, points):
+        """ Whether the points of the job should be written. """
+        digest = self.digest(points)
+        job_id = str(job_id)
+        self.new_digests[job_id] = digest
+        return self.digests.get(job_id) != digest
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with atomic_write(self.path) as f:
+            json.dump({'bucket': self.bucket, 'jobs': self.new_digests}, f)
@@ -2,7 +2,6 @@
 
 import os
 import sys
-import glob
 from datetime import datetime
 import json
 import csv
@@ -19,6 +18,8 @@ bucket_url = bucket_url_unstripped.strip("'")
 PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(PROJECT_DIR)
 from multivac.sensors import test_status  # noqa: E402
+from multivac.storage import Layout, find_log  # noqa: E402
+from multivac.catalog import Catalog  # noqa: E402
 
 parser = argparse.ArgumentParser(description="""
     Search for fails and sort by last occurence.
@@ -37,13 +38,20 @@ branch_list = args.branch
 result_format = args.format
 
 output_dir = 'output'
-workflow_runs_dir = f'{args.repo_path}/workflow_runs'
-workflow_run_jobs_dir = f'{args.repo_path}/workflow_run_jobs'
+layout = Layout(args.repo_path)
 org_repo = args.repo_path
 
 
-def fails(log):
-    for event in test_status.execute(log):
+def fails(log, test_statuses=None):
+    """ Fails found in the log or in the given test statuses stored in
+        the catalog.
+    """
+    if test_statuses is None:
+        events = test_status.execute(log)
+    else:
+        events = test_status.events(
+            test_status.smart_status_iter(test_statuses))
+    for event in events:
         if event['event'] != 'test status':
             continue
         status = event['status']
@@ -51,26 +59,47 @@ def fails(log):
             yield event['test'], event['conf'], status
 
 
+def jobs_with_logs():
+    """ Yield (log, job meta, branch, test statuses) of jobs of the
+        requested branches, which have logs.
+
+        The jobs are queried from the catalog kept by fetch.py if it
+        exists. Test statuses are given if they're stored in the
+        catalog, they're None otherwise.
+    """
+    catalog = Catalog.open_existing(args.repo_path)
+    if catalog:
+        for job in catalog.jobs(branches=branch_list, with_log=True):
+            log = os.path.join(args.repo_path, job['log_path'])
+            yield log, job, job['run_branch'], \
+                catalog.test_outcomes(job['id'])
+        catalog.close()
+        return
+
+    for log in layout.glob_logs():
+        # Load job meta.
+        job_meta_path = log[:-len('.log')] + '.json'
+        with open(job_meta_path, 'r') as f:
+            job = json.load(f)
+
+        # Load workflow run meta.
+        run_id = str(job['run_id'])
+        run_meta_path = layout.run_meta_path(run_id)
+        with open(run_meta_path, 'r') as f:
+            run = json.load(f)
+
+        # Skip branches, which were not requested.
+        branch = run['head_branch']
+        if branch not in branch_list:
+            continue
+
+        yield log, job, branch, None
+
+
 timestamps_min = dict()
 timestamps_max = dict()
 res = dict()
-for log in glob.glob(os.path.join(workflow_run_jobs_dir, '*.log')):
-    # Load job meta.
-    job_meta_path = log.split('.', 1)[0] + '.json'
-    with open(job_meta_path, 'r') as f:
-        job = json.load(f)
-
-    # Load workflow run meta.
-    run_id = str(job['run_id'])
-    run_meta_path = os.path.join(workflow_runs_dir, run_id + '.json')
-    with open(run_meta_path, 'r') as f:
-        run = json.load(f)
-
-    # Skip branches, which were not requested.
-    branch = run['head_branch']
-    if branch not in branch_list:
-        continue
-
+for log, job, branch, test_statuses in jobs_with_logs():
     timestamp_str = job['started_at'].rstrip('Z') + '+00:00'
     timestamp = datetime.fromisoformat(timestamp_str)
     if branch not in timestamps_min or timestamps_min[branch] > timestamp:
@@ -88,7 +117,7 @@ for log in glob.glob(os.path.join(workflow_run_jobs_dir, '*.log')):
         labels = [label.split('-', 1)[0] for label in labels]
     runs_on = ','.join(labels)
 
-    for test, conf, status in fails(log):
+    for test, conf, status in fails(log, test_statuses):
         key = (test, conf, status, runs_on)
         if key not in res:
             res[key] = (timestamp, branch, 1, job_id, run_id)
@@ -127,8 +156,12 @@ def write_csv():
         test, conf, status, runs_on = key
         timestamp, branch, count, job_id, run_id = value
         url = f"https://github.com/{org_repo}/runs/{job_id}?check_suite_focus=true"
-        job_json = f'{bucket_url}/{org_repo}/workflow_run_jobs/{job_id}.json'
-        job_log = f'{bucket_url}/{org_repo}/workflow_run_jobs/{job_id}.log'
+        job_json = layout.relpath(layout.job_meta_path(job_id))
+        job_json = f'{bucket_url}/{org_repo}/{job_json}'
+        # The log may be stored compressed.
+        log_path = layout.job_log_path(job_id)
+        log_name = layout.relpath(find_log(log_path) or log_path)
+        job_log = f'{bucket_url}/{org_repo}/{log_name}'
         run_json = f'{bucket_url}/{org_repo}/workflow_runs/{run_id}.json'
         w.writerow([timestamp, test, conf, branch, status, count, runs_on,
                     url, job_json, job_log, run_json, ])
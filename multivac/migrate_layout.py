@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+""" Convert a flat storage of workflow run jobs into the sharded
+    layout in place (see storage.Layout).
+
+    Files are moved from `workflow_run_jobs/` into
+    `workflow_run_jobs/<shard>/` and the layout is recorded only
+    after all of them are moved. If the migration is interrupted,
+    just run it again: it continues with the files left.
+
+    Don't run fetch.py and the reporting scripts on the storage
+    during the migration.
+"""
+
+import argparse
+import os
+import sys
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_DIR)
+from multivac.catalog import Catalog  # noqa: E402
+from multivac.storage import Layout, TEMP_SUFFIX  # noqa: E402
+
+
+def migrate(repo_path):
+    """ Move job files of the storage into shards.
+
+        Return amount of moved files.
+    """
+    layout = Layout(repo_path)
+    if layout.sharded:
+        print('{}: already sharded'.format(repo_path))
+        return 0
+
+    jobs_dir = layout.workflow_run_jobs_dir
+    # Collect the names first: the directory is changed below.
+    with os.scandir(jobs_dir) as it:
+        names = [entry.name for entry in it if entry.is_file()]
+
+    moved = 0
+    shard_dirs = set()
+    for name in names:
+        path = os.path.join(jobs_dir, name)
+        # Left by a killed fetch.py.
+        if name.endswith(TEMP_SUFFIX):
+            os.remove(path)
+            continue
+        job_id = name.split('.', 1)[0]
+        if not job_id.isdigit():
+            continue
+        shard_dir = os.path.join(jobs_dir, layout.shard(job_id))
+        if shard_dir not in shard_dirs:
+            os.makedirs(shard_dir, exist_ok=True)
+            shard_dirs.add(shard_dir)
+        os.rename(path, os.path.join(shard_dir, name))
+        moved += 1
+        if moved % 10000 == 0:
+            print('{}: moved {} of {} files'.format(repo_path, moved,
+                                                    len(names)))
+
+    layout.store(Layout.SHARDED)
+    print('{}: moved {} files into {} shards'.format(repo_path, moved,
+                                                     len(shard_dirs)))
+
+    # Log paths are changed.
+    catalog = Catalog.open_existing(repo_path, incomplete=True)
+    if catalog:
+        job_count = catalog.rebuild()
+        catalog.close()
+        print('{}: updated {} jobs in {}'.format(repo_path, job_count,
+                                                 catalog.path))
+    return moved
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Convert a flat storage of workflow run jobs into the '
+                    'sharded layout in place')
+    parser.add_argument('repo_path', type=str, nargs='+',
+                        help='owner/repository')
+    args = parser.parse_args()
+
+    for repo_path in args.repo_path:
+        migrate(repo_path)
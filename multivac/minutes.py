@@ -2,21 +2,27 @@
 
 import math
 import os
-import glob
-import re
+import sys
 import json
 from datetime import datetime, timedelta
 import argparse
 
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_DIR)
+from multivac.catalog import Catalog  # noqa: E402
+from multivac.storage import Layout  # noqa: E402
+
 
 parser = argparse.ArgumentParser(description='Machine time spent in jobs')
 parser.add_argument('--short', action='store_true',
                     help="Coalesce 'runs-on' labels by a first word")
+parser.add_argument('--repo-path', type=str, default='.',
+                    help="owner/repository storage directory (the current "
+                         "directory by default)")
 args = parser.parse_args()
 
 
-workflow_runs_dir = 'workflow_runs'
-workflow_run_jobs_dir = 'workflow_run_jobs'
+layout = Layout(args.repo_path)
 
 
 def timestamp(timestamp_from_github):
@@ -45,8 +51,26 @@ def print_minutes(header, acc, k2_list):
         print('{} {}'.format(k1, summary_str))
 
 
-JOB_META_PATH_RE = re.compile(r'^{}/[0-9]+.json$'.format(
-    workflow_run_jobs_dir))
+def jobs():
+    """ Yield meta of jobs, which were not skipped: query the catalog
+        kept by fetch.py if it exists, read job meta files otherwise.
+    """
+    catalog = Catalog.open_existing(args.repo_path)
+    if catalog:
+        yield from catalog.jobs(exclude_conclusions=('skipped',))
+        catalog.close()
+        return
+
+    for job_meta_path in layout.glob_job_meta():
+        # Load job meta.
+        with open(job_meta_path, 'r') as f:
+            job = json.load(f)
+
+        if job['conclusion'] == 'skipped':
+            continue
+
+        yield job
+
 
 # Splitted by day / week / month, then by 'runs-on'.
 minutes_per_day = dict()
@@ -55,25 +79,7 @@ minutes_per_month = dict()
 
 known_runs_on = set()
 
-for job_meta_path in glob.glob(os.path.join(workflow_run_jobs_dir, '*.json')):
-    # Skip everything except workflow run job meta:
-    # say, *.log.test_status.cache.json files.
-    if not JOB_META_PATH_RE.match(job_meta_path):
-        continue
-
-    # Load job meta.
-    with open(job_meta_path, 'r') as f:
-        job = json.load(f)
-
-    # Load workflow run meta.
-    run_id = str(job['run_id'])
-    run_meta_path = os.path.join(workflow_runs_dir, run_id + '.json')
-    with open(run_meta_path, 'r') as f:
-        run = json.load(f)
-
-    if job['conclusion'] == 'skipped':
-        continue
-
+for job in jobs():
     started_at = timestamp(job['started_at'])
     completed_at = timestamp(job['completed_at'])
     # I hope GitHub does not count 1.5 minutes job as 2 minutes.
@@ -1,5 +1,11 @@
 import re
 
+try:
+    from re import _parser
+except ImportError:
+    # Python < 3.11.
+    import sre_parse as _parser
+
 failure_categories = [
     {
         'tag': 'git',
@@ -259,3 +265,114 @@ def compile_failure_specs(failure_specs):
         failure_type.update(
             {'re_compiled': [re.compile(expression) for expression in failure_type['re']]}
         )
+
+
+# Shortest substring, which is worth to look for before trying the
+# regular expressions.
+MIN_LITERAL_LEN = 3
+
+
+def required_literal(pattern):
+    """ The longest literal substring, which any line matching the
+        pattern contains, or None if it can't be found.
+
+        Only runs of literal characters at the top level of the
+        pattern are considered: they're matched in any case.
+    """
+    try:
+        parsed = _parser.parse(pattern)
+    except Exception:
+        return None
+    if parsed.state.flags & re.IGNORECASE:
+        return None
+    runs = ['']
+    for op, av in parsed:
+        if op is _parser.LITERAL:
+            runs[-1] += chr(av)
+        elif runs[-1]:
+            runs.append('')
+    literal = max(runs, key=len)
+    if len(literal) < MIN_LITERAL_LEN:
+        return None
+    return literal
+
+
+class FailureMatcher:
+    """ All the failure specifications of a list compiled into one
+        regular expression: an alternation of the patterns in the
+        list order, each in its own named group.
+
+        A line is tried against the combined expression only if it
+        contains a literal substring required by one of the patterns
+        (a single search of an alternation of the literals). Lines
+        matching nothing, which is nearly all of them, are rejected
+        by this search.
+
+        The result is the same as of checking the patterns one by
+        one: the first matching specification of the list wins.
+
+        The same prefilter is available for raw bytes of a line (see
+        could_match()), so a line may be decoded only if it could
+        match.
+    """
+
+    def __init__(self, failure_specs):
+        self.types = []
+        patterns = []
+        literals = set()
+        prefilter = True
+        for failure_type in failure_specs:
+            for expression in failure_type['re']:
+                patterns.append('(?P<f{}>{})'.format(len(self.types),
+                                                     expression))
+                self.types.append(failure_type['type'])
+                literal = required_literal(expression)
+                if literal is None:
+                    prefilter = False
+                literals.add(literal)
+        self.regexp = re.compile('|'.join(patterns))
+        self.prefilter = None
+        self.bytes_prefilter = None
+        if prefilter and literals:
+            literals = sorted(literals, key=len, reverse=True)
+            self.prefilter = re.compile('|'.join(
+                re.escape(literal) for literal in literals))
+            self.bytes_prefilter = re.compile(b'|'.join(
+                re.escape(literal.encode('utf-8')) for literal in literals))
+
+    def could_match(self, raw_line):
+        """ Whether the UTF-8 encoded line may match. """
+        return self.bytes_prefilter is None or \
+            self.bytes_prefilter.search(raw_line) is not None
+
+    def match(self, line):
+        """ Type of the first specification matching the line or
+            None.
+        """
+        if self.prefilter and not self.prefilter.search(line):
+            return None
+        m = self.regexp.match(line)
+        if m is None:
+            return None
+        return self.types[int(m.lastgroup[1:])]
+
+
+# id() of a failure specification list -> (the list, its matcher).
+# The list is kept to don't reuse its id().
+_matchers = {}
+
+
+def failure_matcher(failure_specs):
+    """ FailureMatcher of the given list compiled once. """
+    entry = _matchers.get(id(failure_specs))
+    if entry is None:
+        entry = (failure_specs, FailureMatcher(failure_specs))
+        _matchers[id(failure_specs)] = entry
+    return entry[1]
+
+
+def match_failure(line, failure_specs):
+    """ Type of the first failure specification matching the line or
+        None.
+    """
+    return failure_matcher(failure_specs).match(line)
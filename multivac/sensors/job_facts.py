@@ -0,0 +1,211 @@
+""" Facts about a CI job extracted from its log in one pass.
+
+    The extractor is fed with the log content as it is downloaded
+    (see fetch.py --ingest) and the facts are stored next to the
+    job metainformation: `<id>.facts.json`. Downstream tools use
+    the facts instead of reading the log again.
+"""
+
+import codecs
+import hashlib
+import io
+import json
+import os
+import re
+
+from multivac.sensors import failures
+from multivac.sensors import test_status
+from multivac.sensors.failures import specific_failures, generic_failures, \
+    failure_matcher, match_failure
+from multivac.sensors.test_status import TestStatusParser
+
+
+COLOR_RE = re.compile('\033' + r'\[\d(?:;\d\d)?m')
+COMPILER_RE = re.compile(r'C compiler identification is '
+                         r'(\S* \d*.\d*.\d*)')
+DATETIME_RE = re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}')
+RUNNER_VERSION_RE = re.compile(r"Current runner version: "
+                               r"'(\d*.\d*.\d*)'")
+FREEBSD_RUNNER_VERSION_RE = re.compile(r"Runner Version: "
+                                       r"(\d*.\d*.\S*)")
+
+
+def _sources_digest(filepaths):
+    sha1 = hashlib.sha1()
+    for filepath in filepaths:
+        with open(filepath, 'rb') as f:
+            sha1.update(f.read())
+    return sha1.hexdigest()
+
+
+# Facts extracted by another version of the sensors or with other
+# failure specifications are not used.
+FACTS_VERSION = _sources_digest([
+    failures.__file__,
+    test_status.__file__,
+    __file__,
+])
+# Versions of the facts except the failure and of the failure
+# specifications alone: a change of the specifications affects
+# only failures found before.
+SENSORS_VERSION = _sources_digest([
+    test_status.__file__,
+    __file__,
+])
+FAILURES_VERSION = _sources_digest([
+    failures.__file__,
+])
+
+
+def decolor(data):
+    return COLOR_RE.sub('', data)
+
+
+def get_log_datetime(log_line: str) -> str:
+    # Get ISO format date and time from the log line
+    datetime_match = DATETIME_RE.search(log_line)
+    if datetime_match:
+        return f'{datetime_match.group(0)}Z'
+    return ''
+
+
+def get_facts_filepath(log_filepath):
+    """ `<id>.facts.json` path for the given `<id>.log` path. """
+    return '{}.facts.json'.format(os.path.splitext(log_filepath)[0])
+
+
+def load_facts(log_filepath):
+    """ Facts about the job stored by fetch.py or None if there are
+        no facts or they are extracted by another version of the
+        sensors.
+    """
+    try:
+        with open(get_facts_filepath(log_filepath), 'r') as f:
+            facts = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if facts.get('version') != FACTS_VERSION:
+        return None
+    return facts
+
+
+class JobFactsExtractor:
+    """ Extract facts from a job log fed by chunks of bytes.
+
+        Lines are decoded and split the same way as a log file
+        opened in the text mode is read, so the facts are the same
+        as ones gathered from the stored log:
+
+        * queued_at -- time of the first log line.
+        * debug -- 'True' for a Debug build, 'False' otherwise.
+        * runner_version, compiler_version.
+        * tests -- (test, conf, status) list of the decolored log.
+        * failure -- the last line matching a failure of each
+          specification: {'specific': (type, line) or None,
+          'generic': <..>}. Only if `detect_failure` is set.
+
+        The test statuses of the log as is are collected into
+        `test_status_cache` in the `test_status.execute()` cache
+        format unless `cache_test_statuses` is False.
+
+        Set `partial` if the log is fed not from the beginning (see
+        fetch.py --tail-kib): the time of its first line is not the
+        queue time then.
+    """
+
+    def __init__(self, detect_failure=False, cache_test_statuses=True):
+        self.detect_failure = detect_failure
+        self.cache_test_statuses = cache_test_statuses
+        self.partial = False
+        if detect_failure:
+            for failure_specs in (specific_failures, generic_failures):
+                failure_matcher(failure_specs)
+        self.reset()
+
+    def reset(self):
+        """ Forget everything fed before: say, on a retry of the
+            download.
+        """
+        self._decoder = io.IncrementalNewlineDecoder(
+            codecs.getincrementaldecoder('utf-8')(errors='replace'),
+            translate=True)
+        self._tail = ''
+        self._raw_parser = None
+        if self.cache_test_statuses:
+            self._raw_parser = TestStatusParser()
+        self._parser = TestStatusParser()
+        self._tests = []
+        self._queued_at = None
+        self._debug = 'False'
+        self._runner_version = None
+        self._compiler_version = 'undefined_compiler'
+        self._failures = {'specific': None, 'generic': None}
+
+    def write(self, chunk):
+        self._feed_text(self._decoder.decode(chunk))
+
+    def _feed_text(self, text):
+        lines = (self._tail + text).split('\n')
+        self._tail = lines.pop()
+        for line in lines:
+            self.feed(line + '\n')
+
+    def feed(self, line):
+        """ Process a line including its trailing newline. """
+        if self._raw_parser:
+            self._raw_parser.feed(line)
+        if self.detect_failure:
+            raw_line = line.rstrip('\n')
+            for kind, failure_specs in (('specific', specific_failures),
+                                        ('generic', generic_failures)):
+                failure_type = match_failure(raw_line, failure_specs)
+                if failure_type:
+                    self._failures[kind] = (failure_type, raw_line)
+
+        line = decolor(line)
+        if self._queued_at is None:
+            self._queued_at = get_log_datetime(line)
+        self._tests.extend(self._parser.feed(line))
+        if self._debug == 'False' and '| Target:' in line and \
+                line.endswith('Debug\n'):
+            self._debug = 'True'
+        if self._runner_version is None:
+            match = RUNNER_VERSION_RE.search(line) or \
+                FREEBSD_RUNNER_VERSION_RE.search(line)
+            if match:
+                self._runner_version = match.group(1)
+        compiler_match = COMPILER_RE.search(line)
+        if compiler_match:
+            self._compiler_version = compiler_match.group(1)
+
+    def close(self):
+        """ Process the last line if it has no trailing newline. """
+        self._feed_text(self._decoder.decode(b'', final=True))
+        if self._tail:
+            self.feed(self._tail)
+            self._tail = ''
+        if self._raw_parser:
+            self._raw_parser.finish()
+        self._tests.extend(self._parser.finish())
+
+    @property
+    def test_status_cache(self):
+        if self._raw_parser is None:
+            return None
+        return self._raw_parser.cache
+
+    @property
+    def facts(self):
+        facts = {
+            'version': FACTS_VERSION,
+            'queued_at': '' if self.partial else self._queued_at or '',
+            'debug': self._debug,
+            'runner_version':
+                self._runner_version or 'unknown_runner_version',
+            'compiler_version': self._compiler_version,
+            'tests': self._tests,
+            'failure': None,
+        }
+        if self.detect_failure:
+            facts['failure'] = self._failures
+        return facts
@@ -6,6 +6,11 @@ import re
 import json
 from collections import OrderedDict
 
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+sys.path.append(PROJECT_DIR)
+from multivac.storage import open_log  # noqa: E402
+
 
 SEP_RE = r' +'
 TIMESTAMP_RE = r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}.\d+Z'
@@ -41,57 +46,51 @@ def get_cache_filepath(log_filepath):
     return '{}.test_status.cache.json'.format(log_filepath)
 
 
-def test_status_iter(log_fh, cache_filepath=None):
-    """ Iterator generator, which accepts a log file handle
-        (which contains an output of a CI job) and yields
-        (test, conf, status) tuples.
+class TestStatusParser:
+    """ Push style parser of test statuses: feed it with lines of
+        a log of a CI job one by one.
 
-        Caches result in the 'cache_filepath' file when its name
-        is provided. Reuses the existing cache on next
-        invocations.
+        `feed()` and `finish()` return (test, conf, status) tuples
+        found so far. `cache` collects the results, which are
+        stored into a cache file by `test_status_iter()`.
     """
-    if cache_filepath:
-        if os.path.isfile(cache_filepath):
-            with open(cache_filepath, 'r') as cache_fh:
-                data = json.load(cache_fh)
-            for test_status in data:
-                yield tuple(test_status)
-            return
 
-        cache = []
+    def __init__(self):
+        self.cache = []
+        self._hang_detected = False
+        self._awaiting_tests = {}
 
-    hang_detected = False
-
-    awaiting_tests = {}
-    for line in log_fh:
+    def feed(self, line):
+        res_list = []
         m = TEST_STATUS_LINE_RE.match(line)
 
         if m:
             if not m.group('status'):
-                awaiting_tests.update({m['wid']: (m['test'], m['conf'])})
-                continue
+                self._awaiting_tests.update(
+                    {m['wid']: (m['test'], m['conf'])})
+                return res_list
             status = m.group('status')
             res = (m['test'], m['conf'], status)
-            if cache_filepath:
-                cache.append(res)
-            yield res
-            continue
-        elif awaiting_tests:
+            self.cache.append(res)
+            res_list.append(res)
+            return res_list
+        elif self._awaiting_tests:
             status_match = LATE_STATUS.match(line)
             if status_match:
-                matched_test = awaiting_tests.pop(status_match.group('wid'))
+                matched_test = self._awaiting_tests.pop(
+                    status_match.group('wid'))
                 res = (matched_test[0],
                        matched_test[1],
                        status_match.group('res'))
-                yield res
+                res_list.append(res)
 
         m = TEST_HANG_RE.match(line)
         if m:
-            hang_detected = True
-            continue
+            self._hang_detected = True
+            return res_list
 
-        if hang_detected:
-            hang_detected = False
+        if self._hang_detected:
+            self._hang_detected = False
             m = HANG_RESULT_RE.match(line)
             if m:
                 result = m['result']
@@ -103,31 +102,60 @@ def test_status_iter(log_fh, cache_filepath=None):
                 test = result.split('.', 1)[0] + '.test.lua'
                 # We don't know a configuration, assume None.
                 res = (test, None, 'hang')
-                if cache_filepath:
-                    cache.append(res)
-                yield res
-                continue
+                self.cache.append(res)
+                res_list.append(res)
+        return res_list
+
+    def finish(self):
+        # if there are tests with no result, save them as failed.
+        res_list = []
+        for wid in self._awaiting_tests:
+            # get tuple (test name, test conf)
+            res = self._awaiting_tests.get(wid)
+            res_list.append((res[0], res[1], 'fail'))
+        return res_list
+
+
+def write_cache(cache_filepath, cache):
+    with open(cache_filepath, 'w') as cache_fh:
+        json.dump(cache, cache_fh, indent=2)
+
+
+def test_status_iter(log_fh, cache_filepath=None):
+    """ Iterator generator, which accepts a log file handle
+        (which contains an output of a CI job) and yields
+        (test, conf, status) tuples.
+
+        Caches result in the 'cache_filepath' file when its name
+        is provided. Reuses the existing cache on next
+        invocations.
+    """
+    if cache_filepath:
+        if os.path.isfile(cache_filepath):
+            with open(cache_filepath, 'r') as cache_fh:
+                data = json.load(cache_fh)
+            for test_status in data:
+                yield tuple(test_status)
+            return
 
-    # if there are tests with no result, save them as failed.
-    for wid in awaiting_tests:
-        res = awaiting_tests.get(wid)  # get tuple (test name, test conf)
-        yield (res[0], res[1], 'fail')
+    parser = TestStatusParser()
+    for line in log_fh:
+        yield from parser.feed(line)
+    yield from parser.finish()
 
     if cache_filepath:
-        with open(cache_filepath, 'w') as cache_fh:
-            json.dump(cache, cache_fh, indent=2)
+        write_cache(cache_filepath, parser.cache)
 
 
-def test_smart_status_iter(log_fh, cache_filepath=None):
-    """ Iterator generator that yields (test, conf, status)
-        tuples.
+def smart_status_iter(test_statuses):
+    """ Iterator generator that accepts (test, conf, status)
+        tuples and yields them with squashed duplicates.
 
-        The difference from `test_status_iter()` is that this
-        iterator squashes duplicates and reports 'transient fail'
-        status for a test, which fails, run again and succeeds.
+        A test, which fails, run again and succeeds, gets
+        'transient fail' status.
     """
     tmp = OrderedDict()
-    for test, conf, status in test_status_iter(log_fh, cache_filepath):
+    for test, conf, status in test_statuses:
         key = (test, conf)
         if status == 'pass' and tmp.get(key) == 'fail':
             status = 'transient fail'
@@ -137,6 +165,17 @@ def test_smart_status_iter(log_fh, cache_filepath=None):
         yield test, conf, status
 
 
+def test_smart_status_iter(log_fh, cache_filepath=None):
+    """ Iterator generator that yields (test, conf, status)
+        tuples.
+
+        The difference from `test_status_iter()` is that this
+        iterator squashes duplicates and reports 'transient fail'
+        status for a test, which fails, run again and succeeds.
+    """
+    yield from smart_status_iter(test_status_iter(log_fh, cache_filepath))
+
+
 def execute(log_filepath):
     """ External API for the smart test status iterator.
 
@@ -146,15 +185,21 @@ def execute(log_filepath):
         `conf` and `status` fields (except common `event` field).
     """
     cache_filepath = get_cache_filepath(log_filepath)
-    with open(log_filepath, 'r') as log_fh:
-        for test, conf, status in test_smart_status_iter(
-                log_fh, cache_filepath):
-            yield {
-                'event': 'test status',
-                'test': test,
-                'conf': conf,
-                'status': status,
-            }
+    with open_log(log_filepath, 'r') as log_fh:
+        yield from events(test_smart_status_iter(log_fh, cache_filepath))
+
+
+def events(smart_test_statuses):
+    """ 'test status' events for the given (test, conf, status)
+        tuples as `execute()` yields them.
+    """
+    for test, conf, status in smart_test_statuses:
+        yield {
+            'event': 'test status',
+            'test': test,
+            'conf': conf,
+            'status': status,
+        }
 
 
 if __name__ == '__main__':
@@ -166,7 +211,7 @@ if __name__ == '__main__':
     """
     log_filepath = sys.argv[1]
     cache_filepath = get_cache_filepath(log_filepath)
-    with open(log_filepath, 'r') as log_fh:
+    with open_log(log_filepath, 'r') as log_fh:
         for test, conf, status in test_smart_status_iter(
                 log_fh, cache_filepath):
             print('event: test status; test: {}; conf: {}; status: {}'.format(
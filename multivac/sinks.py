@@ -0,0 +1,167 @@
+import abc
+import csv
+import json
+import os
+import uuid
+from datetime import datetime, timezone
+
+try:
+    import pyarrow
+    import pyarrow.dataset
+except ImportError:
+    pyarrow = None
+
+
+class Sink(abc.ABC):
+    """ Receives gathered records one by one, as they're produced, and
+        writes them out. So records are not kept in memory.
+
+        Usage:
+
+            with SomeSink(...) as sink:
+                for record in records:
+                    sink.push(record)
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @abc.abstractmethod
+    def push(self, record):
+        pass
+
+    def close(self):
+        pass
+
+
+class FileSink(Sink):
+    """ A sink that writes a file, creating its directory. """
+
+    def __init__(self, path):
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.file = open(path, 'w')
+
+    def close(self):
+        self.file.close()
+
+
+class JSONSink(FileSink):
+    """ An object keyed by `key` of the records.
+
+        The file is the same as `json.dump(records, f, indent=2)` of
+        a dict of the records would give.
+    """
+
+    def __init__(self, path, key):
+        super().__init__(path)
+        self.key = key
+        self.empty = True
+
+    def push(self, record):
+        self.file.write('{\n  ' if self.empty else ',\n  ')
+        self.empty = False
+        # Keys of a JSON object are strings.
+        self.file.write(json.dumps(str(record[self.key])))
+        self.file.write(': ')
+        # One level deeper. Strings have no raw newlines in JSON.
+        self.file.write(json.dumps(record, indent=2).replace('\n', '\n  '))
+
+    def close(self):
+        self.file.write('{}' if self.empty else '\n}')
+        super().close()
+
+
+class NDJSONSink(FileSink):
+    """ A record per line. """
+
+    def push(self, record):
+        self.file.write(json.dumps(record))
+        self.file.write('\n')
+
+
+class CSVSink(FileSink):
+    """ A row per record with the given columns. Other fields of the
+        records are not written.
+    """
+
+    def __init__(self, path, fieldnames):
+        super().__init__(path)
+        self.writer = csv.DictWriter(self.file, fieldnames=fieldnames,
+                                     extrasaction='ignore')
+        self.writer.writeheader()
+
+    def push(self, record):
+        self.writer.writerow(record)
+
+
+def check_parquet():
+    if pyarrow is None:
+        raise RuntimeError('Parquet output requires the pyarrow module: '
+                           'pip install pyarrow')
+
+
+def parquet_schema(columns):
+    """ `pyarrow.Schema` of (name, kind) columns. A kind is 'int',
+        'float', 'string', 'timestamp' (a datetime) or 'category': a
+        string with few distinct values, dictionary-encoded.
+    """
+    check_parquet()
+    types = {
+        'int': pyarrow.int64(),
+        'float': pyarrow.float64(),
+        'string': pyarrow.string(),
+        'timestamp': pyarrow.timestamp('s', tz='UTC'),
+        'category': pyarrow.dictionary(pyarrow.int32(), pyarrow.string()),
+    }
+    return pyarrow.schema([(name, types[kind]) for name, kind in columns])
+
+
+class ParquetSink(Sink):
+    """ A partitioned Parquet dataset in the `path` directory:
+        `<path>/<column>=<value>/part-<stamp>-<n>-<i>.parquet`.
+
+        Records are converted to the schema of `columns` (see
+        parquet_schema()) and written by `max_rows` rows (or only on
+        `flush()` if it is None). Each run adds new files to the
+        dataset and never rewrites existing ones, so a dataset grows
+        by incremental partitions.
+    """
+
+    def __init__(self, path, columns, partition_cols, max_rows=50000):
+        self.path = path
+        self.schema = parquet_schema(columns)
+        self.partition_cols = partition_cols
+        self.max_rows = max_rows
+        self.rows = []
+        self.flushes = 0
+        # Unique for a run, even for several runs of one process in
+        # a second.
+        self.stamp = '{}-{}'.format(
+            datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S'),
+            uuid.uuid4().hex[:12])
+
+    def push(self, record):
+        self.rows.append(record)
+        if self.max_rows is not None and len(self.rows) >= self.max_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        table = pyarrow.Table.from_pylist(self.rows, schema=self.schema)
+        pyarrow.dataset.write_dataset(
+            table, self.path, format='parquet',
+            partitioning=self.partition_cols, partitioning_flavor='hive',
+            basename_template='part-{}-{}-{{i}}.parquet'.format(
+                self.stamp, self.flushes),
+            existing_data_behavior='overwrite_or_ignore')
+        self.flushes += 1
+        self.rows = []
+
+    def close(self):
+        self.flush()
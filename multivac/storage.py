@@ -0,0 +1,385 @@
+""" Access to job logs in the storage.
+
+    A job log is stored either as is (`<id>.log`) or compressed
+    (`<id>.log.gz`, `<id>.log.zst`). Readers refer to a log by
+    its plain `<id>.log` path and open it with `open_log()`, which
+    picks whatever variant exists.
+
+    Job files are either all in `workflow_run_jobs` or spread over
+    its subdirectories by job ID (see `Layout`). Paths of job files
+    are given by `Layout`.
+"""
+
+import collections
+import contextlib
+import glob
+import gzip
+import io
+import json
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Compression name -> file name suffix.
+COMPRESSIONS = {
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+LOG_SUFFIXES = ('',) + tuple(COMPRESSIONS.values())
+TEMP_SUFFIX = '.tmp'
+# Chunks of a compressed log read by log_tail().
+TAIL_CHUNK_SIZE = 64 * 1024
+
+
+def check_compression(compression):
+    """ Raise if the given compression can't be used. """
+    if compression is None:
+        return
+    if compression not in COMPRESSIONS:
+        raise ValueError('Unknown compression: {}'.format(compression))
+    if compression == 'zstd' and zstandard is None:
+        raise RuntimeError('zstd compression requires the zstandard module: '
+                           'pip install zstandard')
+
+
+def compressed_path(log_path, compression):
+    """ Path of the log stored with the given compression. """
+    if compression is None:
+        return log_path
+    return log_path + COMPRESSIONS[compression]
+
+
+def find_log(log_path):
+    """ Path of the stored log in any of supported formats or None
+        if there is no such log.
+    """
+    for suffix in LOG_SUFFIXES:
+        path = log_path + suffix
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def glob_logs(dirpath):
+    """ Plain `<id>.log` paths of all logs in the directory,
+        whatever their storage format is.
+    """
+    res = set()
+    for suffix in LOG_SUFFIXES:
+        for path in glob.glob(os.path.join(dirpath, '*.log' + suffix)):
+            res.add(path[:len(path) - len(suffix)] if suffix else path)
+    return sorted(res)
+
+
+def open_log(log_path, mode='r', **kwargs):
+    """ Open the log for reading in text ('r') or binary ('rb')
+        mode. Extra arguments are passed to the text wrapper, say,
+        `encoding` and `errors`.
+
+        Raise FileNotFoundError if there is no such log.
+    """
+    if mode not in ('r', 'rt', 'rb'):
+        raise ValueError('Logs are opened only for reading')
+    binary = mode == 'rb'
+    path = find_log(log_path)
+    if path is None:
+        raise FileNotFoundError(log_path)
+
+    if path.endswith(COMPRESSIONS['gzip']):
+        return gzip.open(path, 'rb' if binary else 'rt', **kwargs)
+    if path.endswith(COMPRESSIONS['zstd']):
+        check_compression('zstd')
+        fh = open(path, 'rb')
+        reader = zstandard.ZstdDecompressor().stream_reader(fh, closefd=True)
+        if binary:
+            return reader
+        return io.TextIOWrapper(io.BufferedReader(reader), **kwargs)
+    return open(path, mode, **kwargs)
+
+
+def temp_path(path):
+    """ Path of a temporary file to write `path` content into.
+
+        Unique per process and thread, so concurrent writers of the
+        same file don't interfere.
+    """
+    return '{}.{}.{}{}'.format(path, os.getpid(), threading.get_ident(),
+                               TEMP_SUFFIX)
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode='w'):
+    """ Context manager, which gives a file object to write `path`
+        content.
+
+        The content is written to a temporary file, which is synced
+        and renamed to `path` on success and removed on an error. So
+        a reader sees either the old file or the whole new one:
+        never a truncated file left by a killed process or a crashed
+        system.
+    """
+    tmp_path = temp_path(path)
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def fsync_file(path):
+    """ Flush the file content to the disk. """
+    with open(path, 'rb') as f:
+        os.fsync(f.fileno())
+
+
+def remove_temp_files(dirpath):
+    """ Remove temporary files left by killed writers.
+
+        Return amount of removed files.
+    """
+    count = 0
+    if not os.path.isdir(dirpath):
+        return count
+    for entry in os.scandir(dirpath):
+        if entry.name.endswith(TEMP_SUFFIX) and entry.is_file():
+            os.remove(entry.path)
+            count += 1
+    return count
+
+
+def open_log_writer(path, compression):
+    """ Open a file for writing of a log body with the given
+        compression (None means no compression).
+    """
+    check_compression(compression)
+    if compression == 'gzip':
+        return gzip.open(path, 'wb')
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor().stream_writer(open(path, 'wb'))
+    return open(path, 'wb')
+
+
+@contextlib.contextmanager
+def seekable_log(log_path):
+    """ Context manager, which gives a path of an uncompressed
+        regular file with the log content.
+
+        It is the log file itself if the log is not compressed and
+        a temporary file otherwise.
+    """
+    path = find_log(log_path)
+    if path is None:
+        raise FileNotFoundError(log_path)
+    if path == log_path:
+        yield path
+        return
+
+    with tempfile.NamedTemporaryFile(suffix='.log') as tmp_fh:
+        with open_log(log_path, 'rb') as log_fh:
+            shutil.copyfileobj(log_fh, tmp_fh)
+        tmp_fh.flush()
+        yield tmp_fh.name
+
+
+def log_tail(log_path, size):
+    """ Last `size` bytes of the log content.
+
+        A compressed log can't be read from the end: it is
+        decompressed as a stream and only last chunks are kept.
+    """
+    chunks = collections.deque()
+    total = 0
+    with open_log(log_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(TAIL_CHUNK_SIZE), b''):
+            chunks.append(chunk)
+            total += len(chunk)
+            while total - len(chunks[0]) >= size:
+                total -= len(chunks.popleft())
+    return b''.join(chunks)[-size:]
+
+
+def _reverse_lines(data, window):
+    """ Lines of `data` (bytes or mmap) from its end, see
+        reverse_lines().
+    """
+    size = len(data)
+    start = 0
+    if window is not None and window < size:
+        # Skip the partial line.
+        start = data.find(b'\n', size - window - 1) + 1
+        if start == 0:
+            return
+    end = size
+    while end > start:
+        pos = data.rfind(b'\n', start, end)
+        line = data[pos + 1 if pos >= 0 else start:end]
+        end = pos if pos >= 0 else start
+        if b'\r' in line:
+            for part in reversed(line.split(b'\r')):
+                if part:
+                    yield part
+        elif line:
+            yield line
+
+
+def reverse_lines(log_path, window=None):
+    """ Yield lines of the log from its end as raw bytes.
+
+        The log is mapped into memory and searched for line breaks
+        right there, nothing is decoded. Line breaks are as in the
+        text mode: `\n`, `\r\n` or `\r`. Empty lines are skipped.
+
+        Only last `window` bytes are scanned if `window` is given:
+        the partial first line of the window is not yielded. For a
+        compressed log only these bytes (see log_tail()) are kept in
+        memory, otherwise the whole log is decompressed to a
+        temporary file.
+    """
+    path = find_log(log_path)
+    if path is None:
+        raise FileNotFoundError(log_path)
+    if path != log_path and window is not None:
+        # And a byte before the window: whether it starts from a
+        # line.
+        yield from _reverse_lines(log_tail(log_path, window + 1), window)
+        return
+    with seekable_log(log_path) as path, open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield from _reverse_lines(mm, window)
+
+
+class Layout:
+    """ Paths of files of a repository storage.
+
+        * flat -- `workflow_run_jobs/<id>.json`, `<id>.log` and so
+          on, as it was from the beginning.
+        * sharded -- `workflow_run_jobs/<id // SHARD_SIZE>/<id>.json`
+          and so on. Job IDs grow in time, so each shard holds jobs
+          of a period of time: about a day for tarantool/tarantool.
+
+        The layout is recorded in `<owner>/<repo>/layout.json`, the
+        storage is flat if there is no such file. Use
+        `multivac/migrate_layout.py` to convert a flat storage.
+
+        Artifacts of jobs are `artifacts/<run_id>/<job_id>.zip` in
+        any layout: the reports link to them by this path.
+
+        Data derived by the reporting scripts is kept in `cache/`,
+        sharded the same way: it is not backed up along with the
+        job files.
+    """
+    FLAT = 'flat'
+    SHARDED = 'sharded'
+    SHARD_SIZE = 10 ** 7
+    MARKER_FILENAME = 'layout.json'
+
+    def __init__(self, repo_path):
+        self.repo_path = repo_path
+        self.workflow_runs_dir = os.path.join(repo_path, 'workflow_runs')
+        self.workflow_run_jobs_dir = os.path.join(repo_path,
+                                                  'workflow_run_jobs')
+        self.artifacts_dir = os.path.join(repo_path, 'artifacts')
+        self.cache_dir = os.path.join(repo_path, 'cache')
+        self.marker_path = os.path.join(repo_path, self.MARKER_FILENAME)
+        self.kind = self.FLAT
+        if os.path.isfile(self.marker_path):
+            with open(self.marker_path, 'r') as f:
+                self.kind = json.load(f)['workflow_run_jobs']
+            if self.kind not in (self.FLAT, self.SHARDED):
+                raise RuntimeError('Unknown storage layout {}: {}'.format(
+                    self.kind, self.marker_path))
+
+    @property
+    def sharded(self):
+        return self.kind == self.SHARDED
+
+    def store(self, kind):
+        """ Record the layout of the storage. """
+        self.kind = kind
+        with atomic_write(self.marker_path) as f:
+            json.dump({'workflow_run_jobs': kind}, f, indent=2)
+
+    def shard(self, job_id):
+        return str(int(job_id) // self.SHARD_SIZE)
+
+    def job_dir(self, job_id):
+        """ Directory of files of the given job. """
+        if self.sharded:
+            return os.path.join(self.workflow_run_jobs_dir,
+                                self.shard(job_id))
+        return self.workflow_run_jobs_dir
+
+    def job_dirs(self):
+        """ All directories with job files. """
+        if not self.sharded:
+            return [self.workflow_run_jobs_dir]
+        if not os.path.isdir(self.workflow_run_jobs_dir):
+            return []
+        return sorted(entry.path for entry in
+                      os.scandir(self.workflow_run_jobs_dir)
+                      if entry.is_dir() and entry.name.isdigit())
+
+    def job_meta_path(self, job_id):
+        return os.path.join(self.job_dir(job_id), '{}.json'.format(job_id))
+
+    def job_log_path(self, job_id):
+        """ Plain `<id>.log` path of the job log, see `find_log()`
+            and `open_log()`.
+        """
+        return os.path.join(self.job_dir(job_id), '{}.log'.format(job_id))
+
+    def run_meta_path(self, run_id):
+        return os.path.join(self.workflow_runs_dir, '{}.json'.format(run_id))
+
+    def job_cache_path(self, name, job_id):
+        """ `cache/<name>/<shard>/<id>.json` file of the job. """
+        return os.path.join(self.cache_dir, name, self.shard(job_id),
+                            '{}.json'.format(job_id))
+
+    def artifact_path(self, run_id, job_id):
+        return os.path.join(self.artifacts_dir, str(run_id),
+                            '{}.zip'.format(job_id))
+
+    def artifact_dirs(self):
+        """ All directories with artifacts. """
+        if not os.path.isdir(self.artifacts_dir):
+            return []
+        return sorted(entry.path for entry in os.scandir(self.artifacts_dir)
+                      if entry.is_dir())
+
+    def relpath(self, path):
+        """ Path relative to the repository storage: say, to build
+            a link to a backup of the file.
+        """
+        return os.path.relpath(path, self.repo_path)
+
+    def glob_job_meta(self):
+        """ Paths of all job meta files. """
+        res = []
+        for dirpath in self.job_dirs():
+            res.extend(glob.glob(os.path.join(dirpath, '*[0-9].json')))
+        return res
+
+    def glob_logs(self):
+        """ Plain `<id>.log` paths of all stored logs, see
+            `glob_logs()`.
+        """
+        res = []
+        for dirpath in self.job_dirs():
+            res.extend(glob_logs(dirpath))
+        return sorted(res)
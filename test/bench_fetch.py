@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+""" End-to-end benchmark of fetch.py against the offline GitHub
+    API stand-in (see fake_github.py).
+
+    Runs a cold crawl (empty storage) and a warm crawl (nothing
+    changed) and reports requests, bytes, wall time and peak
+    memory of each.
+
+        $ ./test/bench_fetch.py --runs 200 --latency 0.05 --fetch-arg=--workers=8
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_github import Corpus, FakeGitHub
+
+CUR_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(CUR_DIR)
+
+FETCH = os.path.join(PROJECT_DIR, 'multivac', 'fetch.py')
+
+
+def run_fetch(api_url, workdir, repo_path, fetch_args=()):
+    """ Run fetch.py against the given API in the given directory.
+
+        Return wall time in seconds and peak RSS of this very
+        process in KiB.
+    """
+    env = dict(os.environ, MULTIVAC_GITHUB_TOKEN='fake')
+    cmd = [sys.executable, FETCH, '--api-url', api_url] + \
+        list(fetch_args) + [repo_path]
+    started = time.monotonic()
+    process = subprocess.Popen(cmd, cwd=workdir, env=env,
+                               stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    # Unlike getrusage(RUSAGE_CHILDREN), which gives the maximum
+    # among all the finished children, wait4() gives the usage of
+    # the child.
+    _, status, rusage = os.wait4(process.pid, 0)
+    wall = time.monotonic() - started
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+    return wall, rusage.ru_maxrss
+
+
+def measure(server, workdir, repo_path, fetch_args=()):
+    """ Run fetch.py and return what it cost. """
+    before = server.stats.as_dict()
+    wall, maxrss_kib = run_fetch(server.url, workdir, repo_path, fetch_args)
+    after = server.stats.as_dict()
+    return {
+        'requests': after['requests'] - before['requests'],
+        'bytes': after['bytes'] - before['bytes'],
+        'wall': wall,
+        'maxrss_kib': maxrss_kib,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark fetch.py')
+    parser.add_argument('--runs', type=int, default=100)
+    parser.add_argument('--jobs-per-run', type=int, default=10)
+    parser.add_argument('--log-lines', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='seconds to wait before each response')
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--secondary-limit-rate', type=float, default=0)
+    parser.add_argument('--fetch-arg', action='append', default=[],
+                        help='extra fetch.py option (may be passed several '
+                             'times), say, --fetch-arg=--workers=8')
+    args = parser.parse_args()
+
+    corpus = Corpus.synthetic(runs=args.runs, jobs_per_run=args.jobs_per_run,
+                              log_lines=args.log_lines)
+    repo_path = '{}/{}'.format(corpus.owner, corpus.repo)
+    server = FakeGitHub(corpus, latency=args.latency,
+                        error_rate=args.error_rate,
+                        secondary_limit_rate=args.secondary_limit_rate,
+                        retry_after=0)
+    server.start()
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for name in ('cold', 'warm'):
+                res = measure(server, workdir, repo_path, args.fetch_arg)
+                print('{:4}: {:6} requests {:12} bytes {:8.2f} s '
+                      '{:8} KiB max RSS'.format(
+                          name, res['requests'], res['bytes'], res['wall'],
+                          res['maxrss_kib']))
+    finally:
+        server.stop()
@@ -0,0 +1,148 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from multivac.catalog import Catalog, SCHEMA, catalog_path
+
+
+def run_meta(run_id, branch):
+    return {
+        'id': run_id,
+        'head_branch': branch,
+        'status': 'completed',
+        'conclusion': 'failure',
+        'created_at': '2022-11-01T12:00:00Z',
+        'updated_at': '2022-11-01T13:00:00Z',
+    }
+
+
+def job_meta(job_id, run_id, branch, started_at, conclusion='failure'):
+    return {
+        'id': job_id,
+        'run_id': run_id,
+        'name': 'release',
+        'head_branch': branch,
+        'head_sha': 'abc',
+        'status': 'completed',
+        'conclusion': conclusion,
+        'labels': ['ubuntu-20.04'],
+        'runner_name': 'runner',
+        'html_url': 'https://github.com/tarantool/tarantool/runs/{}'.format(
+            job_id),
+        'created_at': started_at,
+        'started_at': started_at,
+        'completed_at': started_at,
+    }
+
+
+class TestCatalog(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.repo_path = self.tmp_dir.name
+
+    def open(self):
+        catalog = Catalog(self.repo_path)
+        self.addCleanup(catalog.close)
+        return catalog
+
+    def test_query(self):
+        catalog = self.open()
+        self.assertFalse(catalog.complete)
+        catalog.put_run(run_meta(1, 'master'), [
+            (job_meta(10, 1, 'master', '2022-11-01T12:00:00Z'),
+             'workflow_run_jobs/10.log', [('a/b.test.lua', None, 'fail')]),
+            (job_meta(11, 1, 'master', '2022-11-01T12:30:00Z', 'skipped'),
+             None, None),
+        ])
+        # An older job meta has no head_branch: the branch of the run
+        # is used.
+        old_job = job_meta(20, 2, '2.10', '2022-11-02T12:00:00Z')
+        del old_job['head_branch']
+        catalog.put_run(run_meta(2, '2.10'), [
+            (old_job, 'workflow_run_jobs/20.log', None),
+        ])
+        self.assertTrue(catalog.has_run('1'))
+        self.assertFalse(catalog.has_run('3'))
+
+        def ids(**kwargs):
+            return [job['id'] for job in catalog.jobs(**kwargs)]
+
+        self.assertEqual(ids(), [20, 11, 10])
+        self.assertEqual(ids(limit=1), [20])
+        self.assertEqual(ids(branches=['master']), [11, 10])
+        self.assertEqual(ids(branches=['2.10']), [20])
+        self.assertEqual(ids(branches=['master', '2.10'], with_log=True),
+                         [20, 10])
+        self.assertEqual(next(catalog.jobs(branches=['2.10']))['run_branch'],
+                         '2.10')
+        self.assertEqual(ids(with_log=True), [20, 10])
+        self.assertEqual(ids(exclude_conclusions=('skipped',)), [20, 10])
+        self.assertEqual(ids(started_since='2022-11-01T12:30:00Z'), [20, 11])
+        self.assertEqual(next(catalog.jobs(limit=1))['labels'],
+                         ['ubuntu-20.04'])
+
+        self.assertEqual(catalog.test_outcomes(10),
+                         [('a/b.test.lua', None, 'fail')])
+        self.assertIsNone(catalog.test_outcomes(20))
+        # Outcomes are kept on an update without them.
+        catalog.put_run(run_meta(1, 'master'), [
+            (job_meta(10, 1, 'master', '2022-11-01T12:00:00Z'),
+             'workflow_run_jobs/10.log', None),
+        ])
+        self.assertEqual(catalog.test_outcomes(10),
+                         [('a/b.test.lua', None, 'fail')])
+
+    def test_rebuild(self):
+        for dirname in ('workflow_runs', 'workflow_run_jobs'):
+            os.makedirs(os.path.join(self.repo_path, dirname))
+
+        def write(path, data):
+            with open(os.path.join(self.repo_path, path), 'w') as f:
+                f.write(data if isinstance(data, str) else json.dumps(data))
+
+        write('workflow_runs/1.json', run_meta(1, 'master'))
+        write('workflow_run_jobs/10.json',
+              job_meta(10, 1, 'master', '2022-11-01T12:00:00Z'))
+        write('workflow_run_jobs/10.log', 'log\n')
+        write('workflow_run_jobs/10.log.test_status.cache.json',
+              [['a/b.test.lua', 'c', 'fail']])
+        write('workflow_run_jobs/11.json',
+              job_meta(11, 1, 'master', '2022-11-01T12:00:00Z'))
+
+        catalog = self.open()
+        self.assertEqual(catalog.rebuild(), 2)
+        jobs = {job['id']: job for job in catalog.jobs()}
+        self.assertEqual(jobs[10]['log_path'], 'workflow_run_jobs/10.log')
+        self.assertIsNone(jobs[11]['log_path'])
+        self.assertEqual(catalog.test_outcomes(10),
+                         [('a/b.test.lua', 'c', 'fail')])
+        self.assertTrue(self.open().complete)
+        self.assertIsNotNone(Catalog.open_existing(self.repo_path))
+
+    def test_incomplete(self):
+        # A rebuild is interrupted after a run is added.
+        catalog = self.open()
+        catalog.put_run(run_meta(1, 'master'), [])
+        catalog.close()
+        self.assertIsNone(Catalog.open_existing(self.repo_path))
+        self.assertFalse(self.open().complete)
+
+    def test_upgrade(self):
+        # A catalog of the first schema version: without log_offset.
+        conn = sqlite3.connect(catalog_path(self.repo_path))
+        conn.executescript(SCHEMA.replace(',\n    log_offset INTEGER', ''))
+        conn.execute('PRAGMA user_version=1')
+        conn.close()
+
+        catalog = self.open()
+        # An existing catalog is not rebuilt.
+        self.assertTrue(catalog.complete)
+        job = job_meta(10, 1, 'master', '2022-11-01T12:00:00Z')
+        job['multivac'] = {'log_offset': 1024}
+        catalog.put_run(run_meta(1, 'master'), [
+            (job, 'workflow_run_jobs/10.log', None),
+        ])
+        self.assertEqual(next(catalog.jobs())['multivac'],
+                         {'log_offset': 1024})
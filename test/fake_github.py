@@ -0,0 +1,572 @@
+#!/usr/bin/env python
+
+""" Offline stand-in for the GitHub Actions API used by fetch.py.
+
+    Serves paginated workflow run lists, workflow runs, job lists,
+    job logs and artifacts from a synthetic or recorded corpus. Emulates
+    rate limit headers, conditional requests (ETag / 304), the
+    redirect of a log or an artifact request to a blob storage (with Range
+    support) and may inject latency and errors.
+
+    Start it standalone and point fetch.py to it:
+
+        $ ./test/fake_github.py --port 8000 --runs 300
+        $ MULTIVAC_GITHUB_TOKEN=x ./multivac/fetch.py \
+            --api-url http://127.0.0.1:8000 tarantool/tarantool
+"""
+
+import argparse
+import datetime
+import email.utils
+import glob
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, urlencode
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_DIR)
+from multivac.storage import Layout, find_log, open_log  # noqa: E402
+
+
+def github_time(dt):
+    return dt.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def parse_github_time(value):
+    return datetime.datetime.fromisoformat(value.rstrip('Z') + '+00:00')
+
+
+class Corpus:
+    """ Workflow runs, jobs and logs of one repository.
+
+        * runs -- workflow run objects, fresh ones first.
+        * jobs -- run ID -> list of job objects.
+        * logs -- job ID -> log body (bytes) or a path to a log
+          file.
+        * artifacts -- run ID -> list of artifact objects.
+        * artifact_blobs -- artifact ID -> archive body (bytes).
+    """
+
+    def __init__(self, owner, repo):
+        self.owner = owner
+        self.repo = repo
+        self.runs = []
+        self.jobs = {}
+        self.logs = {}
+        self.artifacts = {}
+        self.artifact_blobs = {}
+
+    @classmethod
+    def synthetic(cls, owner='tarantool', repo='tarantool', runs=100,
+                  jobs_per_run=10, log_lines=1000, failure_rate=0.1,
+                  branches=('master',), incomplete=1, seed=0, now=None):
+        """ Generate a corpus. `incomplete` freshest runs are in
+            progress.
+        """
+        rnd = random.Random(seed)
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        corpus = cls(owner, repo)
+        html_url = 'https://github.com/{}/{}'.format(owner, repo)
+        for i in range(runs):
+            run_id = 10 ** 9 + runs - i
+            created_at = now - datetime.timedelta(minutes=30 * i + 1)
+            completed = i >= incomplete
+            branch = branches[i % len(branches)]
+            sha = hashlib.sha1(str(run_id).encode()).hexdigest()
+            run = {
+                'id': run_id,
+                'name': 'default',
+                'head_branch': branch,
+                'head_sha': sha,
+                'status': 'completed' if completed else 'in_progress',
+                'conclusion': None,
+                'created_at': github_time(created_at),
+                'updated_at': github_time(
+                    created_at + datetime.timedelta(minutes=20)),
+                'html_url': '{}/actions/runs/{}'.format(html_url, run_id),
+            }
+            failed = False
+            jobs = []
+            for j in range(jobs_per_run):
+                # Fresh jobs have greater IDs.
+                job_id = 10 ** 10 + (runs - i) * jobs_per_run + j
+                started_at = created_at + datetime.timedelta(seconds=10)
+                completed_at = started_at + datetime.timedelta(minutes=15)
+                conclusion = None
+                if completed:
+                    conclusion = 'success'
+                    if rnd.random() < failure_rate:
+                        conclusion = 'failure'
+                        failed = True
+                name = 'job_{}_ubuntu_20_04'.format(j)
+                jobs.append({
+                    'id': job_id,
+                    'run_id': run_id,
+                    'name': name,
+                    'head_branch': branch,
+                    'head_sha': sha,
+                    'status': 'completed' if completed else 'in_progress',
+                    'conclusion': conclusion,
+                    'created_at': github_time(created_at),
+                    'started_at': github_time(started_at),
+                    'completed_at': github_time(completed_at),
+                    'labels': ['ubuntu-20.04'],
+                    'runner_name': 'runner-{}'.format(j),
+                    'html_url': '{}/runs/{}'.format(html_url, job_id),
+                })
+                if completed:
+                    corpus.logs[job_id] = cls.synthetic_log(
+                        started_at, log_lines, conclusion == 'failure')
+                if conclusion == 'failure':
+                    corpus.add_artifact(run_id, job_id, name)
+            if completed:
+                run['conclusion'] = 'failure' if failed else 'success'
+            corpus.runs.append(run)
+            corpus.jobs[run_id] = jobs
+        return corpus
+
+    @staticmethod
+    def synthetic_log(started_at, lines, failed):
+        ts = github_time(started_at).rstrip('Z') + '.0000000Z'
+        res = ['{} Current runner version: \'2.300.0\''.format(ts),
+               '{} -- The C compiler identification is GNU 9.3.0'.format(ts)]
+        for i in range(lines):
+            res.append('{} [{:03}] box/test_{}.test.lua{}[ pass ]'.format(
+                ts, i % 16, i, ' ' * 30))
+        if failed:
+            res.append('{} [001] box/bad.test.lua{}[ fail ]'.format(
+                ts, ' ' * 30))
+            res.append('{} * fail: 1 (1.00%)'.format(ts))
+        return ('\n'.join(res) + '\n').encode('utf-8')
+
+    @classmethod
+    def recorded(cls, repo_path):
+        """ Load a corpus from a fetch.py storage directory
+            (`<owner>/<repo>`) of any layout, logs may be compressed.
+        """
+        owner, repo = repo_path.rstrip('/').split('/')[-2:]
+        corpus = cls(owner, repo)
+        layout = Layout(repo_path)
+        runs = []
+        for path in glob.glob(os.path.join(repo_path, 'workflow_runs',
+                                           '*.json')):
+            with open(path, 'r') as f:
+                runs.append(json.load(f))
+        corpus.runs = sorted(runs, key=lambda run: run['created_at'],
+                             reverse=True)
+        for run in corpus.runs:
+            corpus.jobs[run['id']] = []
+        for path in layout.glob_job_meta():
+            with open(path, 'r') as f:
+                job = json.load(f)
+            job.pop('multivac', None)
+            if job['run_id'] in corpus.jobs:
+                corpus.jobs[job['run_id']].append(job)
+            log_path = layout.job_log_path(job['id'])
+            if find_log(log_path):
+                corpus.logs[job['id']] = log_path
+        return corpus
+
+    # An empty zip archive: just the end of central directory record.
+    EMPTY_ZIP = b'PK\x05\x06' + b'\x00' * 18
+
+    def add_artifact(self, run_id, artifact_id, name, body=EMPTY_ZIP):
+        """ Add an artifact. `archive_download_url` is filled by the
+            server.
+        """
+        self.artifacts.setdefault(run_id, []).append({
+            'id': artifact_id,
+            'name': name,
+            'size_in_bytes': len(body),
+            'expired': False,
+        })
+        self.artifact_blobs[artifact_id] = body
+
+    def log(self, job_id):
+        body = self.logs.get(job_id)
+        if isinstance(body, str):
+            with open_log(body, 'rb') as f:
+                return f.read()
+        return body
+
+
+class Stats:
+    """ What the server has sent. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes = 0
+        self.statuses = {}
+        self.endpoints = {}
+
+    def account(self, endpoint, status, size):
+        with self.lock:
+            self.requests += 1
+            self.bytes += size
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.endpoints[endpoint] = self.endpoints.get(endpoint, 0) + 1
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'bytes': self.bytes,
+                'statuses': dict(self.statuses),
+                'endpoints': dict(self.endpoints),
+            }
+
+
+class FakeGitHub(ThreadingHTTPServer):
+    """ HTTP server with the fake API.
+
+        * latency -- seconds to wait before each response.
+        * rate_limit -- requests per `rate_limit_window` seconds,
+          responses with 304 status and blob downloads are not
+          counted (as on GitHub).
+        * error_rate -- probability of '502 Bad Gateway'.
+        * secondary_limit_rate -- probability of a secondary rate
+          limit (403 with Retry-After).
+        * retry_after_date -- send Retry-After as an HTTP date rather
+          than an amount of seconds.
+        * limited_logs -- amount of first log downloads answered with
+          a secondary rate limit without Retry-After: only the body
+          tells about it.
+    """
+    daemon_threads = True
+
+    def __init__(self, corpus, host='127.0.0.1', port=0, latency=0,
+                 rate_limit=5000, rate_limit_window=3600, error_rate=0,
+                 secondary_limit_rate=0, retry_after=1, retry_after_date=False,
+                 limited_logs=0, seed=0):
+        super().__init__((host, port), FakeGitHubHandler)
+        self.corpus = corpus
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.rate_limit_window = rate_limit_window
+        self.error_rate = error_rate
+        self.secondary_limit_rate = secondary_limit_rate
+        self.retry_after = retry_after
+        self.retry_after_date = retry_after_date
+        self.limited_logs = limited_logs
+        self.random = random.Random(seed)
+        self.stats = Stats()
+        self.lock = threading.Lock()
+        self.remaining = rate_limit
+        self.reset = int(time.time()) + rate_limit_window
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        """ Serve in a background thread. """
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def spend(self):
+        """ Account a request against the rate limit budget.
+
+            Return False if the budget is exhausted.
+        """
+        with self.lock:
+            now = time.time()
+            if now >= self.reset:
+                self.remaining = self.rate_limit
+                self.reset = int(now) + self.rate_limit_window
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+    def refund(self):
+        with self.lock:
+            self.remaining += 1
+
+    def limit_log(self):
+        """ Whether to answer a log download with a secondary rate
+            limit, see `limited_logs`.
+        """
+        with self.lock:
+            if self.limited_logs <= 0:
+                return False
+            self.limited_logs -= 1
+            return True
+
+    def inject(self, rate):
+        with self.lock:
+            return self.random.random() < rate
+
+
+class FakeGitHubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    ROUTES = [
+        (re.compile(r'^/repos/([^/]+)/([^/]+)/actions/runs$'), 'runs'),
+        (re.compile(r'^/repos/([^/]+)/([^/]+)/actions/runs/(\d+)$'), 'run'),
+        (re.compile(r'^/repos/([^/]+)/([^/]+)/actions/runs/(\d+)/jobs$'),
+         'jobs'),
+        (re.compile(r'^/repos/([^/]+)/([^/]+)/actions/jobs/(\d+)/logs$'),
+         'logs'),
+        (re.compile(r'^/repos/([^/]+)/([^/]+)/actions/runs/(\d+)/artifacts$'),
+         'artifacts'),
+        (re.compile(r'^/repos/([^/]+)/([^/]+)/actions/artifacts/(\d+)/zip$'),
+         'artifact_zip'),
+        (re.compile(r'^/blobs/(jobs|artifacts)/(\d+)\.(?:log|zip)$'), 'blob'),
+    ]
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        for regexp, endpoint in self.ROUTES:
+            m = regexp.match(url.path)
+            if m:
+                break
+        else:
+            return self.send_body('unknown', 404, {'message': 'Not Found'})
+
+        if endpoint == 'blob':
+            return self.handle_blob(m.group(1), int(m.group(2)))
+
+        corpus = self.server.corpus
+        if (m.group(1), m.group(2)) != (corpus.owner, corpus.repo):
+            return self.send_body(endpoint, 404, {'message': 'Not Found'})
+
+        if not self.server.spend():
+            return self.send_body(endpoint, 403, {
+                'message': 'API rate limit exceeded'})
+        if self.server.inject(self.server.secondary_limit_rate):
+            retry_after = str(self.server.retry_after)
+            if self.server.retry_after_date:
+                retry_after = email.utils.formatdate(
+                    time.time() + self.server.retry_after, usegmt=True)
+            return self.send_body(endpoint, 403, {
+                'message': 'You have exceeded a secondary rate limit.'},
+                headers={'Retry-After': retry_after})
+        if endpoint == 'logs' and self.server.limit_log():
+            return self.send_body(endpoint, 403, {
+                'message': 'You have exceeded a secondary rate limit.'})
+        if self.server.inject(self.server.error_rate):
+            return self.send_body(endpoint, 502, {'message': 'Server Error'})
+
+        handler = getattr(self, 'handle_' + endpoint)
+        return handler(query, *[int(g) for g in m.groups()[2:]])
+
+    def rate_limit_headers(self):
+        return {
+            'X-RateLimit-Limit': str(self.server.rate_limit),
+            'X-RateLimit-Remaining': str(max(0, self.server.remaining)),
+            'X-RateLimit-Reset': str(self.server.reset),
+            'X-RateLimit-Resource': 'core',
+        }
+
+    def send_body(self, endpoint, status, body, headers=None,
+                  content_type='application/json; charset=utf-8'):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        headers = dict(headers or {})
+        if status != 304:
+            headers['Content-Type'] = content_type
+        headers['Content-Length'] = str(len(body))
+        if not endpoint == 'blob':
+            headers.update(self.rate_limit_headers())
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.stats.account(endpoint, status, len(body))
+
+    def send_json(self, endpoint, body, links=None):
+        """ Send a JSON body with ETag support. """
+        data = json.dumps(body).encode('utf-8')
+        etag = '"{}"'.format(hashlib.sha1(data).hexdigest())
+        headers = {'ETag': etag}
+        if links:
+            headers['Link'] = ', '.join('<{}>; rel="{}"'.format(url, rel)
+                                        for rel, url in links.items())
+        if self.headers.get('If-None-Match') == etag:
+            self.server.refund()
+            return self.send_body(endpoint, 304, b'', headers=headers)
+        return self.send_body(endpoint, 200, data, headers=headers)
+
+    def base_url(self):
+        return 'http://{}'.format(self.headers['Host'])
+
+    def handle_runs(self, query):
+        runs = self.server.corpus.runs
+        if 'branch' in query:
+            runs = [r for r in runs if r['head_branch'] == query['branch']]
+        if 'status' in query:
+            status = query['status']
+            runs = [r for r in runs
+                    if status in (r['status'], r['conclusion'])]
+        if 'created' in query:
+            runs = self.filter_created(runs, query['created'])
+        per_page = min(int(query.get('per_page', 30)), 100)
+        page = int(query.get('page', 1))
+        # GitHub lists at most 1000 results of a search.
+        if len(query.keys() & {'branch', 'status', 'created'}) > 0:
+            runs = runs[:1000]
+        pages = max(1, (len(runs) + per_page - 1) // per_page)
+        body = {
+            'total_count': len(runs),
+            'workflow_runs': runs[(page - 1) * per_page:page * per_page],
+        }
+        links = {}
+        if pages > 1:
+            path = self.base_url() + urlparse(self.path).path
+
+            def page_url(n):
+                return path + '?' + urlencode(dict(query, page=n))
+            if page < pages:
+                links['next'] = page_url(page + 1)
+            links['last'] = page_url(pages)
+        return self.send_json('runs', body, links)
+
+    @staticmethod
+    def filter_created(runs, created):
+        if created.startswith('>='):
+            bound = parse_github_time(created[2:])
+            return [r for r in runs
+                    if parse_github_time(r['created_at']) >= bound]
+        if created.startswith('<='):
+            bound = parse_github_time(created[2:])
+            return [r for r in runs
+                    if parse_github_time(r['created_at']) <= bound]
+        if '..' in created:
+            lower, upper = map(parse_github_time, created.split('..'))
+            return [r for r in runs
+                    if lower <= parse_github_time(r['created_at']) <= upper]
+        raise ValueError('Unsupported created filter: {}'.format(created))
+
+    def handle_run(self, query, run_id):
+        for run in self.server.corpus.runs:
+            if run['id'] == run_id:
+                return self.send_json('run', run)
+        return self.send_body('run', 404, {'message': 'Not Found'})
+
+    def handle_jobs(self, query, run_id):
+        jobs = self.server.corpus.jobs.get(run_id)
+        if jobs is None:
+            return self.send_body('jobs', 404, {'message': 'Not Found'})
+        return self.send_json('jobs', {'total_count': len(jobs),
+                                       'jobs': jobs})
+
+    def handle_logs(self, query, job_id):
+        if self.server.corpus.log(job_id) is None:
+            return self.send_body('logs', 404, {'message': 'Not Found'})
+        location = '{}/blobs/jobs/{}.log'.format(self.base_url(), job_id)
+        return self.send_body('logs', 302, b'', headers={
+            'Location': location})
+
+    def handle_artifacts(self, query, run_id):
+        artifacts = []
+        for artifact in self.server.corpus.artifacts.get(run_id, []):
+            artifact = dict(artifact)
+            artifact['archive_download_url'] = \
+                '{}/repos/{}/{}/actions/artifacts/{}/zip'.format(
+                    self.base_url(), self.server.corpus.owner,
+                    self.server.corpus.repo, artifact['id'])
+            artifacts.append(artifact)
+        return self.send_json('artifacts', {'total_count': len(artifacts),
+                                            'artifacts': artifacts})
+
+    def handle_artifact_zip(self, query, artifact_id):
+        if artifact_id not in self.server.corpus.artifact_blobs:
+            return self.send_body('artifact_zip', 404,
+                                  {'message': 'Not Found'})
+        location = '{}/blobs/artifacts/{}.zip'.format(self.base_url(),
+                                                      artifact_id)
+        return self.send_body('artifact_zip', 302, b'', headers={
+            'Location': location})
+
+    def handle_blob(self, kind, blob_id):
+        if kind == 'artifacts':
+            body = self.server.corpus.artifact_blobs.get(blob_id)
+        else:
+            body = self.server.corpus.log(blob_id)
+        if body is None:
+            return self.send_body('blob', 404, b'BlobNotFound',
+                                  content_type='application/xml')
+        headers = {'Accept-Ranges': 'bytes'}
+        status = 200
+        range_header = self.headers.get('Range')
+        m = range_header and re.match(r'^bytes=(\d*)-(\d*)$', range_header)
+        if m and (m.group(1) or m.group(2)):
+            size = len(body)
+            if m.group(1):
+                start = int(m.group(1))
+                end = int(m.group(2)) if m.group(2) else size - 1
+            else:
+                start = max(0, size - int(m.group(2)))
+                end = size - 1
+            end = min(end, size - 1)
+            if start <= end:
+                headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+                    start, end, size)
+                body = body[start:end + 1]
+                status = 206
+        content_type = 'text/plain'
+        if kind == 'artifacts':
+            content_type = 'application/zip'
+        return self.send_body('blob', status, body, headers=headers,
+                              content_type=content_type)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Offline stand-in for the GitHub Actions API')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--corpus', type=str,
+                        help='fetch.py storage directory (owner/repo) to '
+                             'serve instead of a synthetic corpus')
+    parser.add_argument('--repo-path', type=str,
+                        default='tarantool/tarantool',
+                        help='owner/repository of a synthetic corpus')
+    parser.add_argument('--runs', type=int, default=100)
+    parser.add_argument('--jobs-per-run', type=int, default=10)
+    parser.add_argument('--log-lines', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds to wait before each response')
+    parser.add_argument('--rate-limit', type=int, default=5000)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--secondary-limit-rate', type=float, default=0)
+    args = parser.parse_args()
+
+    if args.corpus:
+        corpus = Corpus.recorded(args.corpus)
+    else:
+        owner, repo = args.repo_path.split('/', 1)
+        corpus = Corpus.synthetic(owner, repo, runs=args.runs,
+                                  jobs_per_run=args.jobs_per_run,
+                                  log_lines=args.log_lines)
+    server = FakeGitHub(corpus, host=args.host, port=args.port,
+                        latency=args.latency, rate_limit=args.rate_limit,
+                        error_rate=args.error_rate,
+                        secondary_limit_rate=args.secondary_limit_rate)
+    print('Serving {} runs of {}/{} on {}'.format(
+        len(corpus.runs), corpus.owner, corpus.repo, server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
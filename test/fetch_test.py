@@ -0,0 +1,271 @@
+import datetime
+import glob
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from multivac.catalog import Catalog
+from multivac.storage import Layout
+from multivac.sensors.job_facts import load_facts
+from multivac.sensors.test_status import get_cache_filepath
+from test.fake_github import Corpus, FakeGitHub, github_time
+
+
+CUR_DIR = os.path.dirname(os.path.abspath(__file__))
+FETCH = os.path.join(os.path.dirname(CUR_DIR), 'multivac', 'fetch.py')
+
+
+class TestFetch(unittest.TestCase):
+    def start_server(self, failure_rate=0.1, **kwargs):
+        self.corpus = Corpus.synthetic(runs=8, jobs_per_run=3, log_lines=50,
+                                       failure_rate=failure_rate)
+        self.repo_path = '{}/{}'.format(self.corpus.owner, self.corpus.repo)
+        self.server = FakeGitHub(self.corpus, retry_after=0, **kwargs)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def fetch_cmd(self, *fetch_args):
+        return [sys.executable, FETCH, '--api-url', self.server.url] + \
+            list(fetch_args) + [self.repo_path]
+
+    def fetch(self, *fetch_args):
+        """ Run fetch.py and return amount of requests it made. """
+        before = self.server.stats.as_dict()['requests']
+        env = dict(os.environ, MULTIVAC_GITHUB_TOKEN='fake')
+        subprocess.run(self.fetch_cmd(*fetch_args), cwd=self.tmp_dir.name,
+                       env=env, check=True, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+        return self.server.stats.as_dict()['requests'] - before
+
+    def check_stored(self):
+        """ All completed runs are stored with their jobs and logs. """
+        storage_dir = os.path.join(self.tmp_dir.name, self.repo_path)
+        layout = Layout(storage_dir)
+        # A new storage is sharded.
+        self.assertTrue(layout.sharded)
+        for run in self.corpus.runs:
+            run_meta_path = os.path.join(storage_dir, 'workflow_runs',
+                                         '{}.json'.format(run['id']))
+            if run['status'] != 'completed':
+                self.assertFalse(os.path.exists(run_meta_path))
+                continue
+            self.assertTrue(os.path.isfile(run_meta_path))
+            for job in self.corpus.jobs[run['id']]:
+                with open(layout.job_meta_path(job['id']), 'r') as f:
+                    self.assertEqual(json.load(f)['id'], job['id'])
+                with open(layout.job_log_path(job['id']), 'rb') as f:
+                    self.assertEqual(f.read(), self.corpus.log(job['id']))
+
+        # The same jobs are in the catalog.
+        catalog = Catalog(storage_dir)
+        self.addCleanup(catalog.close)
+        exp_job_ids = sorted(
+            job['id'] for run in self.corpus.runs
+            if run['status'] == 'completed'
+            for job in self.corpus.jobs[run['id']])
+        job_ids = sorted(job['id'] for job in catalog.jobs(with_log=True))
+        self.assertEqual(job_ids, exp_job_ids)
+
+    def test_crawl(self):
+        self.start_server()
+        self.fetch()
+        self.check_stored()
+
+        # Nothing changed: only the lists are requested again and
+        # they are not modified.
+        requests = self.fetch()
+        self.assertLessEqual(requests, 5)
+        self.check_stored()
+
+    def test_relist(self):
+        self.start_server(failure_rate=0)
+        self.fetch()
+        self.check_stored()
+
+        # The oldest run is restarted and finished between two
+        # crawls: it is out of the --overlap window.
+        run = self.corpus.runs[-1]
+        run['updated_at'] = github_time(
+            datetime.datetime.now(datetime.timezone.utc))
+        # A re-run attempt has new jobs.
+        job = dict(self.corpus.jobs[run['id']][0], id=10 ** 11)
+        self.corpus.jobs[run['id']].append(job)
+        self.corpus.logs[job['id']] = self.corpus.log(
+            self.corpus.jobs[run['id']][0]['id'])
+        storage_dir = os.path.join(self.tmp_dir.name, self.repo_path)
+        job_meta_path = Layout(storage_dir).job_meta_path(job['id'])
+
+        self.fetch('--overlap', '0')
+        self.assertFalse(os.path.exists(job_meta_path))
+
+        # It is caught by the periodic re-listing.
+        self.fetch('--overlap', '0', '--relist-interval', '0')
+        self.check_stored()
+
+        # Nothing changed: the re-listed pages are not modified. The
+        # query is the same in another second.
+        time.sleep(1)
+        before = self.server.stats.as_dict()['statuses']
+        self.fetch('--overlap', '0', '--relist-interval', '0')
+        after = self.server.stats.as_dict()['statuses']
+        self.assertEqual(after.get(200), before.get(200))
+        self.assertGreater(after.get(304), before.get(304))
+
+    def test_ingest(self):
+        self.start_server()
+        self.fetch('--ingest')
+        self.check_stored()
+        storage_dir = os.path.join(self.tmp_dir.name, self.repo_path)
+        for run in self.corpus.runs:
+            if run['status'] != 'completed':
+                continue
+            for job in self.corpus.jobs[run['id']]:
+                log_path = Layout(storage_dir).job_log_path(job['id'])
+                facts = load_facts(log_path)
+                self.assertIsNotNone(facts)
+                self.assertEqual(facts['failure'] is not None,
+                                 job['conclusion'] == 'failure')
+                cache_path = get_cache_filepath(log_path)
+                self.assertTrue(os.path.isfile(cache_path))
+
+    def test_artifacts(self):
+        self.start_server(failure_rate=0.3)
+        # A run with one failed job, which has no artifact, and an
+        # unrelated one.
+        run_id = self.corpus.runs[1]['id']
+        for i, job in enumerate(self.corpus.jobs[run_id]):
+            job['conclusion'] = 'failure' if i == 0 else 'success'
+        self.corpus.artifacts[run_id] = []
+        self.corpus.add_artifact(run_id, 1, 'coverage')
+        # A matrix job and an artifact named after the job key.
+        failed_job = next(
+            job for run in self.corpus.runs[2:]
+            for job in self.corpus.jobs[run['id']]
+            if job['conclusion'] == 'failure')
+        self.corpus.artifacts[failed_job['run_id']] = []
+        self.corpus.add_artifact(failed_job['run_id'], 2, failed_job['name'])
+        failed_job['name'] += ' (debug)'
+        self.fetch('--artifacts')
+        self.check_stored()
+        layout = Layout(os.path.join(self.tmp_dir.name, self.repo_path))
+        self.assertTrue(self.corpus.artifacts)
+        for run in self.corpus.runs:
+            for job in self.corpus.jobs[run['id']]:
+                artifact_path = layout.artifact_path(run['id'], job['id'])
+                if job['conclusion'] != 'failure' or \
+                        run['id'] == run_id or job is failed_job:
+                    self.assertFalse(os.path.exists(artifact_path))
+                    continue
+                with open(artifact_path, 'rb') as f:
+                    self.assertEqual(f.read(), Corpus.EMPTY_ZIP)
+
+    def test_tail(self):
+        for fetch_args in (('--tail-kib', '1'), ('--tail-kib', '1', '--ingest')):
+            with self.subTest(args=fetch_args):
+                self.check_tail(*fetch_args)
+
+    def check_tail(self, *fetch_args):
+        self.start_server(failure_rate=0.3)
+        self.fetch(*fetch_args)
+        ingest = '--ingest' in fetch_args
+        layout = Layout(os.path.join(self.tmp_dir.name, self.repo_path))
+        for run in self.corpus.runs:
+            if run['status'] != 'completed':
+                continue
+            for job in self.corpus.jobs[run['id']]:
+                with open(layout.job_meta_path(job['id']), 'r') as f:
+                    meta = json.load(f)
+                with open(layout.job_log_path(job['id']), 'rb') as f:
+                    log = f.read()
+                full_log = self.corpus.log(job['id'])
+                facts = load_facts(layout.job_log_path(job['id']))
+                if job['conclusion'] == 'failure':
+                    self.assertEqual(log, full_log)
+                    self.assertNotIn('log_offset', meta['multivac'])
+                    if ingest:
+                        self.assertNotEqual(facts['queued_at'], '')
+                    continue
+                # The end of the log from a line start.
+                offset = meta['multivac']['log_offset']
+                self.assertLessEqual(len(log), 1024)
+                self.assertEqual(full_log[offset:], log)
+                self.assertEqual(full_log[offset - 1:offset], b'\n')
+                if not ingest:
+                    self.assertIsNone(facts)
+                    continue
+                # The facts are extracted from the whole log.
+                self.assertNotEqual(facts['queued_at'], '')
+                self.assertEqual(len(facts['tests']), 50)
+
+    def test_retry_after_date(self):
+        self.start_server(secondary_limit_rate=0.05, retry_after_date=True)
+        self.fetch()
+        self.check_stored()
+
+    def test_secondary_limit_body(self):
+        # Only the body of a streamed log download tells about the
+        # limit. The backoff is cut to nothing to keep the test fast.
+        self.start_server(limited_logs=2)
+        driver = ('import random, runpy, sys; '
+                  'random.uniform = lambda a, b: a; '
+                  'sys.argv = sys.argv[1:]; '
+                  'runpy.run_path(sys.argv[0], run_name="__main__")')
+        env = dict(os.environ, MULTIVAC_GITHUB_TOKEN='fake')
+        subprocess.run([sys.executable, '-c', driver] +
+                       self.fetch_cmd()[1:], cwd=self.tmp_dir.name, env=env,
+                       check=True, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+        self.assertEqual(self.server.limited_logs, 0)
+        self.check_stored()
+
+    def test_resume(self):
+        self.start_server(latency=0.05)
+        storage_dir = os.path.join(self.tmp_dir.name, self.repo_path)
+        env = dict(os.environ, MULTIVAC_GITHUB_TOKEN='fake')
+        process = subprocess.Popen(self.fetch_cmd('--workers', '1'),
+                                   cwd=self.tmp_dir.name, env=env,
+                                   stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL)
+        self.addCleanup(process.wait)
+        self.addCleanup(process.kill)
+
+        # Kill the crawl in the middle.
+        runs_pattern = os.path.join(storage_dir, 'workflow_runs', '*.json')
+        deadline = time.time() + 30
+        while not glob.glob(runs_pattern) and time.time() < deadline:
+            time.sleep(0.01)
+        process.send_signal(signal.SIGKILL)
+        process.wait()
+        journal_path = os.path.join(storage_dir, 'journal', 'all.json')
+        self.assertTrue(os.path.isfile(journal_path))
+
+        self.fetch()
+        self.check_stored()
+        self.assertFalse(os.path.exists(journal_path))
+        self.assertEqual(glob.glob(os.path.join(storage_dir, '**', '*.tmp'),
+                                   recursive=True), [])
+
+    def test_temp_files(self):
+        # Left by a killed call, which fetched a branch.
+        self.start_server()
+        storage_dir = os.path.join(self.tmp_dir.name, self.repo_path)
+        tmp_paths = [os.path.join(storage_dir, dirname, 'branches',
+                                  'master.json.1.2.tmp')
+                     for dirname in ('journal', 'checkpoints')]
+        for path in tmp_paths:
+            os.makedirs(os.path.dirname(path))
+            open(path, 'w').close()
+        self.fetch('--branch', 'master')
+        self.check_stored()
+        for path in tmp_paths:
+            self.assertFalse(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
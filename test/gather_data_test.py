@@ -0,0 +1,242 @@
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from multivac.gather_data import ArtifactChecker, ParquetJobsSink
+from multivac.sinks import pyarrow
+from multivac.storage import Layout
+from test.fake_github import Corpus, FakeGitHub
+from test.influxdb_test import FakeInfluxDB
+
+
+CUR_DIR = os.path.dirname(os.path.abspath(__file__))
+MULTIVAC_DIR = os.path.join(os.path.dirname(CUR_DIR), 'multivac')
+LOGS = ['925099517.log', '900598368.log', '3828337083.log', '9224701468.log']
+
+
+class FakeS3Handler(BaseHTTPRequestHandler):
+    def do_HEAD(self):
+        self.server.requests.append(self.path)
+        status = 200 if self.path in self.server.paths else 404
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestArtifactChecker(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeS3Handler)
+        self.server.paths = {'/repo/artifacts/1/11.zip'}
+        self.server.requests = []
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.s3_url = '127.0.0.1:{}/repo'.format(self.server.server_address[1])
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.layout = Layout(tmp_dir.name)
+        patcher = mock.patch('sys.stdout', new_callable=io.StringIO)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_resolve(self):
+        # The artifact of job 21 is stored locally, but it is not
+        # uploaded yet.
+        local_path = self.layout.artifact_path(2, 21)
+        os.makedirs(os.path.dirname(local_path))
+        open(local_path, 'wb').close()
+
+        jobs = [(1, 11), (1, 12), (2, 21)]
+        exp = {
+            11: self.s3_url + '/artifacts/1/11.zip',
+            12: None,
+            21: None,
+        }
+        self.assertEqual(ArtifactChecker(self.layout, self.s3_url)
+                         .resolve(jobs), exp)
+        self.assertEqual(sorted(self.server.requests),
+                         ['/repo/artifacts/1/11.zip',
+                          '/repo/artifacts/1/12.zip',
+                          '/repo/artifacts/2/21.zip'])
+
+        # The results are cached between runs.
+        self.assertEqual(ArtifactChecker(self.layout, self.s3_url)
+                         .resolve(jobs), exp)
+        self.assertEqual(len(self.server.requests), 3)
+
+        # A missing artifact is checked again after a while: say, it is
+        # uploaded by the sync.
+        self.server.paths.add('/repo/artifacts/2/21.zip')
+        exp[21] = self.s3_url + '/artifacts/2/21.zip'
+        with mock.patch.object(ArtifactChecker, 'MISSING_TTL', -1):
+            self.assertEqual(ArtifactChecker(self.layout, self.s3_url)
+                             .resolve(jobs), exp)
+        self.assertEqual(sorted(self.server.requests[3:]),
+                         ['/repo/artifacts/1/12.zip',
+                          '/repo/artifacts/2/21.zip'])
+
+
+def job_data(job_id, started_at, failed_tests=()):
+    """ A job as gathered by GatherData.gather_job(). """
+    data = {
+        'job_id': job_id, 'workflow_run_id': 1, 'job_name': 'release',
+        'os_version': 'ubuntu_20_04', 'branch': 'master',
+        'commit_sha': 'sha', 'conclusion': 'failure',
+        'queued_at': started_at, 'started_at': started_at,
+        'time_in_queue': 0.0, 'completed_at': started_at,
+        'job_duration': 0.0, 'platform': 'amd64',
+        'runner_label': 'ubuntu-20.04', 'gc64': 'False', 'debug': 'False',
+        'html_url': 'https://github.com', 'runner_name': 'runner',
+        'runner_version': '2.0', 'failure_type': 'testrun_test_failed',
+        'compiler_version': 'gcc', 'libc_version': 'glibc',
+    }
+    if failed_tests:
+        data['failed_tests'] = [
+            {'name': name, 'conf': None, 'test_type': 'unit',
+             'test_subtype': None, 'test_attempt': 1}
+            for name in failed_tests]
+    return data
+
+
+@unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+class TestParquetJobsSink(unittest.TestCase):
+    def test_export(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        path = os.path.join(tmp_dir.name, 'parquet')
+        jobs = [job_data(1, '2022-01-01T10:00:00Z', ['a.test', 'b.test']),
+                job_data(2, '2022-01-02T10:00:00Z')]
+        with ParquetJobsSink(path) as sink:
+            for job in jobs:
+                sink.push(job)
+        # The next run exports only new jobs.
+        jobs.append(job_data(3, '2022-01-02T11:00:00Z', ['c.test']))
+        with ParquetJobsSink(path) as sink:
+            for job in jobs:
+                sink.push(job)
+
+        with open(os.path.join(path, 'exported_jobs.json'), 'r') as f:
+            self.assertEqual(json.load(f), [1, 2, 3])
+        self.assertTrue(os.path.isdir(
+            os.path.join(path, 'jobs', 'date=2022-01-02')))
+
+        def read(name):
+            table = pyarrow.dataset.dataset(
+                os.path.join(path, name), format='parquet',
+                partitioning='hive').to_table()
+            return sorted(table.to_pylist(),
+                          key=lambda row: (row['job_id'], row['name'])
+                          if 'name' in row else row['job_id'])
+
+        rows = read('jobs')
+        self.assertEqual([row['job_id'] for row in rows], [1, 2, 3])
+        self.assertEqual([str(row['date']) for row in rows],
+                         ['2022-01-01', '2022-01-02', '2022-01-02'])
+        self.assertEqual(rows[0]['started_at'].isoformat(),
+                         '2022-01-01T10:00:00+00:00')
+        self.assertEqual(rows[0]['failure_type'], 'testrun_test_failed')
+        tests = read('failed_tests')
+        self.assertEqual([(row['job_id'], row['name']) for row in tests],
+                         [(1, 'a.test'), (1, 'b.test'), (3, 'c.test')])
+
+
+class TestGatherData(unittest.TestCase):
+    """ The output is the same whatever amount of processes gathers
+        the jobs.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        corpus = Corpus.synthetic(runs=8, jobs_per_run=4, log_lines=50,
+                                  failure_rate=0.4)
+        # Real logs give tests and failures.
+        for i, job_id in enumerate(sorted(corpus.logs)[::2]):
+            corpus.logs[job_id] = os.path.join(CUR_DIR, 'sensors',
+                                               LOGS[i % len(LOGS)])
+        cls.repo_path = '{}/{}'.format(corpus.owner, corpus.repo)
+        cls.job_ids = sorted(corpus.logs)
+        server = FakeGitHub(corpus, retry_after=0)
+        server.start()
+        try:
+            subprocess.run(
+                [sys.executable, os.path.join(MULTIVAC_DIR, 'fetch.py'),
+                 '--api-url', server.url, cls.repo_path],
+                cwd=cls.tmp_dir.name,
+                env=dict(os.environ, MULTIVAC_GITHUB_TOKEN='fake'),
+                check=True, stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL)
+        finally:
+            server.stop()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def start_server(self, server):
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+    def gather(self, *gather_args, env=None):
+        """ Run gather_data.py, return its output. """
+        res = subprocess.run(
+            [sys.executable, os.path.join(MULTIVAC_DIR, 'gather_data.py'),
+             '--repo-path', self.repo_path, '--since', '3d', '--nocache'] +
+            list(gather_args),
+            cwd=self.tmp_dir.name, env=dict(os.environ, **(env or {})),
+            check=True, capture_output=True, text=True)
+        return res.stdout
+
+    def test_json(self):
+        path = os.path.join(self.tmp_dir.name, 'output', 'workflows.json')
+        res = []
+        for jobs in ('1', '3'):
+            stdout = self.gather('--format', 'json', '-t', '--failure-stats',
+                                 '--jobs', jobs)
+            with open(path, 'r') as f:
+                res.append((f.read(), stdout))
+        self.assertIn('"failed_tests"', res[0][0])
+        self.assertEqual(res[0], res[1])
+
+    def test_influxdb(self):
+        influxdb = FakeInfluxDB()
+        self.start_server(influxdb)
+        s3 = ThreadingHTTPServer(('127.0.0.1', 0), FakeS3Handler)
+        s3.paths = set()
+        s3.requests = []
+        self.start_server(s3)
+        env = {'INFLUX_URL': influxdb.url, 'INFLUX_TOKEN': 'fake',
+               'INFLUX_ORG': 'org'}
+        res = []
+        for jobs in ('1', '3'):
+            # Other buckets: the jobs are not skipped as synced.
+            env.update({'INFLUX_JOB_BUCKET': 'workflows-' + jobs,
+                        'INFLUX_TEST_BUCKET': 'tests-' + jobs,
+                        'INFLUX_TABLE_BUCKET': 'table-' + jobs})
+            influxdb.lines = []
+            self.gather('--format', 'influxdb', '-t', '--jobs', jobs,
+                        '--s3-url',
+                        '127.0.0.1:{}/{{}}'.format(s3.server_address[1]),
+                        env=env)
+            res.append(sorted(influxdb.lines))
+        # Points of jobs, of failed tests and of the table.
+        self.assertGreater(len(res[0]), len(self.job_ids))
+        self.assertTrue(s3.requests)
+        self.assertEqual(res[0], res[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
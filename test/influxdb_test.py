@@ -0,0 +1,106 @@
+import gzip
+import io
+import os
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from multivac.influxdb import InfluxWriter, InfluxWriteError, SyncState
+
+
+class FakeInfluxDB(ThreadingHTTPServer):
+    """ Accepts writes and keeps the written lines. """
+
+    def __init__(self, status=204):
+        self.status = status
+        self.lines = []
+        self.requests = 0
+        super().__init__(('127.0.0.1', 0), FakeInfluxDBHandler)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+
+class FakeInfluxDBHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        self.server.requests += 1
+        if self.server.status == 204:
+            self.server.lines.extend(body.decode().split('\n'))
+        self.send_response(self.server.status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestInfluxWriter(unittest.TestCase):
+    def start_server(self, **kwargs):
+        server = FakeInfluxDB(**kwargs)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        env = {'INFLUX_URL': server.url, 'INFLUX_TOKEN': 'fake',
+               'INFLUX_ORG': 'org'}
+        for patcher in (mock.patch.dict(os.environ, env),
+                        mock.patch('sys.stdout', new_callable=io.StringIO)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        return server
+
+    @staticmethod
+    def point(i):
+        return {'measurement': 'm', 'tags': {'job_id': i},
+                'fields': {'value': 1}, 'time': i}
+
+    def test_write(self):
+        server = self.start_server()
+        with InfluxWriter(batch_size=10, flush_interval=100) as writer:
+            for i in range(25):
+                writer.write('bucket', self.point(i))
+        self.assertEqual(server.requests, 3)
+        self.assertEqual(sorted(server.lines),
+                         sorted('m,job_id={} value=1i {}'.format(i, i)
+                                for i in range(25)))
+
+    def test_error(self):
+        server = self.start_server(status=400)
+        writer = InfluxWriter(batch_size=10, flush_interval=100)
+        writer.write('bucket', self.point(1))
+        with self.assertRaises(InfluxWriteError):
+            writer.close()
+        self.assertEqual(server.requests, 1)
+
+
+class TestSyncState(unittest.TestCase):
+    def test_changed(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'influxdb', 'jobs.json')
+            state = SyncState(path, 'bucket')
+            self.assertTrue(state.changed(1, [{'measurement': 'success'}]))
+            self.assertTrue(state.changed(2, [{'measurement': 'failure'}]))
+            state.save()
+
+            state = SyncState(path, 'bucket')
+            self.assertFalse(state.changed(1, [{'measurement': 'success'}]))
+            self.assertTrue(state.changed(2, [{'measurement': 'hang'}]))
+            self.assertTrue(state.changed(3, [{'measurement': 'success'}]))
+            # Not saved: the points are not written.
+
+            state = SyncState(path, 'bucket')
+            self.assertTrue(state.changed(2, [{'measurement': 'hang'}]))
+            # Another bucket or a full sync.
+            self.assertTrue(SyncState(path, 'other').changed(
+                1, [{'measurement': 'success'}]))
+            self.assertTrue(SyncState(path, 'bucket', full=True).changed(
+                1, [{'measurement': 'success'}]))
+
+
+if __name__ == '__main__':
+    unittest.main()
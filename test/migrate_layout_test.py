@@ -0,0 +1,80 @@
+import json
+import os
+import tempfile
+import unittest
+from multivac.catalog import Catalog
+from multivac.migrate_layout import migrate
+from multivac.storage import Layout
+from test.catalog_test import run_meta, job_meta
+
+
+FILES = [
+    '9224701468.json',
+    '9224701468.log.gz',
+    '9224701468.log.test_status.cache.json',
+    '925099517.json',
+]
+
+
+class TestMigrateLayout(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.repo_path = self.tmp_dir.name
+        self.layout = Layout(self.repo_path)
+        os.makedirs(self.layout.workflow_runs_dir)
+        os.makedirs(self.layout.workflow_run_jobs_dir)
+
+    def test_migrate(self):
+        jobs_dir = self.layout.workflow_run_jobs_dir
+        for name in FILES:
+            job_id = int(name.split('.', 1)[0])
+            data = []
+            if name == '{}.json'.format(job_id):
+                data = job_meta(job_id, 1, 'master', '2022-11-01T12:00:00Z')
+            with open(os.path.join(jobs_dir, name), 'w') as f:
+                json.dump(data, f)
+        with open(self.layout.run_meta_path(1), 'w') as f:
+            json.dump(run_meta(1, 'master'), f)
+        # Left by a killed fetch.py.
+        tmp_name = '925099517.log.42.43.tmp'
+        with open(os.path.join(jobs_dir, tmp_name), 'w') as f:
+            f.write('')
+        # The migration was interrupted.
+        os.makedirs(os.path.join(jobs_dir, '92'))
+        os.rename(os.path.join(jobs_dir, '925099517.json'),
+                  os.path.join(jobs_dir, '92', '925099517.json'))
+        # The catalog refers to the flat layout.
+        catalog = Catalog(self.repo_path)
+        catalog.put_run(run_meta(1, 'master'), [
+            (job_meta(9224701468, 1, 'master', '2022-11-01T12:00:00Z'),
+             'workflow_run_jobs/9224701468.log', None),
+        ])
+        catalog.close()
+
+        self.assertFalse(self.layout.sharded)
+        self.assertEqual(migrate(self.repo_path), 3)
+
+        layout = Layout(self.repo_path)
+        self.assertTrue(layout.sharded)
+        self.assertEqual(layout.job_dirs(), [os.path.join(jobs_dir, '92'),
+                                             os.path.join(jobs_dir, '922')])
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(jobs_dir, '922'))), FILES[:3])
+        self.assertFalse(os.path.exists(os.path.join(jobs_dir, tmp_name)))
+        self.assertEqual(layout.job_meta_path(925099517),
+                         os.path.join(jobs_dir, '92', '925099517.json'))
+        self.assertTrue(os.path.isfile(layout.job_meta_path(925099517)))
+        self.assertEqual(layout.glob_logs(),
+                         [layout.job_log_path(9224701468)])
+
+        # The catalog refers to the moved files.
+        catalog = Catalog(self.repo_path)
+        self.addCleanup(catalog.close)
+        jobs = {job['id']: job for job in catalog.jobs()}
+        self.assertEqual(jobs[9224701468]['log_path'],
+                         'workflow_run_jobs/922/9224701468.log')
+        self.assertIsNone(jobs[925099517]['log_path'])
+
+        # Nothing to do on the second run.
+        self.assertEqual(migrate(self.repo_path), 0)
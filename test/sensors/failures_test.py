@@ -0,0 +1,54 @@
+import os
+import re
+import unittest
+from multivac.sensors.failures import specific_failures, generic_failures, \
+    FailureMatcher, required_literal
+
+
+CUR_DIR = os.path.dirname(os.path.abspath(__file__))
+LOGS = ['925099517.log', '900598368.log', '3828337083.log', '9224701468.log']
+
+
+def match_one_by_one(line, failure_specs):
+    for failure_type in failure_specs:
+        for expression in failure_type['re']:
+            if re.match(expression, line):
+                return failure_type['type']
+    return None
+
+
+class TestFailureMatcher(unittest.TestCase):
+    def test_required_literal(self):
+        self.assertEqual(required_literal(r'.*Test hung!.*'), 'Test hung!')
+        self.assertEqual(required_literal(r'.*- Status code: (404|503) for.*'),
+                         '- Status code: ')
+        self.assertIsNone(required_literal(r'.*(foo|bar).*'))
+        self.assertIsNone(required_literal(r'(?i).*Test hung!.*'))
+
+    def test_same_as_one_by_one(self):
+        lines = [
+            'x - Status code: 503 for y',
+            '[001] * fail: 3 (1.00%)',
+            'Error response from daemon: Head abc EOF',
+            'make[3]: *** foo.c.o] Error 1',
+            'Test hung! Test failed!',
+            'Address already in use',
+        ]
+        for log_basename in LOGS:
+            with open(os.path.join(CUR_DIR, log_basename), 'r',
+                      errors='replace') as f:
+                lines.extend(line.rstrip('\n') for line in f)
+        for failure_specs in (specific_failures, generic_failures):
+            matcher = FailureMatcher(failure_specs)
+            self.assertIsNotNone(matcher.prefilter)
+            for line in lines:
+                self.assertEqual(matcher.match(line),
+                                 match_one_by_one(line, failure_specs), line)
+        # The first matching specification of the list wins.
+        matcher = FailureMatcher([{'type': 'a', 're': [r'.*foo.*']},
+                                  {'type': 'b', 're': [r'.*(bar|baz).*']},
+                                  {'type': 'c', 're': [r'.*foo bar.*']}])
+        self.assertIsNone(matcher.prefilter)
+        self.assertEqual(matcher.match('foo bar'), 'a')
+        self.assertEqual(matcher.match('baz'), 'b')
+        self.assertIsNone(matcher.match('qux'))
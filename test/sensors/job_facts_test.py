@@ -0,0 +1,206 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from multivac import gather_data
+from multivac.gather_data import GatherData, ExtractionCache, detect_error
+from multivac.sensors.failures import specific_failures, generic_failures
+from multivac.sensors.job_facts import COMPILER_RE, RUNNER_VERSION_RE, \
+    FREEBSD_RUNNER_VERSION_RE, JobFactsExtractor, decolor, get_log_datetime
+from multivac.sensors.test_status import test_status_iter
+from multivac.storage import Layout
+
+
+CUR_DIR = os.path.dirname(os.path.abspath(__file__))
+LOGS = ['925099517.log', '900598368.log', '3828337083.log', '9224701468.log']
+
+
+# Line by line detection of the facts, as gather_data.py did before
+# JobFactsExtractor: the expected results.
+
+def get_release_or_debug(lines):
+    for line in lines:
+        if '| Target:' in line and line.endswith('Debug\n'):
+            return 'True'
+    return 'False'
+
+
+def get_runner_version(lines):
+    for line in lines:
+        match = RUNNER_VERSION_RE.search(line)
+        if match:
+            return match.group(1)
+        freebsd_match = FREEBSD_RUNNER_VERSION_RE.search(line)
+        if freebsd_match:
+            return freebsd_match.group(1)
+    return 'unknown_runner_version'
+
+
+def get_compiler_version(lines):
+    compiler = 'undefined_compiler'
+    for line in lines:
+        compiler_match = COMPILER_RE.search(line)
+        if compiler_match:
+            compiler = compiler_match.group(1)
+    return compiler
+
+
+class TestJobFacts(unittest.TestCase):
+    def extract(self, log_filepath, chunk_size):
+        extractor = JobFactsExtractor(detect_failure=True)
+        # Garbage from a failed download attempt.
+        extractor.write(b'garbage\n')
+        extractor.reset()
+        with open(log_filepath, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                extractor.write(chunk)
+        extractor.close()
+        return extractor
+
+    def expected_failure(self, log_filepath):
+        res = {}
+        for kind, failure_specs in (('specific', specific_failures),
+                                    ('generic', generic_failures)):
+            failure_type, line = detect_error(log_filepath, failure_specs)
+            res[kind] = None
+            if failure_type != 'unknown_failure':
+                res[kind] = (failure_type, line)
+        return res
+
+    def expected_test_status_cache(self, raw_lines):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache_filepath = os.path.join(tmp_dir, 'cache.json')
+            list(test_status_iter(raw_lines, cache_filepath))
+            with open(cache_filepath, 'r') as f:
+                return json.load(f)
+
+    def check_log(self, log_basename):
+        """ The facts are the same as gathered from the stored log. """
+        log_filepath = os.path.join(CUR_DIR, log_basename)
+        with open(log_filepath, 'r') as f:
+            raw_lines = list(f)
+        lines = list(map(decolor, raw_lines))
+
+        for chunk_size in (7, 64 * 1024):
+            extractor = self.extract(log_filepath, chunk_size)
+            facts = extractor.facts
+            self.assertEqual(facts['queued_at'], get_log_datetime(lines[0]))
+            self.assertEqual(facts['tests'], list(test_status_iter(lines)))
+            self.assertEqual(facts['debug'],
+                             get_release_or_debug(lines))
+            self.assertEqual(facts['runner_version'],
+                             get_runner_version(lines))
+            self.assertEqual(facts['compiler_version'],
+                             get_compiler_version(lines))
+            self.assertEqual(facts['failure'],
+                             self.expected_failure(log_filepath))
+            self.assertEqual(
+                json.loads(json.dumps(extractor.test_status_cache)),
+                self.expected_test_status_cache(raw_lines))
+
+        # One scan for both lists finds the same as two scans.
+        failure = facts['failure']['specific'] or \
+            facts['failure']['generic'] or ('unknown_failure', None)
+        self.assertEqual(detect_error(log_filepath, specific_failures,
+                                      generic_failures), tuple(failure))
+
+    def test_logs(self):
+        for log_basename in LOGS:
+            with self.subTest(log=log_basename):
+                self.check_log(log_basename)
+
+    def test_extraction_cache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_path = os.path.join(tmp_dir, 'job.log')
+            with open(log_path, 'w') as f:
+                f.write('line\n')
+            cache = ExtractionCache(Layout(tmp_dir), None)
+            log_key = cache.log_key(log_path)
+            entry = cache.load(1, log_key)
+            self.assertIsNone(cache.facts(entry))
+            self.assertIsNone(cache.failure(entry))
+            cache.put_facts(entry, {'tests': []})
+            cache.put_failure(entry, ('unknown_failure', None))
+            cache.store(1, entry)
+
+            entry = cache.load(1, log_key)
+            self.assertEqual(cache.facts(entry), {'tests': []})
+            self.assertEqual(cache.failure(entry), ('unknown_failure', None))
+            # Another window of the failure scan.
+            other = ExtractionCache(Layout(tmp_dir), 1024)
+            self.assertIsNone(other.failure(other.load(1, log_key)))
+            # Another log.
+            with open(log_path, 'a') as f:
+                f.write('more\n')
+            entry = cache.load(1, cache.log_key(log_path))
+            self.assertIsNone(cache.facts(entry))
+
+    def test_extraction_cache_spec_change(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        layout = Layout(tmp_dir.name)
+        jobs = []
+        for job_id, conclusion in ((1, 'success'), (2, 'failure')):
+            log_path = layout.job_log_path(job_id)
+            os.makedirs(os.path.dirname(log_path), exist_ok=True)
+            shutil.copy(os.path.join(CUR_DIR, LOGS[0]), log_path)
+            jobs.append({
+                'id': job_id, 'run_id': 1, 'name': 'release',
+                'head_branch': 'master', 'head_sha': 'sha',
+                'conclusion': conclusion,
+                'started_at': '2021-06-01T00:00:00Z',
+                'completed_at': '2021-06-01T00:10:00Z',
+                'labels': ['ubuntu-20.04'], 'runner_name': 'runner',
+                'html_url': 'https://github.com',
+            })
+        job_ids = {layout.job_log_path(job['id']): job['id'] for job in jobs}
+        cli_args = argparse.Namespace(
+            repo_path=tmp_dir.name, latest=None, watch_failure=None,
+            tests=False, full_sync=False, jobs=1, failure_scan_kib=None,
+            nocache=False, since=None, format='json', s3_url='s3/{}')
+
+        def gather():
+            """ Gather the jobs by a new GatherData. Return IDs of jobs,
+                whose logs are read for the facts and for the failure
+                and whose cache entries are stored.
+            """
+            gather_data.init_worker(cli_args)
+            gatherer = gather_data.worker_gatherer
+            calls = {'facts': [], 'failure': [], 'store': []}
+            detect = gather_data.detect_failure_type
+
+            def extract_facts(job, log_path):
+                calls['facts'].append(job['id'])
+                return GatherData.extract_facts(job, log_path)
+
+            def detect_failure_type(logs, facts, window):
+                calls['failure'].append(job_ids[logs])
+                return detect(logs, facts, window)
+
+            def store(job_id, entry):
+                calls['store'].append(job_id)
+                ExtractionCache.store(gatherer.cache, job_id, entry)
+
+            with mock.patch.object(gatherer, 'extract_facts', extract_facts), \
+                    mock.patch.object(gatherer.cache, 'store', store), \
+                    mock.patch('multivac.gather_data.detect_failure_type',
+                               detect_failure_type):
+                for job in jobs:
+                    gatherer.gather_job(job)
+            return calls
+
+        self.assertEqual(gather(), {'facts': [1, 2], 'failure': [2],
+                                    'store': [1, 2]})
+        # Nothing is changed: nothing is read or written.
+        self.assertEqual(gather(), {'facts': [], 'failure': [], 'store': []})
+        # The failure specifications are changed: only the failed job
+        # is scanned again.
+        with mock.patch('multivac.gather_data.FAILURES_VERSION', 'new'):
+            self.assertEqual(gather(), {'facts': [], 'failure': [2],
+                                        'store': [2]})
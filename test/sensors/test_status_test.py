@@ -1,4 +1,9 @@
+import gzip
 import os
+import shutil
+import subprocess
+import sys
+import tempfile
 import unittest
 import yaml
 from multivac.sensors.test_status import test_status_iter
@@ -78,6 +83,27 @@ class TestStatus(unittest.TestCase):
     def test_smart_status_colored(self):
         self.check_test_smart_status_iter('9224701468.log')
 
+    def test_command_line(self):
+        # Run from another directory, the log is compressed.
+        log_basename = '900598368.log'
+        with open(os.path.join(CUR_DIR, '{}.smart.yaml'.format(
+                log_basename)), 'r') as f:
+            exp = yaml.safe_load(f)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_filepath = os.path.join(tmp_dir, log_basename)
+            with open(os.path.join(CUR_DIR, log_basename), 'rb') as src, \
+                    gzip.open(log_filepath + '.gz', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            script = os.path.join(os.path.dirname(os.path.dirname(CUR_DIR)),
+                                  'multivac', 'sensors', 'test_status.py')
+            res = subprocess.run([sys.executable, script, log_filepath],
+                                 cwd=tmp_dir, check=True,
+                                 capture_output=True, text=True)
+        self.assertEqual(res.stdout.splitlines(), [
+            'event: test status; test: {}; conf: {}; status: {}'.format(
+                test, conf or 'null', status)
+            for test, conf, status in exp])
+
 
 if __name__ == '__main__':
     unittest.main()
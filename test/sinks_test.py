@@ -0,0 +1,86 @@
+import csv
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from multivac.sinks import JSONSink, NDJSONSink, CSVSink, ParquetSink, \
+    pyarrow
+
+
+RECORDS = [
+    {'job_id': 2, 'name': 'job "2"\n', 'tests': [{'name': 'a'}, {}],
+     'empty': {}},
+    {'job_id': 1, 'name': 'job 1', 'tests': []},
+]
+
+
+class TestSinks(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = tmp_dir.name
+
+    def write(self, sink, records):
+        with sink:
+            for record in records:
+                sink.push(record)
+        with open(sink.file.name, 'r') as f:
+            return f.read()
+
+    def test_json(self):
+        for records in (RECORDS, RECORDS[:1], []):
+            with self.subTest(records=len(records)):
+                path = os.path.join(self.tmp_dir, 'out', 'data.json')
+                exp = json.dumps({record['job_id']: record
+                                  for record in records}, indent=2)
+                self.assertEqual(self.write(JSONSink(path, 'job_id'),
+                                            records), exp)
+
+    def test_ndjson(self):
+        path = os.path.join(self.tmp_dir, 'data.ndjson')
+        lines = self.write(NDJSONSink(path), RECORDS).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], RECORDS)
+
+    def test_csv(self):
+        path = os.path.join(self.tmp_dir, 'data.csv')
+        data = self.write(CSVSink(path, ['job_id', 'name']), RECORDS)
+        rows = list(csv.DictReader(data.splitlines(keepends=True)))
+        self.assertEqual(rows, [{'job_id': str(record['job_id']),
+                                 'name': record['name']}
+                                for record in RECORDS])
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_parquet(self):
+        path = os.path.join(self.tmp_dir, 'dataset')
+        columns = [('job_id', 'int'), ('name', 'category'),
+                   ('started_at', 'timestamp'), ('date', 'category')]
+        started_at = datetime(2022, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+        rows = [{'job_id': i, 'name': 'job {}'.format(i % 2),
+                 'started_at': started_at, 'date': '2022-01-0{}'.format(i)}
+                for i in range(1, 4)]
+        # Two runs append to the dataset.
+        for run_rows in (rows[:2], rows[2:]):
+            with ParquetSink(path, columns, ['date'], max_rows=1) as sink:
+                for row in run_rows:
+                    sink.push(row)
+        self.assertTrue(os.path.isdir(os.path.join(path, 'date=2022-01-03')))
+        table = pyarrow.dataset.dataset(path, format='parquet',
+                                        partitioning='hive').to_table()
+        self.assertTrue(pyarrow.types.is_dictionary(
+            table.schema.field('name').type))
+        data = sorted(table.to_pylist(), key=lambda row: row['job_id'])
+        self.assertEqual([row['job_id'] for row in data], [1, 2, 3])
+        self.assertEqual([row['name'] for row in data],
+                         ['job 1', 'job 0', 'job 1'])
+        self.assertEqual(str(data[2]['date']), '2022-01-03')
+
+    @unittest.skipIf(pyarrow is not None, 'pyarrow is installed')
+    def test_parquet_unavailable(self):
+        path = os.path.join(self.tmp_dir, 'dataset')
+        with self.assertRaises(RuntimeError):
+            ParquetSink(path, [('job_id', 'int')], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from multivac import storage
+
+
+LOG = 'line 1\nline 2\n'
+
+
+class TestStorage(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.log_path = os.path.join(self.tmp_dir.name, '42.log')
+
+    def write_log(self, compression):
+        path = storage.compressed_path(self.log_path, compression)
+        with storage.open_log_writer(path, compression) as f:
+            f.write(LOG.encode('utf-8'))
+        return path
+
+    def check_read(self, compression):
+        path = self.write_log(compression)
+        self.assertEqual(storage.find_log(self.log_path), path)
+        self.assertEqual(storage.glob_logs(self.tmp_dir.name),
+                         [self.log_path])
+        with storage.open_log(self.log_path, 'r') as f:
+            self.assertEqual(list(f), ['line 1\n', 'line 2\n'])
+        with storage.seekable_log(self.log_path) as seekable_path:
+            with open(seekable_path, 'r') as f:
+                f.seek(7)
+                self.assertEqual(f.read(), 'line 2\n')
+        self.assertEqual(list(storage.reverse_lines(self.log_path)),
+                         [b'line 2', b'line 1'])
+
+    def test_plain(self):
+        self.check_read(None)
+
+    def test_gzip(self):
+        self.check_read('gzip')
+
+    @unittest.skipIf(storage.zstandard is None, 'zstandard is not installed')
+    def test_zstd(self):
+        self.check_read('zstd')
+
+    def test_reverse_lines(self):
+        data = b'\xff\xfebad\n\nfirst\r\nsecond\rthird\n\nlast'
+        for compression in (None, 'gzip', 'zstd'):
+            if compression == 'zstd' and storage.zstandard is None:
+                continue
+            path = storage.compressed_path(self.log_path, compression)
+            with storage.open_log_writer(path, compression) as f:
+                f.write(data)
+            with self.subTest(compression=compression), \
+                    mock.patch.object(storage, 'TAIL_CHUNK_SIZE', 5):
+                self.check_reverse_lines(compression)
+            os.remove(path)
+
+    def check_reverse_lines(self, compression):
+        def lines(window=None):
+            return list(storage.reverse_lines(self.log_path, window))
+
+        self.assertEqual(lines(), [b'last', b'third', b'second', b'first',
+                                   b'\xff\xfebad'])
+        # The partial first line of the window is skipped.
+        self.assertEqual(lines(window=12), [b'last'])
+        self.assertEqual(lines(window=19), [b'last', b'third', b'second'])
+        self.assertEqual(lines(window=25), [b'last', b'third', b'second',
+                                            b'first'])
+        self.assertEqual(lines(window=2), [])
+        # A compressed log is not decompressed to a file for a window.
+        with mock.patch.object(storage, 'seekable_log',
+                               wraps=storage.seekable_log) as seekable_log:
+            lines(window=12)
+        self.assertEqual(seekable_log.called, compression is None)
+
+    def test_reverse_lines_empty(self):
+        with open(self.log_path, 'wb'):
+            pass
+        self.assertEqual(list(storage.reverse_lines(self.log_path)), [])
+        self.assertEqual(list(storage.reverse_lines(self.log_path, 2)), [])
+
+    def test_missing(self):
+        self.assertIsNone(storage.find_log(self.log_path))
+        with self.assertRaises(FileNotFoundError):
+            storage.open_log(self.log_path)
+
+
+if __name__ == '__main__':
+    unittest.main()